@@ -0,0 +1,34 @@
+import pytest
+
+from db.data import Data
+
+engines = ["pandas", "numpy"]
+
+
+@pytest.mark.parametrize("fetch", engines)
+def test_query_overhead(benchmark, fetch):
+    data = Data(fetch=fetch)
+
+    def query_days():
+        for _ in range(100):
+            days = data.df_from_sql(
+                "SELECT day, open FROM marketdays ORDER BY day DESC LIMIT 5;",
+                params={},
+                index_col="day",
+                parse_dates=["day"],
+            )
+        return days
+
+    assert len(benchmark(query_days)) == 5
+
+
+@pytest.mark.parametrize("fetch", engines)
+def test_query_prices(benchmark, fetch):
+    prices = benchmark(
+        Data(fetch=fetch).df_from_sql,
+        "SELECT ticker, day, close FROM assetprices;",
+        params={},
+        index_col=None,
+        parse_dates=["day"],
+    )
+    assert len(prices) > 0
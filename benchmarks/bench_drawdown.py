@@ -0,0 +1,8 @@
+from benchmarks.drawdown import simulated_returns
+from util.drawdown import drawdowns
+
+
+def test_drawdowns(benchmark):
+    returns, days = simulated_returns(1_000_000)
+    values, _ = benchmark(drawdowns, returns, days)
+    assert len(values["current_drawdown"]) == len(returns)
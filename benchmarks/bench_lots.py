@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from util.lots import cost_basis
+
+
+def simulated_ledger(trades, keys=2_000, seed=0):
+    """Return a ledger of random buys and sales over `keys` accounts and tickers."""
+    rng = np.random.default_rng(seed)
+    units = rng.uniform(1, 100, trades).round(2)
+    return (
+        rng.integers(0, keys, trades),
+        np.datetime64("2000-01-03") + rng.integers(0, 9_000, trades),
+        rng.choice(["buy", "sale", "dividend"], trades, p=[0.5, 0.3, 0.2]),
+        units,
+        (units * rng.uniform(5, 200, trades)).round(2),
+    )
+
+
+@pytest.mark.parametrize("method", ["acb", "fifo"])
+def test_cost_basis(benchmark, method):
+    ledger = simulated_ledger(500_000)
+    booked = benchmark(cost_basis, *ledger, method=method)
+    assert len(booked["cost"]) == len(ledger[0])
@@ -0,0 +1,64 @@
+from components.positions import Positions
+from components.tickers import Tickers
+from portfolio import Portfolio
+from snapshot import snapshot
+from util.price_updater import PriceUpdater
+
+
+def test_tickers(benchmark):
+    tickers = benchmark(Tickers)
+    assert len(tickers.ticker_names) > 0
+
+
+def test_positions(benchmark):
+    tickers = Tickers()
+    positions = benchmark(Positions, tickers=tickers)
+    assert positions.ticker_names == tickers.ticker_names
+
+
+def test_positions_materialized(benchmark):
+    tickers = Tickers()
+    positions = benchmark(Positions, tickers=tickers, materialized=True)
+    assert positions.ticker_names == tickers.ticker_names
+
+
+def test_portfolio(benchmark):
+    portfolio = benchmark(Portfolio, update=False)
+    assert portfolio.latest()["total_value"] > 0
+
+
+def test_portfolio_by_day(benchmark):
+    by_day = benchmark(lambda: Portfolio(update=False).by_day)
+    assert not by_day.empty
+
+
+def test_portfolio_in_threads(benchmark):
+    portfolio = benchmark(Portfolio, update=False, workers=4)
+    assert portfolio.latest()["total_value"] > 0
+
+
+def test_snapshot(benchmark):
+    report = benchmark(
+        snapshot,
+        {
+            "--accounts": None,
+            "--update": False,
+            "--verbose": False,
+            "--positions": True,
+            "--recent": True,
+            "--months": True,
+            "--years": True,
+        },
+    )
+    assert report[0] == "Portfolio Snapshot"
+
+
+def test_price_updater(benchmark, chart_server):
+    def update():
+        updater = PriceUpdater()
+        updater.scraper.base_url = chart_server.url
+        updater.update()
+        return updater
+
+    updater = benchmark(update)
+    assert not updater.scraper.failures
@@ -0,0 +1,44 @@
+import json
+
+from docopt import docopt
+
+
+usage = """
+Compare two benchmark result files, as written by the benchmark cases.
+
+Usage:
+    compare.py [-h] [-t <ratio>] <before> <after>
+
+Options:
+    -h --help                       Show this
+    -t <ratio> --threshold <ratio>  Slowdown reported as a regression [default: 1.1]
+"""
+
+
+def compare(before, after, threshold=1.1):
+    """Return report lines comparing the median times of the benchmarks in both results."""
+    medians = {b["name"]: b["median"] for b in before["benchmarks"]}
+    rep = [
+        f'{before["commit"]} -> {after["commit"]}',
+        f'{"Benchmark":40}{"Before (s)":>12}{"After (s)":>12}{"Ratio":>8}',
+    ]
+    for result in after["benchmarks"]:
+        name = result["name"]
+        if name not in medians:
+            rep.append(f'{name:40}{"-":>12}{result["median"]:12.4f}{"new":>8}')
+            continue
+        ratio = result["median"] / medians[name]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        rep.append(
+            f'{name:40}{medians[name]:12.4f}{result["median"]:12.4f}{ratio:8.2f}{flag}'
+        )
+    return rep
+
+
+if __name__ == "__main__":
+    args = docopt(usage, argv=None, help=True, options_first=False)
+    with open(args["<before>"]) as f:
+        before = json.load(f)
+    with open(args["<after>"]) as f:
+        after = json.load(f)
+    print("\n".join(compare(before, after, float(args["--threshold"]))))
@@ -0,0 +1,156 @@
+"""Benchmark cases over a synthetic portfolio.
+
+Benchmark cases live in `bench_*.py` files, which the test suite does not collect.
+Run them with:
+
+    python -m pytest benchmarks -o python_files="bench_*.py" [--bench-json <path>]
+
+Each case times a call with the `benchmark` fixture. Results are printed at the end of
+the run, and written as JSON (by default to `benchmarks/results/<commit>.json`) to be
+compared across commits with `python -m benchmarks.compare`.
+"""
+
+import json
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+from time import perf_counter
+
+import pytest
+
+import config
+from benchmarks.synthetic import generate
+from db import db
+
+# Results of the benchmarks run in this session, in order
+_results = []
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--bench-accounts", type=int, default=5, help="Synthetic accounts")
+    group.addoption("--bench-tickers", type=int, default=20, help="Synthetic tickers")
+    group.addoption("--bench-years", type=int, default=5, help="Synthetic years")
+    group.addoption("--bench-seed", type=int, default=0, help="Synthetic data seed")
+    group.addoption(
+        "--bench-epoch-days",
+        action="store_true",
+        help="Store the synthetic days as epoch-day numbers",
+    )
+    group.addoption("--bench-rounds", type=int, default=5, help="Rounds per case")
+    group.addoption("--bench-json", default=None, help="Path to write results to")
+
+
+@pytest.fixture(scope="session")
+def synthetic_sizes(request):
+    return {
+        "accounts": request.config.getoption("--bench-accounts"),
+        "tickers": request.config.getoption("--bench-tickers"),
+        "years": request.config.getoption("--bench-years"),
+        "seed": request.config.getoption("--bench-seed"),
+    }
+
+
+@pytest.fixture(scope="session")
+def synthetic_database(request, tmp_path_factory, synthetic_sizes):
+    """Path to a database file filled with a synthetic portfolio, once per run."""
+    path = tmp_path_factory.mktemp("benchmarks") / "finance.db"
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(config.db, "test", {"type": "sqlite", "path": str(path)})
+        db.connect("test")
+        generate(**synthetic_sizes)
+        if request.config.getoption("--bench-epoch-days"):
+            db.migrate_to_epoch_days()
+        db.conn.close()
+        db.engine.dispose()
+    return path
+
+
+@pytest.fixture(autouse=True)
+def setup_test_database(synthetic_database, monkeypatch):
+    """Connect every case to the synthetic database, instead of an empty one in memory."""
+    monkeypatch.setitem(
+        config.db, "test", {"type": "sqlite", "path": str(synthetic_database)}
+    )
+    db.connect("test")
+
+    yield
+
+    db.conn.close()
+    db.engine.dispose()
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    """Print the results of the benchmarks run, and write them as JSON."""
+    if not _results:
+        return
+    commit = _commit()
+    path = config.getoption("--bench-json")
+    if path is None:
+        path = Path(__file__).parent / "results" / f"{commit}.json"
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "machine": platform.platform(),
+                "python": platform.python_version(),
+                "synthetic": {
+                    name: config.getoption(f"--bench-{name.replace('_', '-')}")
+                    for name in ["accounts", "tickers", "years", "seed", "epoch_days"]
+                },
+                "benchmarks": _results,
+            },
+            f,
+            indent=2,
+        )
+
+    terminalreporter.write_sep("-", "benchmarks")
+    terminalreporter.write_line(f'{"Benchmark":40}{"Min (s)":>10}{"Median (s)":>12}')
+    for result in _results:
+        terminalreporter.write_line(
+            f'{result["name"]:40}{result["min"]:10.4f}{result["median"]:12.4f}'
+        )
+    terminalreporter.write_line(f"Results written to {path}")
+
+
+@pytest.fixture
+def benchmark(request):
+    """Time a call over several rounds, record its statistics, and return its result."""
+    rounds = request.config.getoption("--bench-rounds")
+
+    def run(fn, *args, **kwargs):
+        timings = []
+        for _ in range(rounds):
+            start = perf_counter()
+            result = fn(*args, **kwargs)
+            timings.append(perf_counter() - start)
+        _results.append(
+            {
+                "name": request.node.name,
+                "rounds": rounds,
+                "min": min(timings),
+                "max": max(timings),
+                "mean": statistics.mean(timings),
+                "median": statistics.median(timings),
+                "stddev": statistics.stdev(timings) if rounds > 1 else 0.0,
+            }
+        )
+        return result
+
+    return run
+
+
+def _commit():
+    """Return the short hash of the checked out commit, or `unknown` outside of git."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
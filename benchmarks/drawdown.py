@@ -0,0 +1,55 @@
+from time import perf_counter
+
+from docopt import docopt
+import numpy as np
+import pandas as pd
+
+from util.drawdown import drawdowns
+
+
+usage = """
+Time the drawdown kernel over simulated return series of increasing length.
+
+Usage:
+    drawdown.py [-h] [-n <rows>] [-r <runs>] [-s <seed>]
+
+Options:
+    -h --help                Show this
+    -n <rows> --rows <rows>  Length of the longest series [default: 10000000]
+    -r <runs> --runs <runs>  Runs per series length, the best one is reported [default: 3]
+    -s <seed> --seed <seed>  Seed of the simulated returns [default: 0]
+"""
+
+
+def simulated_returns(rows, seed=0):
+    """Return cumulative returns of a random walk, one row per minute."""
+    rng = np.random.default_rng(seed)
+    growth = np.cumprod(1 + rng.normal(0.0, 0.001, rows))
+    days = pd.date_range("2000-01-01", periods=rows, freq="min")
+    return growth - 1, days
+
+
+def benchmark(rows, runs=3, seed=0):
+    """Return the best time, in seconds, to compute the drawdowns of a series of `rows`."""
+    returns, days = simulated_returns(rows, seed)
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        drawdowns(returns, days)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def main(args):
+    longest = int(args["--rows"])
+    rows = [longest // 1000, longest // 100, longest // 10, longest]
+    rep = [f'{"Rows":>12}   {"Seconds":>9}   {"ns/row":>7}']
+    for n in rows:
+        seconds = benchmark(n, int(args["--runs"]), int(args["--seed"]))
+        rep.append(f"{n:12,}   {seconds:9.4f}   {seconds / n * 1e9:7.1f}")
+    return rep
+
+
+if __name__ == "__main__":
+    args = docopt(usage, argv=None, help=True, options_first=False)
+    print("\n".join(main(args)))
@@ -0,0 +1,66 @@
+from time import perf_counter
+
+from docopt import docopt
+
+import config
+from db import db
+from snapshot import snapshot
+
+
+usage = """
+Time cold and warm snapshots of a portfolio database, for each connection profile.
+
+The cold run is the first snapshot on a new connection, with empty page cache and
+memory map (the operating system's file cache is not dropped). Warm runs repeat the
+snapshot on the same connection.
+
+Usage:
+    snapshot.py [-h] [-e <env>] [-p <profiles>] [-r <runs>]
+
+Options:
+    -h --help                            Show this
+    -e <env> --env <env>                 Database environment to read [default: prod]
+    -p <profiles> --profiles <profiles>  Comma-separated connection profiles to compare.
+                                         All profiles in `config.db_profiles`, if omitted
+    -r <runs> --runs <runs>              Warm runs per profile, the best one is reported [default: 5]
+"""
+
+snapshot_args = {
+    "--accounts": None,
+    "--update": False,
+    "--verbose": False,
+    "--positions": True,
+    "--recent": True,
+    "--months": True,
+    "--years": True,
+}
+
+
+def timed_snapshot():
+    """Return the time, in seconds, to produce a full snapshot."""
+    start = perf_counter()
+    snapshot(snapshot_args)
+    return perf_counter() - start
+
+
+def benchmark(env, profile, runs=5):
+    """Return the cold and best warm snapshot times, in seconds, on a connection profile."""
+    db.connect(env, profile)
+    cold = timed_snapshot()
+    warm = min(timed_snapshot() for _ in range(runs))
+    return cold, warm
+
+
+def main(args):
+    profiles = args["--profiles"]
+    profiles = list(config.db_profiles) if profiles is None else profiles.split(",")
+    rep = [f'{"Profile":<12}   {"Cold (s)":>9}   {"Warm (s)":>9}']
+    for profile in profiles:
+        cold, warm = benchmark(args["--env"], profile, int(args["--runs"]))
+        rep.append(f"{profile:<12}   {cold:9.4f}   {warm:9.4f}")
+    return rep
+
+
+if __name__ == "__main__":
+    args = docopt(usage, argv=None, help=True, options_first=False)
+    print("\n".join(main(args)))
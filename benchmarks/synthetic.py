@@ -0,0 +1,191 @@
+from datetime import date, timedelta
+
+from docopt import docopt
+import numpy as np
+import pandas as pd
+
+from db import db
+from db import holdings
+
+
+usage = """
+Fill a database with a seeded synthetic portfolio, for benchmarking.
+
+The database schema is created if needed, and must not hold any data yet.
+
+Usage:
+    synthetic.py [-h] [-e <env>] [-a <accounts>] [-t <tickers>] [-y <years>] [-s <seed>]
+
+Options:
+    -h --help                            Show this
+    -e <env> --env <env>                 Database environment to fill [default: bench]
+    -a <accounts> --accounts <accounts>  Number of accounts [default: 10]
+    -t <tickers> --tickers <tickers>     Number of tickers [default: 30]
+    -y <years> --years <years>           Years of market days, up to today [default: 10]
+    -s <seed> --seed <seed>              Seed of the generated data [default: 0]
+"""
+
+account_types = [("RRSP", "deferred"), ("TFSA", "free"), ("Margin", "taxable")]
+commission = 9.99
+distribution_every = 63  # market days, about a quarter
+
+
+def generate(accounts=10, tickers=30, years=10, seed=0, end=None):
+    """Fill the connected database with a synthetic portfolio.
+
+    Every account is opened on the first day, gets a deposit on the first market day of
+    each month, and spends most of it on one to three tickers. Prices follow random walks,
+    and every ticker pays a distribution each quarter, received as a dividend by the
+    accounts holding it. Transactions are loaded with the holdings triggers dropped, and
+    the materialized daily holdings rebuilt once at the end.
+
+    Keyword arguments:
+    accounts -- number of accounts, alternating between account types and split between
+                two investors
+    tickers -- number of tickers
+    years -- years of market days, up to `end`
+    seed -- seed of the generated data
+    end -- last day of the data. Today, if None
+
+    Returns:
+    dict -- number of rows inserted, keyed by table name
+    """
+    rng = np.random.default_rng(seed)
+    end = date.today() if end is None else end
+    days = pd.date_range(end - timedelta(days=round(365.25 * years)), end, freq="D")
+    open_days = days[days.dayofweek < 5]
+    account_names = [f"ACCT{i + 1:03}" for i in range(accounts)]
+    ticker_names = [f"TKR{i + 1:03}.TO" for i in range(tickers)]
+
+    prices = _prices(rng, len(open_days), tickers)
+    distributions = _distributions(rng, prices)
+    transactions = _transactions(
+        rng, account_names, ticker_names, open_days, prices, distributions
+    )
+
+    rows = {
+        "accountTypes": [(name, tax, 0) for name, tax in account_types],
+        "investors": [("Investor A",), ("Investor B",)],
+        "accounts": [
+            (
+                name,
+                account_types[i % len(account_types)][0],
+                "Investor A" if i % 2 == 0 else "Investor B",
+                _iso(days[0]),
+            )
+            for i, name in enumerate(account_names)
+        ],
+        "assetClasses": [("Cash", 1), ("Domestic Equity", 1)],
+        "assets": [("Cash", "Cash")] + [(t, "Domestic Equity") for t in ticker_names],
+        "marketDays": [(_iso(day), int(day.dayofweek < 5)) for day in days],
+        "assetPrices": [
+            (ticker, _iso(open_days[d]), round(float(prices[d, t]), 2))
+            for t, ticker in enumerate(ticker_names)
+            for d in range(len(open_days))
+        ],
+        "distributions": [
+            (ticker_names[t], _iso(open_days[d]), float(distributions[d, t]))
+            for d, t in zip(*np.nonzero(distributions))
+        ],
+        "transactions": transactions,
+    }
+
+    db.migrate()
+    with db.transaction() as conn:
+        conn.exec_driver_sql("DROP TRIGGER holdings_on_transaction;")
+        conn.exec_driver_sql("DROP TRIGGER holdings_on_market_day;")
+        for table, values in rows.items():
+            placeholders = ", ".join(["?"] * len(values[0]))
+            columns = _columns.get(table)
+            conn.exec_driver_sql(
+                f"INSERT INTO {table} {columns or ''} VALUES ({placeholders});", values
+            )
+    db.migrate()
+    holdings.rebuild_from()
+    return {table: len(values) for table, values in rows.items()}
+
+
+_columns = {
+    "accounts": "(name, accountType, investor, dateCreated)",
+    "assetPrices": "(ticker, day, close)",
+    "distributions": "(ticker, day, amount)",
+    "transactions": (
+        "(day, txType, account, source, target, units, unitPrice, commission, total)"
+    ),
+}
+
+
+def _prices(rng, days, tickers):
+    """Return days-by-tickers closing prices, following geometric random walks."""
+    start = rng.uniform(10.0, 100.0, tickers)
+    drift = rng.normal(0.0003, 0.0002, tickers)
+    volatility = rng.uniform(0.005, 0.02, tickers)
+    growth = np.exp(np.cumsum(rng.normal(drift, volatility, (days, tickers)), axis=0))
+    return np.round(start * growth, 2)
+
+
+def _distributions(rng, prices):
+    """Return days-by-tickers per-unit distributions, paid once a quarter by every ticker."""
+    distributions = np.zeros_like(prices)
+    offsets = rng.integers(0, distribution_every, prices.shape[1])
+    for t, offset in enumerate(offsets):
+        paid = np.arange(offset, len(prices), distribution_every)
+        distributions[paid, t] = np.round(prices[paid, t] * rng.uniform(0.002, 0.01), 4)
+    return distributions
+
+
+def _transactions(rng, accounts, tickers, open_days, prices, distributions):
+    """Return the deposits, buys and dividends of all accounts, as transaction rows."""
+    first_of_month = set(
+        np.flatnonzero(np.r_[True, open_days.month[1:] != open_days.month[:-1]])
+    )
+    rows = []
+    units = np.zeros((len(accounts), len(tickers)))
+    for d, day in enumerate(open_days):
+        # Dividends are paid on the units held by the end of the previous market day
+        for t in np.flatnonzero(distributions[d]):
+            amount = float(distributions[d, t])
+            for a in np.flatnonzero(units[:, t]):
+                rows.append(
+                    (_iso(day), "dividend", accounts[a], tickers[t], "Cash")
+                    + (float(units[a, t]), amount, 0)
+                    + (round(units[a, t] * amount, 2),)
+                )
+        if d not in first_of_month:
+            continue
+        for a, account in enumerate(accounts):
+            deposit = round(float(rng.uniform(500, 2000)), 2)
+            rows.append(
+                (_iso(day), "deposit", account, None, "Cash")
+                + (None, None, None, deposit)
+            )
+            chosen = rng.choice(len(tickers), rng.integers(1, 4), replace=False)
+            for t in chosen:
+                price = float(prices[d, t])
+                bought = int(deposit * 0.95 / len(chosen) // price)
+                if bought == 0:
+                    continue
+                units[a, t] += bought
+                rows.append(
+                    (_iso(day), "buy", account, "Cash", tickers[t])
+                    + (bought, price, commission)
+                    + (round(bought * price + commission, 2),)
+                )
+    return rows
+
+
+def _iso(day):
+    return day.date().isoformat()
+
+
+if __name__ == "__main__":
+    args = docopt(usage, argv=None, help=True, options_first=False)
+    db.connect(args["--env"])
+    counts = generate(
+        int(args["--accounts"]),
+        int(args["--tickers"]),
+        int(args["--years"]),
+        int(args["--seed"]),
+    )
+    for table, count in counts.items():
+        print(f"{table:16}{count:12,}")
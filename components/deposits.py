@@ -9,11 +9,12 @@ class Deposits:
     """DataFrame-based structure to keep track of investment deposits.
 
     Public methods:
-    amount(date) -- Return the total sum deposited on this day to all accounts requested
+    amount(date) -- Return the total sum deposited on this day to all accounts requested,
+                    net of withdrawals
 
     Instance variables:
     deposits -- DataFrame, day-indexed, with the total sum deposited on each day into
-                any of the accounts requested
+                any of the accounts requested, minus the sum withdrawn from them
     """
 
     def amount(self, day):
@@ -32,12 +33,13 @@ class Deposits:
 
     def _get_deposits(self):
         return self._data.df_from_sql(
-            """SELECT SUM(total) AS amount, day
+            """SELECT SUM(CASE txtype WHEN 'withdrawal' THEN -total ELSE total END)
+                    AS amount, day
             FROM transactions
             WHERE account IN :accounts
                 AND (:from_day IS NULL OR day >= :from_day)
                 AND day <= :today
-                AND txtype = 'deposit'
+                AND txtype IN ('deposit', 'withdrawal')
             GROUP BY day
             ORDER BY day ASC;""",
             params={
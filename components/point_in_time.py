@@ -0,0 +1,201 @@
+from datetime import date, datetime
+import json
+
+import pandas as pd
+from sqlalchemy import bindparam
+
+from db import db, holdings as holdings_db
+from db.data import Data
+from util.determine_accounts import determine_accounts
+
+
+class PointInTime:
+    """Portfolio figures on given days, computed from aggregated SQL without a daily history.
+
+    Holdings and totals are each computed with a single query over all the days requested,
+    however sparse, so checking thousands of days costs about as much as checking one.
+
+    Public methods:
+    holdings(days) -- Return the holdings of each ticker on the given days
+    values(days) -- Return the portfolio totals on the given days
+    val(prop, day) -- Return a portfolio total on a single day
+
+    Instance variables:
+    accounts -- Names of the accounts to include. All accounts, if None
+    materialized -- Whether holdings are read from the materialized daily holdings
+    cost_method -- Method to assign a cost to the units sold. Only `acb` (average cost)
+    """
+
+    def holdings(self, days):
+        """Return the holdings of each ticker on the given days.
+
+        Returns a DataFrame indexed by day and ticker, with the `units` held, their `cost`
+        (sales take away their share of the average cost), the `distributions` and
+        `realized_gains` received, the last closing `price` up to the day, and the
+        `market_value` of the units held.
+        """
+        if self.materialized:
+            holdings_db.extend_to_today()
+        df = self._data.df_from_sql(
+            self._holdings_sql(),
+            params={"days": self._days_json(days), "accounts": self.accounts},
+            index_col=["day", "ticker"],
+            parse_dates=["day"],
+            bindparams=[bindparam("accounts", expanding=True)],
+        )
+        df["market_value"] = df["units"] * df["price"]
+        return df
+
+    def values(self, days):
+        """Return the portfolio totals on the given days.
+
+        Returns a DataFrame indexed by day, with the `capital` deposited (net of
+        withdrawals), the `positions_cost`, `positions_value`, `dividends` and
+        `realized_gains` of all holdings, and the resulting `cash` and `total_value`,
+        as in `Portfolio.by_day`.
+        """
+        holdings = self.holdings(days)
+        deposits = self._data.df_from_sql(
+            """WITH days AS (SELECT DISTINCT value AS day FROM json_each(:days))
+            SELECT days.day,
+                TOTAL(CASE t.txType WHEN 'withdrawal' THEN -t.total ELSE t.total END)
+                    AS capital
+            FROM days LEFT JOIN transactions t
+                ON t.txType IN ('deposit', 'withdrawal')
+                AND t.account IN :accounts
+                AND t.day <= days.day
+            GROUP BY days.day
+            ORDER BY days.day ASC;""",
+            params={"days": self._days_json(days), "accounts": self.accounts},
+            index_col="day",
+            parse_dates=["day"],
+            bindparams=[bindparam("accounts", expanding=True)],
+        )
+        totals = holdings.groupby(level="day")[
+            ["cost", "market_value", "distributions", "realized_gains"]
+        ].sum(min_count=1)
+        df = deposits.join(totals).fillna(0.0)
+        df = df.rename(
+            columns={
+                "cost": "positions_cost",
+                "market_value": "positions_value",
+                "distributions": "dividends",
+            }
+        )
+        df["cash"] = (
+            df["capital"] + df["dividends"] + df["realized_gains"] - df["positions_cost"]
+        )
+        df["total_value"] = df["cash"] + df["positions_value"]
+        return df[
+            [
+                "capital",
+                "positions_cost",
+                "positions_value",
+                "dividends",
+                "realized_gains",
+                "cash",
+                "total_value",
+            ]
+        ]
+
+    def val(self, prop, day):
+        """Return a portfolio total on a single day."""
+        return self.values([day])[prop].iloc[0]
+
+    def __init__(self, accounts=None, data=None, materialized=False, cost_method="acb"):
+        """Instantiate a PointInTime object.
+
+        With `materialized`, holdings are read from the `holdingsDaily` table instead of
+        being booked from the transactions. Either way, sales are booked at average
+        cost, so only `acb` is supported.
+        """
+        if cost_method != "acb":
+            raise ValueError("Point-in-time holdings book sales at average cost (acb)")
+        self._data = Data() if data is None else data
+        self.accounts = determine_accounts(accounts)
+        self.materialized = materialized
+        self.cost_method = cost_method
+
+    def _days_json(self, days):
+        """Return the days requested (a day, or a list of days) as a JSON array of days.
+
+        Days are given as stored in the database, as ISO dates or epoch-day numbers.
+        """
+        if isinstance(days, (str, date, datetime, pd.Timestamp)):
+            days = [days]
+        return json.dumps([db.day_value(pd.Timestamp(day).date()) for day in days])
+
+    def _holdings_sql(self):
+        """Return the query for the holdings of each ticker on the days requested.
+
+        Figures are taken from the last move (or the materialized holdings of the last
+        market day) at or before each day requested, and the price from the last day
+        priced. Both are found by sorting the days requested together with the moves (or
+        prices) of each ticker, and carrying the last one forward with a window, rather
+        than by comparing every day with every move or price.
+        """
+        if self.materialized:
+            holdings = """holdings AS
+                (SELECT days.day, h.ticker,
+                    TOTAL(h.units) AS units, TOTAL(h.cost) AS cost,
+                    TOTAL(h.distributions) AS distributions,
+                    TOTAL(h.realizedGains) AS realized_gains
+                FROM days JOIN holdingsDaily h
+                    ON h.day = (SELECT MAX(m.day) FROM marketDays m WHERE m.day <= days.day)
+                WHERE h.account IN :accounts
+                GROUP BY days.day, h.ticker)"""
+        else:
+            bookings = holdings_db.booking_ctes(
+                "account IN :accounts AND day <= (SELECT MAX(day) FROM days)",
+                "SELECT DISTINCT account, ticker, 0 AS units, 0 AS cost FROM moves",
+            )
+            holdings = f"""{bookings},
+            running AS
+                (SELECT mv.account, mv.ticker, mv.n, b.units, b.cost,
+                    SUM(mv.dividend) OVER moved AS distributions,
+                    SUM(mv.received - mv.paid + b.cost - b.previous) OVER moved
+                        AS realized_gains
+                FROM moves mv JOIN booked b USING (account, ticker, n)
+                WINDOW moved AS (PARTITION BY mv.account, mv.ticker ORDER BY mv.n)),
+            last_moves AS
+                (SELECT day, account, ticker, requested,
+                    MAX(n) OVER (
+                        PARTITION BY account, ticker ORDER BY day, requested
+                        ROWS UNBOUNDED PRECEDING
+                    ) AS n
+                FROM (SELECT day, account, ticker, n, 0 AS requested FROM moves
+                    UNION ALL
+                    SELECT days.day, held.account, held.ticker, NULL, 1
+                    FROM days CROSS JOIN held)),
+            holdings AS
+                (SELECT l.day, l.ticker,
+                    TOTAL(r.units) AS units, TOTAL(r.cost) AS cost,
+                    TOTAL(r.distributions) AS distributions,
+                    TOTAL(r.realized_gains) AS realized_gains
+                FROM last_moves l JOIN running r USING (account, ticker, n)
+                WHERE l.requested
+                GROUP BY l.day, l.ticker)"""
+        return f"""WITH RECURSIVE
+            days AS (SELECT DISTINCT value AS day FROM json_each(:days)),
+            {holdings},
+            priced AS
+                (SELECT *,
+                    MAX(price_day) OVER (
+                        PARTITION BY ticker ORDER BY day, requested
+                        ROWS UNBOUNDED PRECEDING
+                    ) AS last_priced
+                FROM (SELECT day, ticker, 1 AS requested, units, cost, distributions,
+                        realized_gains, NULL AS price_day
+                    FROM holdings
+                    UNION ALL
+                    SELECT day, ticker, 0, NULL, NULL, NULL, NULL, day
+                    FROM assetPrices
+                    WHERE ticker IN (SELECT ticker FROM holdings)
+                        AND day <= (SELECT MAX(day) FROM days)
+                        AND close IS NOT NULL))
+            SELECT h.day, h.ticker, h.units, h.cost, h.distributions, h.realized_gains,
+                p.close AS price
+            FROM priced h LEFT JOIN assetPrices p
+                ON p.ticker = h.ticker AND p.day = h.last_priced
+            WHERE h.requested
+            ORDER BY h.day ASC, h.ticker ASC;"""
@@ -1,11 +1,14 @@
 from datetime import date
+import numpy as np
 import pandas as pd
 from sqlalchemy import bindparam
 
 pd.set_option("future.no_silent_downcasting", True)
 
 from components.ticker import Ticker
+from db import holdings as holdings_db
 from util.determine_accounts import determine_accounts
+from util.lots import cost_basis
 
 
 class Position:
@@ -19,6 +22,7 @@ class Position:
     market_value(date) -- Return the market value of the units held
     open_profit(date) -- Return the unrealized appreciation profits
     distributions(date) -- Return the cash value received from distributions
+    realized_gains(date) -- Return the gains realized by sales
     distribution_returns(date) -- Return the returns from accumulated
                                   distributions over the cost of the position
     appreciation_returns(date) -- Return the returns from
@@ -29,6 +33,7 @@ class Position:
     Instance variables:
     accounts -- Name of the accounts for this position. All accounts, if None
     ticker_name -- Name of the ticker
+    cost_method -- Method to assign a cost to the units sold, `acb` (average cost) or `fifo`
     values -- DataFrame indexed by day, with:
         - a `units` float column, held units of this ticker
         - a `cost` float column, price paid in total for the position
@@ -37,6 +42,7 @@ class Position:
         - a `market_value` float column, market value of the position
         - an `open_profit' float column, unrealized appreciation profits
         - a `distributions` float column, cash received from distributions
+        - a `realized_gains` float column, gains realized by sales, over the cost of the units sold
         - a `distribution_returns` float column, distributions / cost
         - an `appreciation_returns` float column, open_profit / cost
         - a `total_returns` float column, distribution and appreciation returns
@@ -98,6 +104,13 @@ class Position:
         except KeyError:
             return None
 
+    def realized_gains(self, day):
+        """Return the gains realized by sales of this position."""
+        try:
+            return self.values["realized_gains"][day]
+        except KeyError:
+            return None
+
     def distribution_returns(self, day):
         """Return the returns from accumulated distributions."""
         try:
@@ -127,19 +140,37 @@ class Position:
             return None
 
     def __init__(
-        self, ticker_name, accounts=None, from_day=None, ticker=None, data=None
+        self,
+        ticker_name,
+        accounts=None,
+        from_day=None,
+        ticker=None,
+        data=None,
+        values=None,
+        materialized=False,
+        cost_method="acb",
     ):
-        """Instantiate a Position object."""
+        """Instantiate a Position object.
+
+        If `values` is provided (as done by `Positions` when computing all positions at once),
+        it is used as the daily values DataFrame instead of querying the database.
+        With `materialized`, daily holdings are read from the `holdingsDaily` table
+        instead of being accumulated from the transactions. Those book sales at average
+        cost, so they only support the `acb` cost method.
+        """
+        if materialized and cost_method != "acb":
+            raise ValueError("Materialized holdings book sales at average cost (acb)")
         self._data = data
         self.ticker_name = ticker_name
         self.accounts = determine_accounts(accounts)
         self.from_day = from_day
-        if ticker:
-            self._ticker = ticker
-        else:
+        self.materialized = materialized
+        self.cost_method = cost_method
+        self._ticker = ticker
+        if self._ticker is None and values is None:
             self._ticker = Ticker(ticker_name, from_day, data=self._data)
 
-        self.values = self._get_daily_values()
+        self.values = self._get_daily_values() if values is None else values
 
     def __repr__(self):
         return str(self.values.head())
@@ -149,30 +180,106 @@ class Position:
 
     def _get_daily_values(self):
         """Create a DataFrame with daily position data."""
+        if self.materialized:
+            df = self._get_daily_holdings()
+        else:
+            df = self._get_daily_transactions().cumsum()
+
+        df["current_price"] = self._ticker.values["price"]
+        df["cost_per_unit"] = df["cost"] / df["units"]
+        df["market_value"] = df["units"] * df["current_price"]
+        df["open_profit"] = df["market_value"] - df["cost"]
+        df["appreciation_returns"] = df["open_profit"] / df["cost"]
+        df["distribution_returns"] = df["distributions"] / df["cost"]
+        df["total_returns"] = df["distribution_returns"].fillna(0) + df[
+            "appreciation_returns"
+        ].fillna(0)
+
+        return df
+
+    def _get_daily_transactions(self):
+        """Return the daily changes in units, cost, distributions and realized gains."""
         df = self._data.df_from_sql(
-            """WITH buys AS
-                (SELECT SUM(units) AS units,
-                    SUM(total) AS total, day
+            """WITH moves AS
+                (SELECT day, txtype AS txtype, account, units, total, rowid AS seq
                 FROM transactions
                 WHERE account IN :accounts
                     AND (:from_day IS NULL OR day >= :from_day)
-                    AND txtype = 'buy'
-                    AND target = :ticker_name
-                GROUP BY day
-                ORDER BY day ASC),
-            dividends AS
-                (SELECT SUM(total) AS total, day
-                FROM transactions
+                    AND ((txtype = 'buy' AND target = :ticker_name)
+                        OR (txtype IN ('sale', 'dividend') AND source = :ticker_name)))
+            SELECT m.day, moves.txtype, moves.account, moves.units, moves.total
+            FROM marketdays m LEFT JOIN moves USING (day)
+            WHERE (:from_day IS NULL OR m.day >= :from_day)
+                AND m.day <= :today
+            ORDER BY m.day ASC, moves.seq ASC;""",
+            params={
+                "accounts": self.accounts,
+                "ticker_name": self.ticker_name,
+                "from_day": self.from_day,
+                "today": date.today(),
+            },
+            bindparams=[bindparam("accounts", expanding=True)],
+            index_col=None,
+            parse_dates=["day"],
+        )
+        transactions = df[df["txtype"].notna()]
+        booked = cost_basis(
+            pd.factorize(transactions["account"])[0],
+            transactions["day"].to_numpy(),
+            transactions["txtype"].to_numpy(),
+            transactions["units"].to_numpy(dtype=float),
+            transactions["total"].to_numpy(dtype=float),
+            self.cost_method,
+        )
+        changes = pd.DataFrame(
+            {
+                "units": booked["units"],
+                "cost": booked["cost"],
+                "distributions": np.where(
+                    transactions["txtype"] == "dividend", transactions["total"], 0.0
+                ),
+                "realized_gains": booked["realized"],
+            },
+            index=transactions["day"],
+        )
+        days = pd.DatetimeIndex(df["day"].unique(), name="day")
+        return changes.groupby(level="day").sum().reindex(days, fill_value=0.0)
+
+    def _get_daily_holdings(self):
+        """Return the cumulative daily holdings of this position, as materialized.
+
+        Holdings accumulate from the first transaction, so those on the last market day
+        before `from_day` are subtracted to count only transactions since `from_day`.
+        """
+        holdings_db.extend_to_today()
+        df = self._data.df_from_sql(
+            """WITH baseline AS
+                (SELECT TOTAL(units) AS units, TOTAL(cost) AS cost,
+                    TOTAL(distributions) AS distributions,
+                    TOTAL(realizedGains) AS realized_gains
+                FROM holdingsDaily
+                WHERE account IN :accounts
+                    AND ticker = :ticker_name
+                    AND day = (SELECT MAX(day) FROM marketdays WHERE day < :from_day)),
+            held AS
+                (SELECT day, TOTAL(units) AS units, TOTAL(cost) AS cost,
+                    TOTAL(distributions) AS distributions,
+                    TOTAL(realizedGains) AS realized_gains
+                FROM holdingsDaily
                 WHERE account IN :accounts
+                    AND ticker = :ticker_name
                     AND (:from_day IS NULL OR day >= :from_day)
-                    AND txtype = 'dividend'
-                    AND source = :ticker_name
-                GROUP BY day
-                ORDER BY day ASC)
-            SELECT m.day, buys.units, buys.total AS cost,
-                dividends.total AS distributions
-            FROM marketdays m LEFT JOIN buys USING (day)
-            LEFT JOIN dividends USING (day)
+                    AND day <= :today
+                GROUP BY day)
+            SELECT m.day,
+                COALESCE(held.units, 0) - baseline.units AS units,
+                COALESCE(held.cost, 0) - baseline.cost AS cost,
+                COALESCE(held.distributions, 0) - baseline.distributions
+                    AS distributions,
+                COALESCE(held.realized_gains, 0) - baseline.realized_gains
+                    AS realized_gains
+            FROM marketdays m LEFT JOIN held USING (day)
+            CROSS JOIN baseline
             WHERE (:from_day IS NULL OR m.day >= :from_day)
                 AND m.day <= :today
             ORDER BY m.day ASC;""",
@@ -186,18 +293,4 @@ class Position:
             index_col="day",
             parse_dates=["day"],
         )
-
-        df["units"] = df["units"].fillna(0).infer_objects(copy=False).cumsum()
-        df["cost"] = df["cost"].fillna(0).infer_objects(copy=False).cumsum()
-        df["distributions"] = df["distributions"].fillna(0).infer_objects(copy=False).cumsum()
-        df["current_price"] = self._ticker.values["price"]
-        df["cost_per_unit"] = df["cost"] / df["units"]
-        df["market_value"] = df["units"] * df["current_price"]
-        df["open_profit"] = df["market_value"] - df["cost"]
-        df["appreciation_returns"] = df["open_profit"] / df["cost"]
-        df["distribution_returns"] = df["distributions"] / df["cost"]
-        df["total_returns"] = df["distribution_returns"].fillna(0) + df[
-            "appreciation_returns"
-        ].fillna(0)
-
-        return df
+        return df.astype(float)
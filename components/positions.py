@@ -1,20 +1,39 @@
+from datetime import date
+import numpy as np
 import pandas as pd
+from sqlalchemy import bindparam
 
 from components.position import Position
 from components.tickers import Tickers
+from db import holdings as holdings_db
+from db.data import Data
 from util.determine_accounts import determine_accounts
+from util import tracer
+from util.lots import cost_basis, open_lots
+from util.parallel import map_chunks
 
 
 class Positions:
     """DataFrame-based structure that wraps several Position objects
 
+    All positions are computed at once, as day-by-ticker arrays, from a single query
+    over the transactions of the accounts requested (or, if `materialized`, over the
+    daily holdings already accumulated in the `holdingsDaily` table).
+
     Public methods:
     calc_weights -- Trigger weight calculations for all positions in this object
+    frames -- Return the DataFrames of this object in a dict keyed by attribute name
+    state_before(day) -- Return the state of the positions at the end of the day before, to carry on from
+    extended(later) -- Return these positions followed by later ones, carried on from them
 
     Instance variables:
     accounts -- Names of the accounts for these positions. All accounts, if None
+    materialized -- Whether positions are read from the materialized daily holdings
+    cost_method -- Method to assign a cost to the units sold, `acb` (average cost) or `fifo`
+    workers -- Number of threads to read transactions (or holdings) with. A single read, if None
     ticker_names -- List with the ticker names contained in the object
-    positions -- Dict with ticker names as keys and Position objects as values
+    positions -- Dict with ticker names as keys and Position objects as values.
+                 Built on first access, as views over the DataFrames below
     units -- DataFrame, day-indexed, one position per column. Daily number of units held in the position
     costs -- DataFrame, day-indexed, one position per column. Total cost of the units held in the position this day
     costs_per_unit -- DataFrame, day-indexed, one position per column. Average cost of the units held in the position
@@ -22,46 +41,163 @@ class Positions:
     market_values -- DataFrame, day-indexed, one position per column. The market value of the position this day
     open_profits -- DataFrame, day-indexed, one position per column. Unrealized appreciation profits this day
     distributions -- DataFrame, day-indexed, one position per column. Cash values received for the position to this day
+    realized_gains -- DataFrame, day-indexed, one position per column. Gains realized by sales of the position to this day
     distribution_returns -- DataFrame, day-indexed, one position per column. Cumulative distributions over position cost
     appreciation_returns -- DataFrame, day-indexed, one position per column. Appreciation returns over position cost
     total_returns -- DataFrame, day-indexed, one position per column. Appreciation and distribution returns
     weight -- DataFrame, day-indexed, one position per column, plus cash. Weight of the position
     """
 
+    # DataFrame attributes of this object, and the matching column in each Position's values
+    features = {
+        "units": "units",
+        "costs": "cost",
+        "distributions": "distributions",
+        "realized_gains": "realized_gains",
+        "current_prices": "current_price",
+        "costs_per_unit": "cost_per_unit",
+        "market_values": "market_value",
+        "open_profits": "open_profit",
+        "appreciation_returns": "appreciation_returns",
+        "distribution_returns": "distribution_returns",
+        "total_returns": "total_returns",
+    }
+
+    # Features that depend on the price of a ticker, unknown on days it is not held
+    _priced_features = [
+        "current_prices",
+        "costs_per_unit",
+        "appreciation_returns",
+        "distribution_returns",
+    ]
+
     def calc_weights(self, total_values):
         """Trigger weight calculations for all positions held in this object."""
-        for _, position in self.positions.items():
-            position.calc_weight(total_values)
-        self.weights = self._collect_feature("weight")
+        self.weights = self.market_values.div(total_values, axis=0).fillna(0.00)
+        if self._positions is not None:
+            for name, position in self._positions.items():
+                position.values["weight"] = self.weights[name]
         self.weights["Cash"] = 1 - self.weights.sum(axis=1)
 
-    def __init__(self, accounts=None, from_day=None, tickers=None, data=None):
-        self._data = data
+    def frames(self):
+        """Return the DataFrames of this object in a dict keyed by attribute name."""
+        attrs = list(self.features) + (["weights"] if hasattr(self, "weights") else [])
+        return {attr: getattr(self, attr) for attr in attrs}
+
+    def state_before(self, day):
+        """Return the state of the positions at the end of the day before `day`.
+
+        Positions from `day` carry on from it (see `Positions(opening=...)`). The state is
+        a dict with the `units`, `costs`, `distributions`, `realized_gains` and
+        `current_prices` of each ticker on the last day before `day`. Booking
+        transactions, it also has the transactions booked before `day` (`ledger`) and the
+        `lots` still held after them, by account and ticker. Those are kept from booking
+        these positions, or read again if they were restored from frames.
+        """
+        day = pd.Timestamp(day)
+        before = self.units.index < day
+        state = {
+            attr: getattr(self, attr)[before].iloc[-1]
+            for attr in ["units", "costs", "distributions", "realized_gains", "current_prices"]
+        }
+        if self.materialized:
+            return state
+        ledger = self._ledger
+        if ledger is None:
+            ledger = self._read(self._query_transactions)
+        ledger = ledger[ledger["day"] < day]
+        pools = ledger[["account", "ticker"]].drop_duplicates()
+        lots = open_lots(
+            ledger.groupby(["account", "ticker"], sort=False).ngroup().to_numpy(),
+            ledger["day"].to_numpy(),
+            ledger["txtype"].to_numpy(),
+            ledger["units"].to_numpy(dtype=float),
+            ledger["total"].to_numpy(dtype=float),
+            self.cost_method,
+        )
+        state["ledger"] = ledger
+        state["lots"] = pd.DataFrame(
+            {
+                "account": pools["account"].to_numpy()[lots["key"]],
+                "ticker": pools["ticker"].to_numpy()[lots["key"]],
+                "units": lots["units"],
+                "cost": lots["cost"],
+            }
+        )
+        return state
+
+    def extended(self, later):
+        """Return these positions followed by `later` ones, carried on from these.
+
+        `later` positions carry on from `state_before()` their first day, and replace
+        these from then on. Tickers first held later are taken as not held before.
+        """
+        start = later.units.index[0]
+        names = later.ticker_names
+        frames = {}
+        for attr in self.features:
+            earlier = getattr(self, attr)
+            earlier = earlier[earlier.index < start].reindex(columns=names)
+            if attr not in self._priced_features:
+                earlier = earlier.fillna(0.0)
+            frames[attr] = pd.concat([earlier, getattr(later, attr)])
+        positions = Positions(
+            self.accounts,
+            self.from_day,
+            data=self._data,
+            frames=frames,
+            materialized=self.materialized,
+            workers=self.workers,
+            cost_method=self.cost_method,
+        )
+        positions._ledger = later._ledger
+        return positions
+
+    def __init__(
+        self,
+        accounts=None,
+        from_day=None,
+        tickers=None,
+        data=None,
+        frames=None,
+        materialized=False,
+        workers=None,
+        cost_method="acb",
+        opening=None,
+    ):
+        """Instantiate a Positions object.
+
+        If `frames` is provided (a dict of DataFrames keyed by attribute name, as stored
+        by a cache), the positions are restored from it instead of being computed.
+        With `workers`, transactions (or holdings) are read in that many chunks of
+        tickers, each on its own thread and database connection.
+        Materialized holdings book sales at average cost, so they only support `acb`.
+        If `opening` is provided (as returned by `state_before(from_day)`), positions
+        carry on from it instead of starting on `from_day` with nothing held: the lots
+        held then are booked ahead of the transactions since, and the totals to date
+        are added to those since.
+        """
+        if materialized and cost_method != "acb":
+            raise ValueError("Materialized holdings book sales at average cost (acb)")
+        self._data = Data() if data is None else data
         self.accounts = determine_accounts(accounts)
+        self.from_day = from_day
+        self.materialized = materialized
+        self.workers = workers
+        self.cost_method = cost_method
+        self._opening = opening
+        self._ledger = None
+        self._positions = None
+        if frames is not None:
+            self.ticker_names = list(frames["units"].columns)
+            for attr, df in frames.items():
+                setattr(self, attr, df)
+            return
         if not tickers:
-            tickers = Tickers(from_day, data=self._data)
+            tickers = Tickers(self.accounts, from_day, data=self._data, workers=workers)
         self.ticker_names = tickers.ticker_names
-        self.positions = {
-            name: Position(
-                name,
-                accounts=self.accounts,
-                from_day=from_day,
-                ticker=tickers.tickers[name],
-                data=self._data,
-            )
-            for name in self.ticker_names
-        }
         if len(self.ticker_names) > 0:
-            self.units = self._collect_feature("units")
-            self.costs = self._collect_feature("cost")
-            self.costs_per_unit = self._collect_feature("cost_per_unit")
-            self.current_prices = self._collect_feature("current_price")
-            self.market_values = self._collect_feature("market_value")
-            self.open_profits = self._collect_feature("open_profit")
-            self.distributions = self._collect_feature("distributions")
-            self.distribution_returns = self._collect_feature("distribution_returns")
-            self.appreciation_returns = self._collect_feature("appreciation_returns")
-            self.total_returns = self._collect_feature("total_returns")
+            self._calc_features(tickers)
 
     def __repr__(self):
         return str(self.positions)
@@ -69,9 +205,242 @@ class Positions:
     def __str__(self):
         return str(self.positions)
 
-    def _collect_feature(self, feature):
-        """Extract a feature (a column) from several position objects and collect them in a single DataFrame."""
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._positions = {
+                name: Position(
+                    name,
+                    accounts=self.accounts,
+                    from_day=self.from_day,
+                    data=self._data,
+                    values=self._position_values(name),
+                    materialized=self.materialized,
+                    cost_method=self.cost_method,
+                )
+                for name in self.ticker_names
+            }
+        return self._positions
+
+    def _calc_features(self, tickers):
+        """Compute the daily features of all positions as day-by-ticker arrays."""
+        days = tickers.prices.index
+        with tracer.stage("holdings"):
+            if self.materialized:
+                holdings_db.extend_to_today()
+                cumulative = self._cumulative_holdings
+            else:
+                cumulative = self._cumulative_transactions
+            units, costs, distributions, realized_gains = cumulative(days)
+        prices = tickers.prices[self.ticker_names].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            market_values = units * prices
+            open_profits = market_values - costs
+            appreciation_returns = open_profits / costs
+            distribution_returns = distributions / costs
+            features = {
+                "units": units,
+                "costs": costs,
+                "distributions": distributions,
+                "realized_gains": realized_gains,
+                "current_prices": prices,
+                "costs_per_unit": costs / units,
+                "market_values": market_values,
+                "open_profits": open_profits,
+                "appreciation_returns": appreciation_returns,
+                "distribution_returns": distribution_returns,
+                "total_returns": np.nan_to_num(distribution_returns, nan=0.0)
+                + np.nan_to_num(appreciation_returns, nan=0.0),
+            }
+
+        for attr, values in features.items():
+            setattr(
+                self, attr, pd.DataFrame(values, index=days, columns=self.ticker_names)
+            )
+
+    def _cumulative_transactions(self, days):
+        """Return days-by-tickers arrays of units, costs, distributions and realized gains to date.
+
+        Buys and sales are booked into lots per account and ticker, in a single pass.
+        Lots held before the first day (if carried on from an opening state) are booked
+        as buys on the first day, ahead of the transactions since.
+        """
+        transactions = self._read(self._query_transactions)
+        self._ledger = transactions
+        opening = self._opening
+        if opening is not None:
+            self._ledger = _stacked([opening["ledger"], transactions])
+            lots = opening["lots"]
+            lots = lots[lots["ticker"].isin(self.ticker_names)]
+            transactions = _stacked(
+                [
+                    pd.DataFrame(
+                        {
+                            "day": days[0],
+                            "txtype": "buy",
+                            "account": lots["account"],
+                            "ticker": lots["ticker"],
+                            "units": lots["units"],
+                            "total": lots["cost"],
+                        }
+                    ),
+                    transactions,
+                ]
+            )
+        keys = transactions.groupby(["account", "ticker"], sort=False).ngroup()
+        booked = cost_basis(
+            keys.to_numpy(),
+            transactions["day"].to_numpy(),
+            transactions["txtype"].to_numpy(),
+            transactions["units"].to_numpy(dtype=float),
+            transactions["total"].to_numpy(dtype=float),
+            self.cost_method,
+        )
+        changes = pd.DataFrame(
+            {
+                "day": transactions["day"],
+                "ticker": transactions["ticker"],
+                "units": booked["units"],
+                "cost": booked["cost"],
+                "realized": booked["realized"],
+                "distributions": np.where(
+                    transactions["txtype"] == "dividend", transactions["total"], 0.0
+                ),
+            }
+        )
+
+        cumulative = tuple(
+            self._daily_totals(changes, column, days).cumsum(axis=0)
+            for column in ["units", "cost", "distributions", "realized"]
+        )
+        if opening is None:
+            return cumulative
+        units, costs, distributions, realized = cumulative
+        return (
+            units,
+            costs,
+            distributions + self._opening_totals("distributions"),
+            realized + self._opening_totals("realized_gains"),
+        )
+
+    def _query_transactions(self, data, ticker_names):
+        """Return the buys, sales and dividends of some tickers, in the order they were made."""
+        return data.df_from_sql(
+            """SELECT day, txtype AS txtype, account,
+                CASE txtype WHEN 'buy' THEN target ELSE source END AS ticker,
+                units, total
+            FROM transactions
+            WHERE account IN :accounts
+                AND (:from_day IS NULL OR day >= :from_day)
+                AND day <= :today
+                AND ((txtype = 'buy' AND target IN :ticker_names)
+                    OR (txtype IN ('sale', 'dividend') AND source IN :ticker_names))
+            ORDER BY day, rowid;""",
+            params={
+                "accounts": self.accounts,
+                "ticker_names": ticker_names,
+                "from_day": self.from_day,
+                "today": date.today(),
+            },
+            index_col=None,
+            parse_dates=["day"],
+            bindparams=[
+                bindparam("accounts", expanding=True),
+                bindparam("ticker_names", expanding=True),
+            ],
+        )
+
+    def _cumulative_holdings(self, days):
+        """Return days-by-tickers arrays of units, costs, distributions and realized gains to date.
+
+        Read from the materialized daily holdings, which accumulate from the first
+        transaction: those on the last market day before `from_day` are subtracted, and
+        the totals of the opening state (if carried on from one) added.
+        """
+        holdings = self._read(self._query_holdings)
+        if self.from_day is not None:
+            since = holdings["day"] >= pd.Timestamp(self.from_day)
+            baseline, holdings = holdings[~since], holdings[since]
+        else:
+            baseline = holdings[:0]
+
+        cumulative = []
+        for column, attr in [
+            ("units", "units"),
+            ("cost", "costs"),
+            ("distributions", "distributions"),
+            ("realized", "realized_gains"),
+        ]:
+            values = self._daily_totals(holdings, column, days)
+            if len(baseline) > 0:
+                values -= self._daily_totals(baseline, column, baseline["day"].unique())
+            if self._opening is not None:
+                values += self._opening_totals(attr)
+            cumulative.append(values)
+        return tuple(cumulative)
+
+    def _query_holdings(self, data, ticker_names):
+        """Return the materialized daily holdings of some tickers, from the baseline day on."""
+        return data.df_from_sql(
+            """SELECT day, ticker, TOTAL(units) AS units, TOTAL(cost) AS cost,
+                TOTAL(distributions) AS distributions, TOTAL(realizedGains) AS realized
+            FROM holdingsDaily
+            WHERE account IN :accounts
+                AND ticker IN :ticker_names
+                AND day <= :today
+                AND (:from_day IS NULL
+                    OR day >= (SELECT COALESCE(MAX(day), :from_day)
+                        FROM marketDays WHERE day < :from_day))
+            GROUP BY day, ticker;""",
+            params={
+                "accounts": self.accounts,
+                "ticker_names": ticker_names,
+                "from_day": self.from_day,
+                "today": date.today(),
+            },
+            index_col=None,
+            parse_dates=["day"],
+            bindparams=[
+                bindparam("accounts", expanding=True),
+                bindparam("ticker_names", expanding=True),
+            ],
+        )
+
+    def _read(self, query):
+        """Run a query over all tickers, in chunks of tickers if there are several workers."""
         return pd.concat(
-            {name: self.positions[name].values[feature] for name in self.ticker_names},
-            axis=1,
+            map_chunks(query, self.ticker_names, self._data, self.workers),
+            ignore_index=True,
+        )
+
+    def _opening_totals(self, attr):
+        """Return the totals of a feature in the opening state, as a row of all tickers."""
+        return self._opening[attr].reindex(self.ticker_names).fillna(0.0).to_numpy(float)
+
+    def _daily_totals(self, transactions, column, days):
+        """Return a days-by-tickers array with the daily sum of a transaction column."""
+        return (
+            transactions.pivot_table(
+                index="day", columns="ticker", values=column, aggfunc="sum"
+            )
+            .reindex(index=days, columns=self.ticker_names)
+            .fillna(0.0)
+            .to_numpy(dtype=float)
+        )
+
+    def _position_values(self, name):
+        """Assemble the daily values of a single position from the wide DataFrames."""
+        values = pd.DataFrame(
+            {column: getattr(self, attr)[name] for attr, column in self.features.items()}
         )
+        if hasattr(self, "weights"):
+            values["weight"] = self.weights[name]
+        return values
+
+
+def _stacked(frames):
+    """Concatenate the rows of `frames`, skipping empty ones (the first one, if all are)."""
+    kept = [df for df in frames if len(df.index) > 0]
+    if len(kept) == 0:
+        return frames[0]
+    return pd.concat(kept, ignore_index=True)
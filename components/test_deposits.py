@@ -1,8 +1,12 @@
-from datetime import date
+from datetime import date, datetime as dt
+from freezegun import freeze_time
 import pandas as pd
+from sqlalchemy import text
 from unittest.mock import patch
 
+from conftest import simple_fixture
 from components.deposits import Deposits
+from db import db
 from db.data import Data
 
 
@@ -47,3 +51,20 @@ class TestDeposits:
         assert d.amount(date(2016, 12, 31)) == 0  # out of range
         assert d.amount(date(2017, 1, 3)) == 0
         assert d.amount(date(2017, 2, 1)) == 5000
+
+    def test_withdrawals_are_netted(self):
+        simple_fixture()
+        db.conn.execute(
+            text(
+                """INSERT INTO transactions (day, txtype, account, source, target, total)
+                VALUES ('2017-03-06', 'withdrawal', 'RRSP1', 'Cash', null, 2500),
+                    ('2017-03-07', 'deposit', 'RRSP1', null, 'Cash', 1000),
+                    ('2017-03-07', 'withdrawal', 'RRSP1', 'Cash', null, 400);"""
+            )
+        )
+        with freeze_time(dt(2017, 3, 7)):
+            d = Deposits(data=Data())
+
+        assert d.amount(pd.Timestamp("2017-03-02")) == 10000
+        assert d.amount(pd.Timestamp("2017-03-06")) == -2500
+        assert d.amount(pd.Timestamp("2017-03-07")) == 600
@@ -0,0 +1,121 @@
+from datetime import datetime as dt
+from freezegun import freeze_time
+import pandas as pd
+import pytest
+from pytest import approx
+from sqlalchemy import text
+from unittest.mock import patch
+
+from conftest import simple_fixture
+from components.point_in_time import PointInTime
+from db import db
+from db.data import Data
+from portfolio import Portfolio
+
+
+def setup_function():
+    db._env = "test"
+    db.ensure_connected()
+
+
+def test_point_in_time_instantiates():
+    pit = PointInTime(data=Data())
+
+    assert pit is not None
+    assert pit.values(["2017-03-03"])["total_value"].iloc[0] == 0
+
+
+def test_holdings():
+    simple_fixture()
+    holdings = PointInTime("RRSP1", data=Data()).holdings(["2017-03-05", "2017-03-06"])
+
+    vcn = holdings.loc[("2017-03-05", "VCN.TO")]
+    assert vcn["units"] == 100
+    assert vcn["cost"] == approx(3010.35)
+    assert vcn["distributions"] == approx(10.10)
+    assert vcn["price"] == approx(30.10)
+    assert vcn["market_value"] == approx(3010.00)
+    assert holdings.loc[("2017-03-06", "VCN.TO")]["distributions"] == approx(20.00)
+    assert holdings.loc[("2017-03-06", "VEE.TO")]["market_value"] == approx(3200.00)
+
+
+def test_holdings_take_the_last_price_of_each_ticker():
+    simple_fixture()
+    db.conn.execute(
+        text("DELETE FROM assetprices WHERE ticker = 'VCN.TO' AND day = '2017-03-06';")
+    )
+    holdings = PointInTime("RRSP1", data=Data()).holdings(["2017-03-02", "2017-03-06"])
+
+    assert list(holdings.index) == [
+        (pd.Timestamp("2017-03-06"), "VCN.TO"),
+        (pd.Timestamp("2017-03-06"), "VEE.TO"),
+    ]
+    assert holdings["price"].tolist() == approx([30.10, 32.00])
+
+
+def test_only_average_cost_is_supported():
+    with pytest.raises(ValueError, match="acb"):
+        PointInTime(data=Data(), cost_method="fifo")
+
+
+def test_values_match_portfolio():
+    simple_fixture()
+    days = ["2017-03-02", "2017-03-04", "2017-03-06", "2017-03-07"]
+    with freeze_time(dt(2017, 3, 7)):
+        p = Portfolio(update=False)
+    for materialized in [False, True]:
+        values = PointInTime(data=Data(), materialized=materialized).values(days)
+
+        assert len(values) == len(days)
+        for column in values.columns:
+            for day in days:
+                assert values[column][day] == approx(p.val(column, day)), (column, day)
+
+
+def test_values_match_portfolio_with_sales_and_withdrawals():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES ('2017-03-06', 'sale', 'RRSP1', 'VCN.TO', 'Cash', 50, 1492.50),
+                ('2017-03-07', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 10, 298.85),
+                ('2017-03-07', 'withdrawal', 'RRSP1', 'Cash', null, null, 1000);"""
+        )
+    )
+    days = ["2017-03-03", "2017-03-05", "2017-03-06", "2017-03-07"]
+    with freeze_time(dt(2017, 3, 7)):
+        p = Portfolio(update=False)
+    for materialized in [False, True]:
+        values = PointInTime(data=Data(), materialized=materialized).values(days)
+
+        for column in values.columns:
+            for day in days:
+                assert values[column][day] == approx(p.val(column, day)), (column, day)
+
+
+def test_val():
+    simple_fixture()
+    pit = PointInTime(data=Data())
+
+    assert pit.val("total_value", dt(2017, 3, 6)) == approx(10394.30)
+    assert pit.val("capital", "2017-03-01") == 0
+
+
+def test_sparse_days_take_a_fixed_number_of_queries():
+    simple_fixture()
+    pit = PointInTime(data=Data())
+    days = [f"2017-03-0{day}" for day in range(2, 9)] * 100
+    with patch.object(Data, "df_from_sql", wraps=Data().df_from_sql) as data_call:
+        values = pit.values(days)
+
+    assert data_call.call_count == 2
+    assert len(values) == 7
+
+
+def test_holdings_with_epoch_days():
+    simple_fixture()
+    days = ["2017-03-05", "2017-03-06"]
+    iso = PointInTime("RRSP1", data=Data()).holdings(days)
+    db.migrate_to_epoch_days()
+
+    pd.testing.assert_frame_equal(PointInTime("RRSP1", data=Data()).holdings(days), iso)
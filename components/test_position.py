@@ -1,7 +1,9 @@
 from datetime import datetime as dt
 from freezegun import freeze_time
 import math
+import pandas as pd
 from pytest import approx
+from sqlalchemy import text
 
 from conftest import simple_fixture, simple_fixture_teardown
 from components.position import Position
@@ -106,3 +108,21 @@ def test_values():
     assert vcn.weight("2017-03-01") is None
     assert vcn.weight("2017-03-02") == 0
     assert vcn.weight("2017-03-06") == 1
+
+
+def test_materialized_values_match_values():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES ('2017-03-07', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 10, 298.85);"""
+        )
+    )
+    for from_day in [None, dt(2017, 3, 6).date()]:
+        with freeze_time(dt(2017, 3, 7)):
+            vcn = Position("VCN.TO", from_day=from_day, data=Data())
+            materialized = Position(
+                "VCN.TO", from_day=from_day, data=Data(), materialized=True
+            )
+
+        pd.testing.assert_frame_equal(materialized.values, vcn.values, check_dtype=False)
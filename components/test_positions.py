@@ -1,9 +1,14 @@
 from datetime import datetime as dt
 from freezegun import freeze_time
+import pandas as pd
 from pytest import approx
+from sqlalchemy import text
+from unittest.mock import patch
 
 from conftest import simple_fixture, simple_fixture_teardown
+from components.position import Position
 from components.positions import Positions
+from components.tickers import Tickers
 from db import db
 from db.data import Data
 
@@ -46,3 +51,100 @@ def test_loads_with_data():
     assert p.total_returns.loc["2017-03-03"]["VCN.TO"] == approx(
         (3010.0 + 10.1 - 3010.35) / 3010.35
     )
+
+
+def test_positions_match_single_positions():
+    simple_fixture()
+    with freeze_time(dt(2017, 3, 7)):
+        p = Positions(data=Data())
+        single = {name: Position(name, data=Data()) for name in p.ticker_names}
+
+    for name in p.ticker_names:
+        pd.testing.assert_frame_equal(
+            p.positions[name].values,
+            single[name].values,
+            check_dtype=False,
+            check_names=False,
+        )
+
+
+def test_sales_are_booked_into_positions():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES ('2017-03-06', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 40, 1200.00),
+                ('2017-03-07', 'sale', 'RRSP1', 'VCN.TO', 'Cash', 100, 3000.00);"""
+        )
+    )
+    with freeze_time(dt(2017, 3, 7)):
+        acb = Positions(data=Data())
+        fifo = Positions(data=Data(), cost_method="fifo")
+        single = Position("VCN.TO", data=Data(), cost_method="fifo")
+    average_cost = (3010.35 + 1200.00) / 140
+
+    assert acb.units.loc["2017-03-06"]["VCN.TO"] == approx(140)
+    assert acb.units.loc["2017-03-07"]["VCN.TO"] == approx(40)
+    assert acb.costs.loc["2017-03-07"]["VCN.TO"] == approx(40 * average_cost)
+    assert acb.realized_gains.loc["2017-03-06"]["VCN.TO"] == 0
+    assert acb.realized_gains.loc["2017-03-07"]["VCN.TO"] == approx(
+        3000.00 - 100 * average_cost
+    )
+    assert acb.realized_gains.loc["2017-03-07"]["VEE.TO"] == 0
+
+    # The sale takes out the whole first lot, leaving the second one
+    assert fifo.units.loc["2017-03-07"]["VCN.TO"] == approx(40)
+    assert fifo.costs.loc["2017-03-07"]["VCN.TO"] == approx(1200.00)
+    assert fifo.realized_gains.loc["2017-03-07"]["VCN.TO"] == approx(3000.00 - 3010.35)
+    pd.testing.assert_frame_equal(
+        fifo.positions["VCN.TO"].values,
+        single.values,
+        check_dtype=False,
+        check_names=False,
+    )
+
+
+def test_positions_are_computed_with_a_single_query():
+    simple_fixture()
+    with freeze_time(dt(2017, 3, 7)):
+        tickers = Tickers(data=Data())
+        with patch.object(Data, "df_from_sql", wraps=Data().df_from_sql) as data_call:
+            p = Positions(tickers=tickers, data=Data())
+
+    assert data_call.call_count == 1
+    assert p._positions is None
+
+
+def test_calc_weights():
+    simple_fixture()
+    with freeze_time(dt(2017, 3, 7)):
+        p = Positions(data=Data())
+    vcn = p.positions["VCN.TO"]
+    totals = p.market_values.sum(axis=1)
+    p.calc_weights(totals)
+
+    assert p.weights.loc["2017-03-02"]["VCN.TO"] == 0
+    assert p.weights.loc["2017-03-06"]["VCN.TO"] == approx(2985.0 / 6185.0)
+    assert p.weights.loc["2017-03-06"]["Cash"] == approx(0)
+    assert vcn.weight("2017-03-06") == approx(2985.0 / 6185.0)
+    assert p.positions["VEE.TO"].weight("2017-03-06") == approx(3200.0 / 6185.0)
+
+
+def test_materialized_positions_match_positions():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES ('2017-03-07', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 10, 298.85);"""
+        )
+    )
+    for from_day in [None, dt(2017, 3, 6).date()]:
+        with freeze_time(dt(2017, 3, 7)):
+            tickers = Tickers(from_day=from_day, data=Data())
+            p = Positions(from_day=from_day, tickers=tickers, data=Data())
+            materialized = Positions(
+                from_day=from_day, tickers=tickers, data=Data(), materialized=True
+            )
+
+        for attr, df in p.frames().items():
+            pd.testing.assert_frame_equal(getattr(materialized, attr), df)
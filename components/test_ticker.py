@@ -2,9 +2,11 @@ from datetime import datetime as dt, date
 from freezegun import freeze_time
 import pandas as pd
 from pytest import approx
+from sqlalchemy import text
 
 from conftest import simple_fixture, simple_fixture_teardown
 from components.ticker import Ticker
+from util.market_calendar import market_calendar
 from db import db
 from db.data import Data
 
@@ -84,3 +86,31 @@ def test_values():
     )
 
     assert vcn.volatility == approx(vcn.values[vcn.values.open == 1]["change"].std(axis=0))
+
+
+def test_values_from_calendar_match_market_days():
+    simple_fixture()
+    with freeze_time(dt(2017, 3, 7)):
+        from_db = Ticker("VCN.TO", data=Data())
+        from_calendar = Ticker("VCN.TO", data=Data(), calendar=market_calendar())
+
+    pd.testing.assert_frame_equal(from_calendar.values, from_db.values)
+    assert from_calendar.volatility == approx(from_db.volatility)
+
+
+def test_calendar_keeps_days_without_prices():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """DELETE FROM assetprices
+            WHERE day = '2017-03-02' OR (ticker = 'VCN.TO' AND day = '2017-03-06');"""
+        )
+    )
+    with freeze_time(dt(2017, 3, 8)):
+        from_db = Ticker("VCN.TO", data=Data())
+        from_calendar = Ticker("VCN.TO", data=Data(), calendar=market_calendar())
+
+    pd.testing.assert_frame_equal(from_calendar.values, from_db.values)
+    assert from_calendar.values.index[0] == dt(2017, 3, 2)
+    assert from_calendar.distribution(dt(2017, 3, 6)) == approx(0.0990)
+    assert from_calendar.price(dt(2017, 3, 6)) == approx(30.10)
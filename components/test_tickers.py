@@ -1,11 +1,16 @@
 from datetime import datetime as dt
 from freezegun import freeze_time
+import pandas as pd
 from pytest import approx
+from sqlalchemy import text
+from unittest.mock import patch
 
 from conftest import simple_fixture, simple_fixture_teardown
+from components.ticker import Ticker
 from components.tickers import Tickers
 from db import db
 from db.data import Data
+from util.market_calendar import market_calendar
 
 
 def setup_function():
@@ -42,3 +47,60 @@ def test_loads_with_data():
     assert t.correlations["VCN.TO"]["VEE.TO"] == approx(-0.9922778767136671)
 
     assert t.price("2017-03-02", "VCN.TO") == approx(30.00)
+
+
+def test_bulk_load_matches_single_tickers():
+    simple_fixture()
+    with freeze_time(dt(2017, 3, 7)):
+        t = Tickers(data=Data())
+        single = {name: Ticker(name, data=Data()) for name in t.ticker_names}
+
+    for name in t.ticker_names:
+        pd.testing.assert_frame_equal(
+            t.tickers[name].values,
+            single[name].values[t.tickers[name].values.columns],
+            check_dtype=False,
+            check_names=False,
+        )
+        assert t.volatilities[name] == approx(single[name].volatility)
+
+
+def test_bulk_load_issues_a_fixed_number_of_queries():
+    simple_fixture()
+    with patch.object(Data, "df_from_sql", wraps=Data().df_from_sql) as data_call:
+        with freeze_time(dt(2017, 3, 7)):
+            Tickers(data=Data())
+
+    assert data_call.call_count == 2
+
+
+def test_calendar_replaces_market_days_query():
+    simple_fixture()
+    with freeze_time(dt(2017, 3, 7)):
+        from_db = Tickers(data=Data())
+        with patch.object(Data, "df_from_sql", wraps=Data().df_from_sql) as data_call:
+            from_calendar = Tickers(data=Data(), calendar=market_calendar())
+
+    assert not any("marketdays" in call.args[0] for call in data_call.call_args_list)
+    pd.testing.assert_series_equal(from_calendar.market_day, from_db.market_day)
+    pd.testing.assert_frame_equal(from_calendar.prices, from_db.prices)
+    pd.testing.assert_frame_equal(from_calendar.returns, from_db.returns)
+
+
+def test_calendar_keeps_days_without_prices():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """DELETE FROM assetprices
+            WHERE day = '2017-03-02' OR (ticker = 'VCN.TO' AND day = '2017-03-06');"""
+        )
+    )
+    with freeze_time(dt(2017, 3, 8)):
+        from_db = Tickers(data=Data())
+        from_calendar = Tickers(data=Data(), calendar=market_calendar())
+
+    pd.testing.assert_series_equal(from_calendar.market_day, from_db.market_day)
+    pd.testing.assert_frame_equal(from_calendar.distributions, from_db.distributions)
+    pd.testing.assert_frame_equal(from_calendar.returns, from_db.returns)
+    assert from_calendar.market_day.index[0] == dt(2017, 3, 2)
+    assert from_calendar.distributions["VCN.TO"][dt(2017, 3, 6)] == approx(0.0990)
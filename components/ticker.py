@@ -16,6 +16,7 @@ class Ticker:
 
     Instance variables:
     ticker_name -- Name of the ticker
+    calendar -- MarketCalendar to generate market days from. Read from the database, if None
     values -- DataFrame indexed by day, with:
         - a `price` float column with the ticker's closing price
         - a `change` float column with the percentage price change from the day before
@@ -76,12 +77,21 @@ class Ticker:
         except KeyError:
             return None
 
-    def __init__(self, ticker_name, from_day=None, data=None):
-        """Instantiate a Ticker object."""
+    def __init__(
+        self, ticker_name, from_day=None, data=None, values=None, calendar=None
+    ):
+        """Instantiate a Ticker object.
+
+        If `values` is provided (as done by `Tickers` when loading in bulk),
+        it is used as the daily values DataFrame instead of querying the database.
+        If `calendar` (a MarketCalendar) is provided, market days are generated from it
+        instead of being read from the `marketDays` table.
+        """
         self._data = data
         self.ticker_name = ticker_name
         self.from_day = from_day
-        self.values = self._get_daily_values()
+        self.calendar = calendar
+        self.values = self._get_daily_values() if values is None else values
         self.volatility = self._get_volatility()
 
     def __repr__(self):
@@ -92,17 +102,40 @@ class Ticker:
 
     def _get_daily_values(self):
         """Create a DataFrame with daily ticker data."""
-        df = self._data.df_from_sql(
+        if self.calendar is None:
+            df = self._get_market_quotes()
+        else:
+            df = self._get_calendar_quotes()
+
+        df["price"] = df["price"].ffill()
+        df["change"] = (df["price"] / df["price"].shift(1)) - 1.0
+        first_price_idx = df["price"].first_valid_index()
+        df["distributions_from_start"] = df["distribution"].cumsum()
+        if first_price_idx:
+            df["change_from_start"] = (df["price"] / df["price"][first_price_idx]) - 1.0
+            df["yield_from_start"] = (
+                df["distributions_from_start"] / df["price"][first_price_idx]
+            )
+        else:  # there are no valid prices
+            df["change_from_start"] = 0.0
+            df["yield_from_start"] = 0.0
+        df["returns"] = df["change_from_start"] + df["yield_from_start"]
+
+        return df
+
+    def _get_market_quotes(self):
+        """Return the prices and distributions of the ticker on every day in `marketDays`."""
+        return self._data.df_from_sql(
             """WITH tickerdistributions AS
                 (SELECT day, amount
                 FROM distributions
                 WHERE ticker = :ticker_name)
             SELECT m.day, m.open, p.close AS price,
                 COALESCE(d.amount, 0) AS distribution
-            FROM marketdays m LEFT JOIN assetprices p USING (day)
-            LEFT JOIN tickerdistributions d USING (day)
-            WHERE (p.ticker IS NULL OR p.ticker = :ticker_name)
-            AND (:from_day IS NULL OR m.day >= :from_day)
+            FROM marketdays m LEFT JOIN assetprices p
+                ON p.day = m.day AND p.ticker = :ticker_name
+            LEFT JOIN tickerdistributions d ON d.day = m.day
+            WHERE (:from_day IS NULL OR m.day >= :from_day)
             AND m.day <= :today
             ORDER BY m.day ASC;""",
             params={
@@ -114,20 +147,43 @@ class Ticker:
             parse_dates=["day"],
         )
 
-        df["price"] = df["price"].ffill()
-        df["change"] = (df["price"] / df["price"].shift(1)) - 1.0
-        first_price_idx = df["price"].first_valid_index()
-        df["distributions_from_start"] = df["distribution"].cumsum()
-        if first_price_idx:
-            df["change_from_start"] = (df["price"] / df["price"][first_price_idx]) - 1.0
-            df["yield_from_start"] = (
-                df["distributions_from_start"] / df["price"][first_price_idx]
-            )
-        else:  # there are no valid prices
-            df["change_from_start"] = 0.0
-            df["yield_from_start"] = 0.0
-        df["returns"] = df["change_from_start"] + df["yield_from_start"]
+    def _get_calendar_quotes(self):
+        """Return the prices and distributions of the ticker on every day of the calendar.
 
+        Days start at `from_day`, or else at the first transaction or quote, and prices
+        and distributions are read independently, so distributions on days without a
+        price are kept.
+        """
+        df = self._data.df_from_sql(
+            """SELECT day, MAX(price) AS price, TOTAL(distribution) AS distribution
+            FROM (SELECT day, close AS price, 0 AS distribution
+                FROM assetprices
+                WHERE ticker = :ticker_name
+                UNION ALL
+                SELECT day, NULL, amount
+                FROM distributions
+                WHERE ticker = :ticker_name)
+            WHERE (:from_day IS NULL OR day >= :from_day)
+                AND day <= :today
+            GROUP BY day
+            ORDER BY day ASC;""",
+            params={
+                "ticker_name": self.ticker_name,
+                "from_day": self.from_day,
+                "today": date.today(),
+            },
+            index_col="day",
+            parse_dates=["day"],
+        )
+        start = self.from_day
+        if start is None:
+            start = first_day(self._data, df.index.min())
+        if start is None:
+            return df.reindex(columns=["open", "price", "distribution"])
+        days = self.calendar.days(start, date.today())
+        df = df.reindex(days.index)
+        df.insert(0, "open", days)
+        df["distribution"] = df["distribution"].fillna(0)
         return df
 
     def _get_volatility(self):
@@ -136,3 +192,23 @@ class Ticker:
             return None
         else:
             return self.values[self.values.open == 1]["change"].std(axis=0)
+
+
+def first_day(data, first_quote=None):
+    """Return the first day of the transactions or quotes, to generate market days from.
+
+    Keyword arguments:
+    data -- Data object to query the transactions through
+    first_quote -- first day with quotes, if any
+
+    Returns:
+    Timestamp -- first day, or None if there are neither transactions nor quotes
+    """
+    first_transaction = data.df_from_sql(
+        "SELECT MIN(day) AS day FROM transactions WHERE day <= :today;",
+        params={"today": date.today()},
+        index_col=None,
+        parse_dates=["day"],
+    )["day"].iloc[0]
+    days = [day for day in (first_transaction, first_quote) if not pd.isna(day)]
+    return min(days) if days else None
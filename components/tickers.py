@@ -2,9 +2,12 @@ from datetime import date
 import pandas as pd
 from sqlalchemy import bindparam, text
 
-from components.ticker import Ticker
+from components.ticker import Ticker, first_day
 from db import db
+from db.data import Data
 from util.determine_accounts import determine_accounts
+from util import tracer
+from util.parallel import map_chunks
 
 
 class Tickers:
@@ -12,6 +15,8 @@ class Tickers:
 
     Public methods:
     price(date, ticker_name) -- Price at the given date of the given ticker
+    quotes(from_day, bought) -- Unfilled market days, prices and distributions, from the given day
+    subset(accounts, from_day, bought) -- Tickers object over part of these tickers, without querying again
 
     Instance variables:
     ticker_names -- List with the ticker names contained in the object
@@ -23,6 +28,9 @@ class Tickers:
     distributions_from_start -- DataFrame, day-indexed, one ticker per column. Accumulated distributions
     yields_from_start -- DataFrame, day-indexed, one ticker per column. Per-unit yields
     returns -- DataFrame, day-indexed, one ticker per column. Total returns percentage (appreciation + yield)
+    workers -- Number of threads to read prices and distributions with. A single read, if None
+    calendar -- MarketCalendar to generate market days from. Read from the database, if None
+    carried -- Series with the last prices, before the first day, of the tickers held then. None, if not carried
     volatilities -- Dict of ticker volatilities (standard deviation of price changes)
     correlations -- DataFrame indexed by ticker name with one column per ticker. Values represent the correlation
         between both tickers' prices
@@ -33,25 +41,89 @@ class Tickers:
         """Return the price of ticker_name on the given day."""
         return self.tickers[ticker_name].price(day)
 
-    def __init__(self, accounts=None, from_day=None, data=None):
-        """Instantiate a Tickers object, with dates starting on from_day."""
-        self._data = data
+    def quotes(self, from_day=None, bought=None):
+        """Return the bulk-loaded quotes from `from_day` onwards, as loaded from the database.
+
+        The quotes are a dict with the `market_day` Series and the unfilled `prices` and
+        `distributions` DataFrames. If `bought` is provided, only the tickers in it with
+        prices since `from_day` are kept.
+        """
+        if self._quotes is None:
+            days = pd.DatetimeIndex([], name="day")
+            return {
+                "market_day": pd.Series(index=days, dtype=int, name="open"),
+                "prices": pd.DataFrame(index=days),
+                "distributions": pd.DataFrame(index=days),
+            }
+        market_day = self._quotes["market_day"]
+        if from_day is not None:
+            market_day = market_day[market_day.index >= pd.Timestamp(from_day)]
+        prices = self._quotes["prices"].loc[market_day.index]
+        names = list(prices.columns)
+        if bought is not None:
+            priced = prices.columns[prices.notna().any()]
+            names = sorted(set(priced).intersection(bought))
+        return {
+            "market_day": market_day,
+            "prices": prices[names],
+            "distributions": self._quotes["distributions"].loc[market_day.index, names],
+        }
+
+    def subset(self, accounts, from_day, bought):
+        """Return a Tickers object for some of these tickers, without querying the database.
+
+        `from_day` must not be earlier than this object's, and `bought` lists the tickers
+        bought in `accounts` since `from_day`. Only those with prices since then are kept.
+        """
+        return Tickers(
+            accounts, from_day, data=self._data, quotes=self.quotes(from_day, bought)
+        )
+
+    def __init__(
+        self,
+        accounts=None,
+        from_day=None,
+        data=None,
+        quotes=None,
+        workers=None,
+        calendar=None,
+        carried=None,
+    ):
+        """Instantiate a Tickers object, with dates starting on from_day.
+
+        If `quotes` is provided (a dict with the `market_day` Series and the unfilled
+        `prices` and `distributions` DataFrames, as returned by `quotes`), the features
+        are computed from it instead of querying the database.
+        With `workers`, prices and distributions are read in that many chunks of tickers,
+        each on its own thread and database connection.
+        If `calendar` (a MarketCalendar) is provided, market days are generated from it
+        instead of being read from the `marketDays` table.
+        If `carried` (a Series of prices by ticker name) is provided, those tickers were
+        held before `from_day`: they are kept even if not bought since, and their last
+        prices are carried forward until they get new ones.
+        """
+        self._data = Data() if data is None else data
         self.accounts = determine_accounts(accounts)
-        self.ticker_names = self._get_ticker_names(self.accounts, from_day)
+        self.workers = workers
+        self.calendar = calendar
+        self.carried = carried
+        self._quotes = None
+        if quotes is not None:
+            self.ticker_names = list(quotes["prices"].columns)
+        else:
+            self.ticker_names = self._get_ticker_names(self.accounts, from_day)
+            if carried is not None:
+                self.ticker_names = sorted(set(self.ticker_names).union(carried.index))
+            if len(self.ticker_names) > 0:
+                with tracer.stage("quotes"):
+                    quotes = self._load_quotes(from_day)
+        if len(self.ticker_names) > 0:
+            with tracer.stage("features"):
+                self._calc_features(quotes)
         self.tickers = self._get_tickers(from_day)
         if len(self.ticker_names) > 0:
-            self.prices = self._collect_feature("price")
-            self.changes = self._collect_feature("change")
-            self.changes_from_start = self._collect_feature("change_from_start")
-            self.distributions = self._collect_feature("distribution")
-            self.distributions_from_start = self._collect_feature(
-                "distributions_from_start"
-            )
-            self.yields_from_start = self._collect_feature("yield_from_start")
-            self.returns = self._collect_feature("returns")
             self.volatilities = self._collect_volatilities()
             self.correlations = self._calc_correlations()
-            self.market_day = self._collect_market_days()
 
     def __repr__(self):
         return str(self.tickers)
@@ -75,7 +147,8 @@ class Tickers:
         cur = db.conn.execute(
             text("""SELECT DISTINCT(target) AS name
             FROM transactions
-            WHERE (:from_day IS NULL OR day >= :from_day)
+            WHERE txtype = 'buy'
+                AND (:from_day IS NULL OR day >= :from_day)
                 AND day <= :today
                 AND account IN :accounts;""").bindparams(
                 bindparam("accounts", expanding=True)
@@ -87,16 +160,131 @@ class Tickers:
         return sorted(set(priced).intersection(bought))
 
     def _get_tickers(self, from_day):
-        """Get all ticker objects."""
+        """Get all ticker objects, each one holding a view of the bulk-loaded features."""
         return {
-            name: Ticker(name, from_day, data=self._data) for name in self.ticker_names
+            name: Ticker(
+                name, from_day, data=self._data, values=self._ticker_values(name)
+            )
+            for name in self.ticker_names
         }
 
-    def _collect_feature(self, feature):
-        """Extract a feature (a column) from several position objects and collect them in a single DataFrame."""
-        return pd.concat(
-            {name: self.tickers[name].values[feature] for name in self.ticker_names},
-            axis=1,
+    def _load_quotes(self, from_day):
+        """Load the market days, prices and distributions of all tickers in bulk."""
+        quotes = pd.concat(
+            map_chunks(
+                lambda data, names: self._query_quotes(data, names, from_day),
+                self.ticker_names,
+                self._data,
+                self.workers,
+            ),
+            ignore_index=True,
+        )
+        market_day = self._market_days(from_day, quotes)
+        return {
+            "market_day": market_day,
+            "prices": self._pivot(quotes, "price", market_day.index),
+            "distributions": self._pivot(quotes, "distribution", market_day.index),
+        }
+
+    def _market_days(self, from_day, quotes):
+        """Return a day-indexed Series, with whether the market was open, up to today.
+
+        Days are read from the database, or generated by the calendar if there is one,
+        from `from_day` or else from the first day with transactions or quotes.
+        """
+        if self.calendar is not None:
+            start = from_day
+            if start is None:
+                start = first_day(self._data, quotes["day"].min())
+            return self.calendar.days(start, date.today())
+        days = self._data.df_from_sql(
+            """SELECT day, open
+            FROM marketdays
+            WHERE (:from_day IS NULL OR day >= :from_day)
+                AND day <= :today
+            ORDER BY day ASC;""",
+            params={"from_day": from_day, "today": date.today()},
+            index_col="day",
+            parse_dates=["day"],
+        )
+        return days["open"]
+
+    def _query_quotes(self, data, ticker_names, from_day):
+        """Return the prices and distributions of some tickers, one row per ticker, day and feature."""
+        return data.df_from_sql(
+            """SELECT 'price' AS feature, ticker, day, close AS value
+            FROM assetprices
+            WHERE ticker IN :ticker_names
+                AND (:from_day IS NULL OR day >= :from_day)
+                AND day <= :today
+            UNION ALL
+            SELECT 'distribution' AS feature, ticker, day, amount AS value
+            FROM distributions
+            WHERE ticker IN :ticker_names
+                AND (:from_day IS NULL OR day >= :from_day)
+                AND day <= :today;""",
+            params={
+                "ticker_names": ticker_names,
+                "from_day": from_day,
+                "today": date.today(),
+            },
+            index_col=None,
+            parse_dates=["day"],
+            bindparams=[bindparam("ticker_names", expanding=True)],
+        )
+
+    def _calc_features(self, quotes):
+        """Compute the daily features of all tickers, one DataFrame per feature."""
+        self._quotes = quotes
+        self.market_day = quotes["market_day"]
+        if self.carried is None:
+            self.prices = quotes["prices"].ffill()
+            self.changes = (self.prices / self.prices.shift(1)) - 1.0
+        else:
+            seed = self.carried.reindex(quotes["prices"].columns).to_frame().T
+            prices = pd.concat([seed, quotes["prices"]]).ffill()
+            changes = (prices / prices.shift(1)) - 1.0
+            self.prices = prices.iloc[1:].rename_axis(quotes["prices"].index.name)
+            self.changes = changes.iloc[1:].rename_axis(quotes["prices"].index.name)
+        self.distributions = quotes["distributions"].fillna(0.0)
+        self.distributions_from_start = self.distributions.cumsum()
+        first_prices = self._first_valid(self.prices)
+        self.changes_from_start = (self.prices / first_prices) - 1.0
+        self.yields_from_start = self.distributions_from_start / first_prices
+        no_prices = first_prices.index[first_prices.isna()]
+        self.changes_from_start[no_prices] = 0.0
+        self.yields_from_start[no_prices] = 0.0
+        self.returns = self.changes_from_start + self.yields_from_start
+
+    def _pivot(self, quotes, feature, days):
+        """Turn the long-format rows of one feature into a day-indexed, one-ticker-per-column DataFrame."""
+        rows = quotes[quotes["feature"] == feature]
+        return (
+            rows.pivot(index="day", columns="ticker", values="value")
+            .reindex(index=days, columns=self.ticker_names)
+            .rename_axis(columns=None)
+            .astype(float)
+        )
+
+    def _first_valid(self, df):
+        """Return the first non-null value of each column."""
+        if df.empty:
+            return pd.Series(float("nan"), index=df.columns)
+        return df.bfill().iloc[0]
+
+    def _ticker_values(self, name):
+        """Assemble the daily values of a single ticker from the bulk-loaded features."""
+        return pd.DataFrame(
+            {
+                "open": self.market_day,
+                "price": self.prices[name],
+                "distribution": self.distributions[name],
+                "change": self.changes[name],
+                "distributions_from_start": self.distributions_from_start[name],
+                "change_from_start": self.changes_from_start[name],
+                "yield_from_start": self.yields_from_start[name],
+                "returns": self.returns[name],
+            }
         )
 
     def _collect_volatilities(self):
@@ -106,7 +294,3 @@ class Tickers:
     def _calc_correlations(self):
         """Calculate the correlations between ticker prices."""
         return self.prices.corr()
-
-    def _collect_market_days(self):
-        """Extract the Series of open market days from a Ticker object."""
-        return self.tickers[self.ticker_names[0]].values["open"]
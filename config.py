@@ -1,11 +1,49 @@
 db = {
     "prod": {
         "type": "sqlite",
-        "path": "data/finance.db"
+        "path": "data/finance.db",
+        "pool_size": 5,
+        "busy_timeout": 5000,
+    },
+    "bench": {
+        "type": "sqlite",
+        "path": "data/bench.db",
     },
     "test": {
         "type": "sqlite",
         "path": ":memory:"
     },
 }
+db_profiles = {
+    # Read-write connections: readers do not block on a writer, and a commit only
+    # syncs to disk at WAL checkpoints
+    "default": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+        },
+    },
+    # Read-only reporting runs: a large page cache, memory-mapped reads and
+    # temporary tables in memory
+    "reporting": {
+        "read_only": True,
+        "pragmas": {
+            "cache_size": -65536,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        },
+    },
+}
+data = {
+    # Engine to fetch query results with: "pandas" (pandas.read_sql_query) or "numpy"
+    # (rows read straight off the sqlite3 cursor into NumPy arrays)
+    "fetch": "pandas",
+}
 sharpe = 0.017
+cache = {
+    "path": "data/cache",
+}
+compact = {
+    "ratios": "float32",
+    "amounts": "float64",
+}
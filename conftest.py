@@ -1,6 +1,17 @@
+import calendar
+from collections import Counter
+from datetime import date, datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
 import pytest
 from sqlalchemy import text
 
+import config
 from db import db
 
 
@@ -20,6 +31,28 @@ def setup_test_database():
         db.engine.dispose()
 
 
+@pytest.fixture
+def file_database(tmp_path, monkeypatch):
+    """Return a function that copies the test database to a file, and connects to it.
+
+    Keyword arguments to the function are added to the settings of the `test`
+    environment, in `config.db`. Returns the path of the database file.
+    """
+
+    def connect(**settings):
+        path = tmp_path / "finance.db"
+        file_db = sqlite3.connect(path)
+        db.conn.connection.driver_connection.backup(file_db)
+        file_db.close()
+        monkeypatch.setitem(
+            config.db, "test", {"type": "sqlite", "path": str(path), **settings}
+        )
+        db.connect("test")
+        return path
+
+    return connect
+
+
 def _create_schema():
     with open("db/schemas.sql", "r") as f:
         schema_sql = f.read()
@@ -131,3 +164,97 @@ def simple_fixture_teardown():
         db.conn.close()
     if db.engine is not None:
         db.engine.dispose()
+
+
+class ChartHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the Yahoo chart API, serving canned chart JSON.
+
+    Every symbol gets closing prices for 2017-03-07 and 2017-03-08, except that
+    symbols starting with FLAKY fail once before succeeding, symbols starting with DOWN
+    always fail, and symbols starting with MISSING are not found.
+    """
+
+    protocol_version = "HTTP/1.1"
+    days = [date(2017, 3, 7), date(2017, 3, 8)]
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        symbol = url.path.rsplit("/", 1)[-1]
+        with self.server.lock:
+            self.server.requests[symbol] += 1
+            self.server.start_days[symbol] = datetime.fromtimestamp(
+                int(parse_qs(url.query)["period1"][0]), timezone.utc
+            ).date()
+            attempt = self.server.requests[symbol]
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(
+                self.server.max_in_flight, self.server.in_flight
+            )
+        time.sleep(self.server.delay)
+        try:
+            if symbol.startswith("DOWN") or (symbol.startswith("FLAKY") and attempt == 1):
+                self._reply(503, {"error": "Service Unavailable"})
+            elif symbol.startswith("MISSING"):
+                self._reply(
+                    404,
+                    {"chart": {"result": None, "error": {"code": "Not Found"}}},
+                )
+            else:
+                self._reply(200, self._chart(symbol))
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _chart(self, symbol):
+        return {
+            "chart": {
+                "result": [
+                    {
+                        "meta": {"symbol": symbol},
+                        "timestamp": [
+                            calendar.timegm(day.timetuple()) + 12 * 3600
+                            for day in self.days
+                        ],
+                        "indicators": {"quote": [{"close": [30.10, 30.25]}]},
+                    }
+                ],
+                "error": None,
+            }
+        }
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ChartServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        super().__init__(("127.0.0.1", 0), ChartHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.start_days = {}
+        self.in_flight = self.max_in_flight = 0
+        self.url = f"http://127.0.0.1:{self.server_port}/chart"
+
+
+@pytest.fixture
+def chart_server():
+    server = ChartServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
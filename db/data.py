@@ -1,7 +1,18 @@
+from contextlib import nullcontext
+from datetime import date
+import re
+
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
 
+import config
 from db import db
+from util import tracer
+
+# Ordinal of 1970-01-01, day 0 of datetime64[D], and the integer that stands for NaT
+_epoch = date(1970, 1, 1).toordinal()
+_nat = np.iinfo(np.int64).min
 
 
 class Data:
@@ -12,27 +23,169 @@ class Data:
     this intermediary can be passed on to component classes instead of
     direct access to the database connection, and this indirection
     helps with testing and improving modularity.
+
+    Outside of the main thread, queries on the shared connection go through a session
+    connection each instead (see `db.shared()`). Used as a context manager, a Data
+    object queries through a connection of its own, checked out of the pool for the
+    duration of the block:
+
+        with Data() as data:
+            df = data.df_from_sql(...)
+
+    Query results are fetched by one of two engines: "pandas", through
+    pandas.read_sql_query, or "numpy", which reads the rows straight off the sqlite3
+    cursor into one typed NumPy array per column, and converts dates in bulk.
+    Both return the same dataframes.
     """
 
-    def __init__(self):
+    fetch_engines = ["pandas", "numpy"]
+
+    def __init__(self, conn=None, fetch=None):
+        """Instantiate a Data object, on the shared connection unless `conn` is provided.
+
+        Keyword arguments:
+        conn -- connection to query through (default the shared `db.conn`)
+        fetch -- engine to fetch query results with, one of `fetch_engines`
+                 (default `config.data["fetch"]`)
+        """
+        fetch = config.data["fetch"] if fetch is None else fetch
+        if fetch not in self.fetch_engines:
+            raise ValueError(f"Unknown fetch engine: {fetch}")
         db.ensure_connected()
-        self._conn = db.conn
+        self._conn = db.conn if conn is None else conn
+        self._session = None
+        self._fetch = fetch
+
+    def copy(self):
+        """Return a Data object with the same settings, on the shared connection.
+
+        Used as a context manager, the copy queries through a connection of its own, so
+        that each thread can query with the settings of the same Data object.
+        """
+        return Data(fetch=self._fetch)
+
+    def __enter__(self):
+        self._session = db.session()
+        self._shared_conn = self._conn
+        self._conn = self._session.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        session, self._session = self._session, None
+        self._conn = self._shared_conn
+        return session.__exit__(exc_type, exc_value, traceback)
 
     def df_from_sql(self, sql, params, index_col, parse_dates, bindparams=None):
         """Return a dataframe from a SQL query.
 
         Return a dataframe from a sql query, given the parameters provided.
-        This function just wraps around pandas.read_sql_query, but it is useful because
-        other components may use this without exposing the database connection to them.
+        This function just wraps around pandas.read_sql_query (or the cursor of the
+        "numpy" fetch engine), but it is useful because other components may use this
+        without exposing the database connection to them.
         """
         sql_text = text(sql)
         if bindparams:
             sql_text = sql_text.bindparams(*bindparams)
 
-        return pd.read_sql_query(
-            sql=sql_text,
-            con=self._conn,
-            params=params,
-            index_col=index_col,
-            parse_dates=parse_dates,
-        )
+        # Queries are only named if traced, as naming them parses the SQL
+        traced = tracer.is_tracing()
+        with tracer.stage(query_name(sql)) if traced else nullcontext():
+            with self._connection() as conn:
+                if self._fetch == "numpy":
+                    df = self._df_from_cursor(
+                        conn, sql_text, params, index_col, parse_dates
+                    )
+                else:
+                    df = db.read_sql_query(
+                        sql=sql_text,
+                        con=conn,
+                        params=params,
+                        index_col=index_col,
+                        parse_dates=parse_dates,
+                    )
+            if traced:
+                tracer.count(len(df.index), int(df.memory_usage(index=True).sum()))
+        return df
+
+    def _connection(self):
+        """Return a context yielding the connection to query through."""
+        return db.shared() if self._conn is db.conn else nullcontext(self._conn)
+
+    def _df_from_cursor(self, conn, sql_text, params, index_col, parse_dates):
+        """Return a dataframe from the rows of the sqlite3 cursor of a query.
+
+        SQLAlchemy still compiles the query and binds its parameters, but the rows are
+        read from the DBAPI cursor in one go, without wrapping each in a Row, and each
+        column becomes a single NumPy array.
+        """
+        result = conn.execute(sql_text, params or {})
+        try:
+            names = [column[0] for column in result.cursor.description]
+            rows = result.cursor.fetchall()
+        finally:
+            result.close()
+
+        dates = _listed(parse_dates)
+        values = zip(*rows) if rows else [()] * len(names)
+        arrays = {
+            name: to_datetimes(column) if name in dates else to_array(column)
+            for name, column in zip(names, values)
+        }
+        index = None
+        if isinstance(index_col, str):
+            index = pd.Index(arrays.pop(index_col), name=index_col)
+        elif index_col is not None:
+            index = pd.MultiIndex.from_arrays(
+                [arrays.pop(name) for name in index_col], names=list(index_col)
+            )
+        df = pd.DataFrame(arrays, index=index, columns=list(arrays), copy=False)
+        return df
+
+
+def to_array(values):
+    """Return a typed NumPy array of the values of a result column.
+
+    Integer columns become int64, numeric columns float64 (with NULLs as NaN), and
+    anything else an object array, as pandas.read_sql_query would infer them.
+    """
+    kinds = set(map(type, values))
+    if kinds and kinds <= {int}:
+        return np.array(values, dtype=np.int64)
+    if kinds and kinds <= {int, float, type(None)} and kinds & {int, float}:
+        return np.array(values, dtype=np.float64)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def to_datetimes(values):
+    """Convert the values of a result column to datetime64[ns], in bulk.
+
+    Integers are taken as day numbers since 1970-01-01, and dates are turned into day
+    numbers through their ordinals, which NumPy converts much faster than date objects.
+    Datetimes and ISO strings are parsed by NumPy, and NULLs become NaT.
+    """
+    kinds = set(map(type, values)) - {type(None)}
+    if kinds == {date}:
+        ordinals = [_nat if day is None else day.toordinal() - _epoch for day in values]
+        days = np.array(ordinals, dtype=np.int64).view("datetime64[D]")
+    elif kinds == {int}:
+        days = np.array(values, dtype="datetime64[D]")
+    else:
+        return np.array(values, dtype="datetime64[ns]")
+    return days.astype("datetime64[ns]")
+
+
+def _listed(columns):
+    """Return the names of columns given as None, a name, a list or a dict."""
+    if columns is None:
+        return []
+    if isinstance(columns, str):
+        return [columns]
+    return list(columns)
+
+
+def query_name(sql):
+    """Name a query after the first table it reads from, to trace it."""
+    table = re.search(r"\bFROM\s+(\w+)", sql, re.IGNORECASE)
+    return f"sql:{table.group(1).lower() if table else 'query'}"
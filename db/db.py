@@ -1,9 +1,14 @@
+from contextlib import contextmanager
+import json
 import pandas as pd
+import re
 import sqlite3
+import threading
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool, StaticPool
 
 import config
 
@@ -11,23 +16,78 @@ import config
 conn = None
 engine = None
 _env = "prod"
+_profile = "default"
 
+# Connection settings, unless set for the environment in `config.db`
+_defaults = {"pool_size": 5, "busy_timeout": 5000}
 
-def connect(env=_env):
+# Columns added to the schema after their tables, as (table, column, type)
+_added_columns = [
+    ("transactions", "importHash", "text"),
+    ("holdingsDaily", "realizedGains", "numeric(12, 2) not null default 0"),
+]
+
+# Version of the schema (kept in PRAGMA user_version) that stores dates as epoch-day
+# numbers, the days since 1970-01-01. Earlier versions store them as ISO dates
+epoch_days_version = 2
+_epoch_days = False
+_epoch = date(1970, 1, 1)
+
+# Date column of each table, stored as an epoch-day number from `epoch_days_version`
+_date_columns = {
+    "accounts": "dateCreated",
+    "marketDays": "day",
+    "transactions": "day",
+    "holdingsDaily": "day",
+    "assetPrices": "day",
+    "distributions": "day",
+    "inflationRates": "month",
+    "changedDays": "day",
+}
+
+# Declarations of date columns, as ISO dates and as epoch-day numbers
+_date_declarations = [
+    (r"\b(\w+) date not null", r"\1 integer check (typeof(\1) = 'integer') not null"),
+    ("default current_date", "default (CAST(julianday('now') - 2440587.5 AS integer))"),
+    (r"\bcurrent_date\b", "CAST(julianday('now') - 2440587.5 AS integer)"),
+]
+
+
+# Columns declared as dates are read as dates, the same for every database. Dates
+# passed to the database are converted by each engine instead (see `_day_params()`)
+sqlite3.register_converter("date", lambda val: date.fromisoformat(val.decode()))
+sqlite3.register_converter("timestamp", lambda val: datetime.fromisoformat(val.decode()))
+
+
+def connect(env=_env, profile="default"):
     """Connect to finance database.
 
-    The connection becomes available on the `conn` singleton variable.
+    The connection becomes available on the `conn` singleton variable, and further
+    connections can be checked out of the `engine` pool with `session()`.
     Subsequent calls to `connect()` release previous connections and reconnect.
 
+    Database files are pooled up to the environment's `pool_size`, and wait up to
+    `busy_timeout` milliseconds on locks. Every connection runs the PRAGMAs of the
+    profile, and read-only profiles open the file with `mode=ro`. In-memory databases
+    live in a single connection, shared by the pool, and only take the PRAGMAs that
+    apply to them.
+
+    Dates are passed to and read from the database as ISO strings, unless the schema
+    stores days as epoch-day numbers (see `migrate_to_epoch_days()`).
+
     Keyword arguments:
     env -- environment to connect to.
            Must be a key in the `config.db` dict (default 'prod')
+    profile -- connection profile to connect with.
+               Must be a key in the `config.db_profiles` dict (default 'default')
 
     Returns:
     bool -- True if the connection is alive
     """
-    global _env, conn, engine
+    global _env, _profile, conn, engine
+    db_profile = config.db_profiles[profile]
     _env = env
+    _profile = profile
 
     if conn is not None:
         conn.close()
@@ -38,36 +98,58 @@ def connect(env=_env):
 
     db_config = config.db[env]
     db_path = db_config["path"]
+    in_memory = db_path == ":memory:"
+    read_only = db_profile.get("read_only", False) and not in_memory
 
     # Test databases are in :memory: and have no file
-    if db_path != ":memory:":
+    if not in_memory and not read_only:
         Path(db_path).parent.mkdir(parents=True, exist_ok=True)
 
-    def adapt_date_iso(val):
-        return val.isoformat()
-
-    def adapt_datetime_iso(val):
-        return val.isoformat()
-
-    def convert_date(val):
-        return date.fromisoformat(val.decode())
-
-    def convert_datetime(val):
-        return datetime.fromisoformat(val.decode())
-
-    sqlite3.register_adapter(date, adapt_date_iso)
-    sqlite3.register_adapter(datetime, adapt_datetime_iso)
-    sqlite3.register_converter("date", convert_date)
-    sqlite3.register_converter("timestamp", convert_datetime)
+    settings = {**_defaults, **db_config}
+    pragmas = {
+        name: value
+        for name, value in db_profile.get("pragmas", {}).items()
+        if not (name == "journal_mode" and (in_memory or read_only))
+    }
+    if in_memory:
+        pool_args = {"poolclass": StaticPool, "pool_reset_on_return": None}
+    else:
+        pool_args = {
+            "poolclass": QueuePool,
+            "pool_size": settings["pool_size"],
+            "max_overflow": 0,
+        }
 
+    url = f"sqlite:///{db_path}"
+    if read_only:
+        url = f"sqlite:///file:{db_path}?mode=ro&uri=true"
     new_engine = create_engine(
-        f"sqlite:///{db_path}",
+        url,
         execution_options={"isolation_level": "AUTOCOMMIT"},
-        connect_args={"detect_types": sqlite3.PARSE_DECLTYPES},
+        connect_args={
+            "detect_types": sqlite3.PARSE_DECLTYPES,
+            "check_same_thread": False,
+        },
+        **pool_args,
     )
 
+    @event.listens_for(new_engine, "connect")
+    def set_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout'])};")
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value};")
+        cursor.close()
+
+    @event.listens_for(new_engine, "before_cursor_execute", retval=True)
+    def pass_days(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            return statement, [_day_params(params) for params in parameters]
+        return statement, _day_params(parameters)
+
     engine = new_engine
     conn = engine.connect().execution_options(autocommit=True)
+    _use_epoch_days(schema_version() >= epoch_days_version)
     return is_alive()
 
 
@@ -81,7 +163,27 @@ def ensure_connected(env=None):
         raise ValueError("Already connected to a different environment.")
 
     _env = env
-    return True if is_alive() else connect(_env)
+    return True if is_alive() else connect(_env, _profile)
+
+
+def is_in_memory():
+    """Report whether the database of the current environment lives in memory only.
+
+    In-memory databases cannot be shared by other connections or processes.
+    """
+    return config.db[_env]["path"] == ":memory:"
+
+
+def session_capacity():
+    """Return how many session connections can be checked out of the pool at once.
+
+    The pool holds the environment's `pool_size` connections, one of which is the
+    shared `conn`. In-memory databases live in a single connection.
+    """
+    ensure_connected()
+    if is_in_memory():
+        return 1
+    return max(engine.pool.size() - 1, 1)
 
 
 def is_alive():
@@ -90,22 +192,295 @@ def is_alive():
     return conn is not None and not conn.closed
 
 
+def schema_version():
+    """Return the version of the database schema, 0 if it was never set."""
+    return conn.exec_driver_sql("PRAGMA user_version;").scalar()
+
+
+def uses_epoch_days():
+    """Report whether the database stores days as epoch-day numbers."""
+    return _epoch_days
+
+
+def table_versions():
+    """Return the number of changes made to each table that portfolios are computed from.
+
+    Returns:
+    dict -- versions (number of changes) keyed by table name, kept in `tableVersions`
+    """
+    ensure_connected()
+    return dict(conn.exec_driver_sql("SELECT name, version FROM tableVersions;").all())
+
+
+def first_changed_day(versions):
+    """Return the earliest day changed in those tables since the given versions, or None.
+
+    Triggers keep the version of the last change to each day of each table in
+    `changedDays`, so finding it reads one row per day changed, not the days themselves.
+
+    Keyword arguments:
+    versions -- versions of the tables to compare with, as returned by `table_versions()`
+    """
+    ensure_connected()
+    day = conn.execute(
+        text(
+            """SELECT MIN(c.day) FROM changedDays c
+            WHERE c.version > COALESCE(
+                (SELECT value FROM json_each(:versions) WHERE key = c.name), 0
+            );"""
+        ),
+        {"versions": json.dumps(versions)},
+    ).scalar()
+    return None if day is None else as_date(day)
+
+
+def day_value(day):
+    """Return a date as stored in the database: an epoch-day number, or an ISO date."""
+    if isinstance(day, datetime):
+        day = day.date()
+    return (day - _epoch).days if _epoch_days else day.isoformat()
+
+
+def as_date(value):
+    """Return a day read from the database (epoch-day number, ISO date or date) as a date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, int):
+        return _epoch + timedelta(days=value)
+    return date.fromisoformat(value)
+
+
+def schema_sql(epoch_days=False):
+    """Return the statements of the schema, with dates stored as epoch-day numbers if asked.
+
+    Dates as epoch-day numbers are declared as integers, checked to be integers (so
+    that ISO dates are not stored in them by mistake), and make `marketDays` a rowid
+    table keyed on the day.
+    """
+    with open(Path(__file__).parent / "schemas.sql", "r") as f:
+        sql = f.read()
+    if epoch_days:
+        for iso, epoch in _date_declarations:
+            sql = re.sub(iso, epoch, sql)
+    return sql
+
+
+def migrate():
+    """Bring the database schema up to date.
+
+    Columns added to the schema after a table was created are first added to the
+    existing table, and triggers are dropped to be created again as they are now. All
+    statements in the schema are idempotent, so running it again creates only the
+    tables and indexes that are missing. Table statistics are then refreshed, so the
+    query planner can make use of the indexes. The materialized holdings are not
+    rebuilt (see `holdings.rebuild_from()`).
+
+    New databases store days as epoch-day numbers if their environment sets
+    `epoch_days` in `config.db`. Existing databases keep the days as they are, until
+    converted with `migrate_to_epoch_days()`.
+    """
+    ensure_connected()
+    if config.db[_env].get("epoch_days", False) and not _has_table("transactions"):
+        conn.exec_driver_sql(f"PRAGMA user_version = {epoch_days_version};")
+        _use_epoch_days(True)
+    for table, column, column_type in _added_columns:
+        columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table});")]
+        if columns and column not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {column_type};")
+    for trigger in _triggers():
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger};")
+
+    conn.connection.driver_connection.executescript(schema_sql(_epoch_days))
+    conn.exec_driver_sql("ANALYZE;")
+
+
+def migrate_to_epoch_days():
+    """Convert the dates of the database from ISO dates to epoch-day numbers.
+
+    Every table with dates is copied aside, created again from the schema with dates
+    as integers, and filled back with its dates converted, all in a single transaction.
+    Its indexes and triggers are created again afterwards. Reads of days as integers
+    need no parsing, and joins on them compare integers instead of strings. As every
+    date column is converted, dates are always passed to the database as numbers.
+
+    Returns:
+    bool -- True if the days were converted, False if they were converted already
+    """
+    migrate()
+    if _epoch_days:
+        return False
+
+    triggers = [f"DROP TRIGGER IF EXISTS {trigger};" for trigger in _triggers()]
+    columns = {
+        table: [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table});")]
+        for table in _date_columns
+    }
+    statements = ["BEGIN;", *triggers]
+    for table in _date_columns:
+        statements += [
+            f"CREATE TEMP TABLE {table}Iso AS SELECT * FROM main.{table};",
+            f"DROP TABLE main.{table};",
+        ]
+    statements += [schema_sql(epoch_days=True), *triggers]
+    for table, date_column in _date_columns.items():
+        values = [
+            f"CAST(julianday({column}) - 2440587.5 AS integer)"
+            if column == date_column
+            else column
+            for column in columns[table]
+        ]
+        statements += [
+            f"""INSERT INTO main.{table} ({', '.join(columns[table])})
+            SELECT {', '.join(values)} FROM temp.{table}Iso;""",
+            f"DROP TABLE temp.{table}Iso;",
+        ]
+    statements += [
+        schema_sql(epoch_days=True),
+        f"PRAGMA user_version = {epoch_days_version};",
+        "COMMIT;",
+    ]
+
+    raw_conn = conn.connection.driver_connection
+    try:
+        raw_conn.executescript("\n".join(statements))
+    except BaseException:
+        if raw_conn.in_transaction:
+            raw_conn.execute("ROLLBACK;")
+        raise
+    _use_epoch_days(True)
+    conn.exec_driver_sql("ANALYZE;")
+    return True
+
+
+def _triggers():
+    """Return the names of the triggers in the database."""
+    return conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger';"
+    ).scalars().all()
+
+
+def _has_table(name):
+    """Report whether the database has a table of the given name."""
+    return conn.exec_driver_sql(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?;", (name,)
+    ).scalar() > 0
+
+
+def _use_epoch_days(epoch_days):
+    """Pass dates to the database as epoch-day numbers or as ISO dates, from now on."""
+    global _epoch_days
+    _epoch_days = epoch_days
+
+
+def _day_params(parameters):
+    """Return statement parameters with dates as stored in the database (see `day_value()`).
+
+    Datetimes (such as pandas Timestamps) are passed whole as ISO timestamps to
+    databases of ISO dates.
+    """
+    def value(val):
+        if isinstance(val, datetime) and not _epoch_days:
+            return val.isoformat()
+        return day_value(val) if isinstance(val, date) else val
+
+    if isinstance(parameters, dict):
+        return {name: value(val) for name, val in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return type(parameters)(value(val) for val in parameters)
+    return parameters
+
+
+@contextmanager
+def session():
+    """Check out a connection from the pool for the statements in the block.
+
+    Unlike the shared `conn`, a session connection belongs to a single unit of work,
+    so each thread can query through its own. It is returned to the pool on exit.
+    """
+    ensure_connected()
+    with engine.connect() as session_conn:
+        yield session_conn
+
+
+@contextmanager
+def shared():
+    """Yield the shared `conn` on the main thread, and a session connection on others.
+
+    The shared connection is reserved for the main thread, so that queries on other
+    threads never run within (and see the uncommitted writes of) its statements.
+    """
+    ensure_connected()
+    if threading.current_thread() is threading.main_thread():
+        yield conn
+    else:
+        with session() as session_conn:
+            yield session_conn
+
+
+@contextmanager
+def transaction():
+    """Run the statements in the block within a single database transaction.
+
+    Connections otherwise commit after every statement, so batches of writes should go
+    through this to commit (and sync to disk) only once. The transaction runs on a
+    session connection of its own (see `session()`), so readers on other connections
+    only see its writes once committed.
+    Yields the connection to execute the statements on.
+    """
+    with session() as session_conn:
+        session_conn.exec_driver_sql("BEGIN")
+        try:
+            yield session_conn
+        except BaseException:
+            session_conn.exec_driver_sql("ROLLBACK")
+            raise
+        session_conn.exec_driver_sql("COMMIT")
+
+
 def df_from_sql(sql, params, index_col, parse_dates, bindparams=None):
     """Return a dataframe from a SQL query.
 
     Return a dataframe from a sql query, given the parameters provided.
-    This function just wraps around pandas.read_sql_query, but it is useful because
-    other components may use this without exposing the database connection to them.
+    This function just wraps around pandas.read_sql_query (see `read_sql_query()`),
+    but it is useful because other components may use this without exposing the
+    database connection to them.
     """
-    ensure_connected()
     sql_text = text(sql)
     if bindparams:
         sql_text = sql_text.bindparams(*bindparams)
 
-    return pd.read_sql_query(
-        sql=sql_text,
-        con=conn,
-        params=params,
-        index_col=index_col,
-        parse_dates=parse_dates,
-    )
+    with shared() as shared_conn:
+        return read_sql_query(
+            sql=sql_text,
+            con=shared_conn,
+            params=params,
+            index_col=index_col,
+            parse_dates=parse_dates,
+        )
+
+
+def read_sql_query(sql, con, params, index_col, parse_dates):
+    """Return a dataframe from pandas.read_sql_query, parsing epoch-day numbers too.
+
+    pandas would parse integers as nanoseconds, so with days stored as epoch-day
+    numbers the dates are parsed here instead: numbers as days since 1970-01-01, and
+    anything else as pandas would.
+    """
+    if not _epoch_days:
+        return pd.read_sql_query(
+            sql=sql,
+            con=con,
+            params=params,
+            index_col=index_col,
+            parse_dates=parse_dates,
+        )
+
+    df = pd.read_sql_query(sql=sql, con=con, params=params)
+    for name in [parse_dates] if isinstance(parse_dates, str) else parse_dates or []:
+        if pd.api.types.is_numeric_dtype(df[name]):
+            df[name] = pd.to_datetime(df[name], unit="D")
+        else:
+            df[name] = pd.to_datetime(df[name])
+    return df if index_col is None else df.set_index(index_col)
@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+from datetime import date
+
+from sqlalchemy import text
+
+from db import db
+
+
+@contextmanager
+def deferred(conn):
+    """Defer the holdings updates of the transactions inserted in the block on `conn`.
+
+    The trigger updating the holdings on every transaction inserted is dropped for the
+    block, and created again afterwards. The holdings are then rebuilt once, from the
+    earliest day inserted. `conn` must be within a transaction (see `db.transaction()`),
+    so that other connections never find the trigger missing.
+    """
+    trigger = conn.exec_driver_sql(
+        """SELECT sql FROM sqlite_master
+        WHERE type = 'trigger' AND name = 'holdings_on_transaction';"""
+    ).scalar_one()
+    last = conn.exec_driver_sql(
+        "SELECT COALESCE(MAX(rowid), 0) FROM transactions;"
+    ).scalar_one()
+    conn.exec_driver_sql("DROP TRIGGER holdings_on_transaction;")
+    yield conn
+    conn.exec_driver_sql(trigger)
+    first_day = conn.exec_driver_sql(
+        f"SELECT MIN(day) FROM transactions WHERE rowid > {int(last)};"
+    ).scalar_one()
+    if first_day is not None:
+        rebuild_from(first_day, conn)
+
+
+def extend_to_today(conn=None):
+    """Extend the materialized daily holdings to the market days passed since last written.
+
+    Market days are inserted ahead of time, and the triggers only write holdings up to
+    the current date, so the holdings of the market days since are written here as they
+    pass. Readers of the holdings call this first.
+
+    Keyword arguments:
+    conn -- connection within a transaction to extend on. In a transaction of its own,
+            if None (and only if there are days to write)
+
+    Returns:
+    int -- number of holdings rows written
+    """
+    db.ensure_connected()
+    first_day = (db.conn if conn is None else conn).execute(
+        text(
+            """SELECT MIN(day) FROM marketDays
+            WHERE day <= :today
+                AND ((SELECT MAX(day) FROM holdingsDaily) IS NULL
+                    OR day > (SELECT MAX(day) FROM holdingsDaily))
+                AND EXISTS (
+                    SELECT 1 FROM transactions
+                    WHERE txType IN ('buy', 'sale', 'dividend') AND day <= :today
+                );"""
+        ),
+        {"today": date.today()},
+    ).scalar_one()
+    if first_day is None:
+        return 0
+    return rebuild_from(first_day, conn)
+
+
+def rebuild_from(day=None, conn=None):
+    """Rebuild the materialized daily holdings from a given day onwards, up to today.
+
+    The `holdingsDaily` table is kept up to date by triggers as transactions and market
+    days are inserted, and extended as days pass by `extend_to_today()`. Any other
+    change to the transactions (an update, a deletion, a bulk load with the triggers
+    dropped, or one dated before a later sale of the same ticker) needs the holdings
+    rebuilt from the earliest day affected. Holdings on the last market day before
+    `day` are kept, and used as the starting point.
+
+    Keyword arguments:
+    day -- first day to rebuild. Everything is rebuilt, if None
+    conn -- connection within a transaction to rebuild on. In a transaction of its own,
+            if None
+
+    Returns:
+    int -- number of holdings rows written
+    """
+    if day is None:
+        day = date.min
+    if conn is None:
+        with db.transaction() as conn:
+            return rebuild_from(day, conn)
+    start = conn.execute(
+        text("SELECT MAX(day) FROM marketDays WHERE day < :day;"), {"day": day}
+    ).scalar_one()
+    conn.execute(
+        text("DELETE FROM holdingsDaily WHERE :start IS NULL OR day > :start;"),
+        {"start": start},
+    )
+    # Holdings carried from the starting day, and those of tickers first moved after it
+    held = """SELECT account, ticker, MIN(first_day) AS first_day,
+            TOTAL(units) AS units, TOTAL(cost) AS cost,
+            TOTAL(distributions) AS distributions, TOTAL(realized) AS realized
+        FROM (SELECT account, ticker, day AS first_day, units, cost, distributions,
+                realizedGains AS realized
+            FROM holdingsDaily
+            WHERE day = :start
+            UNION ALL
+            SELECT account, ticker, MIN(day), 0, 0, 0, 0
+            FROM moves
+            GROUP BY account, ticker)
+        GROUP BY account, ticker"""
+    cur = conn.execute(
+        text(
+            f"""INSERT INTO holdingsDaily
+                (account, ticker, day, units, cost, distributions, realizedGains)
+            WITH RECURSIVE {booking_ctes("(:start IS NULL OR day > :start)", held)},
+            daily AS
+                (SELECT mv.account, mv.ticker,
+                    (SELECT MIN(m.day) FROM marketDays m WHERE m.day >= mv.day)
+                        AS day,
+                    TOTAL(mv.bought - mv.sold) AS units,
+                    TOTAL(b.cost - b.previous) AS cost,
+                    TOTAL(mv.dividend) AS distributions,
+                    TOTAL(mv.received - mv.paid + b.cost - b.previous) AS realized
+                FROM moves mv JOIN booked b USING (account, ticker, n)
+                GROUP BY 1, 2, 3),
+            grid AS
+                (SELECT h.account, h.ticker, m.day,
+                    0 AS units, 0 AS cost, 0 AS distributions, 0 AS realized
+                FROM held h JOIN marketDays m
+                    ON m.day >= h.first_day AND (:start IS NULL OR m.day > :start)
+                    AND m.day <= :today),
+            steps AS
+                (SELECT * FROM grid
+                UNION ALL
+                SELECT * FROM daily WHERE day <= :today)
+            SELECT s.account, s.ticker, s.day,
+                h.units + SUM(TOTAL(s.units)) OVER running,
+                h.cost + SUM(TOTAL(s.cost)) OVER running,
+                h.distributions + SUM(TOTAL(s.distributions)) OVER running,
+                h.realized + SUM(TOTAL(s.realized)) OVER running
+            FROM steps s JOIN held h USING (account, ticker)
+            GROUP BY s.account, s.ticker, s.day
+            WINDOW running AS (
+                PARTITION BY s.account, s.ticker ORDER BY s.day
+            );"""
+        ),
+        {"start": start, "today": date.today()},
+    )
+    return cur.rowcount
+
+
+def booking_ctes(where, held):
+    """Return the common table expressions that book transactions at average cost.
+
+    Buys, sales and dividends matching the `where` condition are booked per account
+    and ticker, in the order they were made, starting from the units and cost held in
+    the `held` query (by account and ticker). Sales take away their share of the cost
+    held, so the booking runs through the transactions one at a time, recursively.
+
+    Returns the `held` query and two more, for a `WITH RECURSIVE` clause:
+        - `moves`, the transactions, numbered `n` from 1 within each account and ticker,
+          with the units `bought` and `sold`, the cash `paid` and `received` for them,
+          and the `dividend` received
+        - `booked`, the `units` and `cost` held after each move, and the cost held
+          before it (`previous`). Its gains realized are `received - paid + cost -
+          previous`
+    """
+    return f"""moves AS
+        (SELECT account,
+            CASE txType WHEN 'buy' THEN target ELSE source END AS ticker,
+            day,
+            CASE txType WHEN 'buy' THEN COALESCE(units, 0) ELSE 0 END AS bought,
+            CASE txType WHEN 'sale' THEN COALESCE(units, 0) ELSE 0 END AS sold,
+            CASE txType WHEN 'buy' THEN COALESCE(total, 0) ELSE 0 END AS paid,
+            CASE txType WHEN 'sale' THEN COALESCE(total, 0) ELSE 0 END AS received,
+            CASE txType WHEN 'dividend' THEN COALESCE(total, 0) ELSE 0 END AS dividend,
+            ROW_NUMBER() OVER (
+                PARTITION BY account, CASE txType WHEN 'buy' THEN target ELSE source END
+                ORDER BY day, rowid
+            ) AS n
+        FROM transactions
+        WHERE txType IN ('buy', 'sale', 'dividend') AND {where}),
+    held AS ({held}),
+    booked (account, ticker, n, units, cost, previous) AS
+        (SELECT account, ticker, 0, units, cost, cost FROM held
+        UNION ALL
+        SELECT b.account, b.ticker, mv.n,
+            b.units + mv.bought - mv.sold,
+            CASE
+                WHEN mv.sold = 0 THEN b.cost
+                WHEN b.units > mv.sold THEN b.cost * (b.units - mv.sold) / b.units
+                ELSE 0
+            END + mv.paid,
+            b.cost
+        FROM booked b JOIN moves mv
+            ON mv.account = b.account AND mv.ticker = b.ticker AND mv.n = b.n + 1)"""
@@ -39,9 +39,176 @@ CREATE TABLE IF NOT EXISTS transactions (
     units numeric(9, 2),
     unitPrice numeric(9, 2),
     commission numeric(9, 2),
-    total numeric(12, 2) not null
+    total numeric(12, 2) not null,
+    importHash text  -- content hash of the transactions loaded by importers
 );
 
+-- Covering indexes for the component queries, which filter transactions by type,
+-- ticker (as target for buys, as source for dividends), account and day
+CREATE INDEX IF NOT EXISTS transactions_by_target ON transactions (
+    txType,
+    target,
+    account,
+    day,
+    units,
+    total
+);
+
+CREATE INDEX IF NOT EXISTS transactions_by_source ON transactions (
+    txType,
+    source,
+    account,
+    day,
+    units,
+    total
+);
+
+-- Importers look up the transactions already loaded by their content hash
+CREATE INDEX IF NOT EXISTS transactions_by_import_hash ON transactions (importHash)
+WHERE importHash IS NOT NULL;
+
+-- Cumulative units, cost, distributions and realized gains held per account and ticker,
+-- on every market day since the first transaction on the ticker, up to the last one
+-- written (at most the current date). Sales take away their share of the cost held (its
+-- average cost). Kept up to date by the triggers below as transactions and market days
+-- are inserted; db/holdings.py extends it to the days passed since, and rebuilds it
+-- otherwise
+CREATE TABLE IF NOT EXISTS holdingsDaily (
+    account text not null references accounts(name),
+    ticker text not null references assets(ticker),
+    day date not null references marketDays(day),
+    units numeric(12, 4) not null default 0,
+    cost numeric(12, 2) not null default 0,
+    distributions numeric(12, 2) not null default 0,
+    realizedGains numeric(12, 2) not null default 0,
+    primary key (account, ticker, day)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS holdings_by_day ON holdingsDaily (
+    day,
+    ticker,
+    account
+);
+
+-- Holdings are written up to the last market day already written, or the current date
+-- if none are. Sales are booked at the average cost held by the end of their market day,
+-- read once before any holdings are updated: exact as long as transactions are inserted
+-- in order
+CREATE TRIGGER IF NOT EXISTS holdings_on_transaction
+AFTER INSERT ON transactions
+WHEN NEW.txType IN ('buy', 'sale', 'dividend')
+BEGIN
+    INSERT OR IGNORE INTO holdingsDaily (account, ticker, day)
+    SELECT NEW.account,
+        CASE NEW.txType WHEN 'buy' THEN NEW.target ELSE NEW.source END,
+        day
+    FROM marketDays
+    WHERE day >= NEW.day
+        AND day <= COALESCE((SELECT MAX(day) FROM holdingsDaily), current_date);
+
+    UPDATE holdingsDaily
+    SET units = units + CASE NEW.txType
+            WHEN 'buy' THEN COALESCE(NEW.units, 0)
+            WHEN 'sale' THEN -COALESCE(NEW.units, 0)
+            ELSE 0
+        END,
+        cost = cost + CASE NEW.txType
+            WHEN 'buy' THEN NEW.total
+            WHEN 'sale' THEN -(
+                SELECT CASE
+                    WHEN COALESCE(NEW.units, 0) = 0 THEN 0
+                    WHEN h.units > NEW.units THEN h.cost * NEW.units / CAST(h.units AS real)
+                    ELSE h.cost
+                END
+                FROM holdingsDaily h
+                WHERE h.account = NEW.account
+                    AND h.ticker = NEW.source
+                    AND h.day = (SELECT MIN(day) FROM marketDays WHERE day >= NEW.day))
+            ELSE 0
+        END,
+        distributions = distributions
+            + CASE NEW.txType WHEN 'dividend' THEN NEW.total ELSE 0 END,
+        realizedGains = realizedGains + CASE NEW.txType
+            WHEN 'sale' THEN NEW.total - (
+                SELECT CASE
+                    WHEN COALESCE(NEW.units, 0) = 0 THEN 0
+                    WHEN h.units > NEW.units THEN h.cost * NEW.units / CAST(h.units AS real)
+                    ELSE h.cost
+                END
+                FROM holdingsDaily h
+                WHERE h.account = NEW.account
+                    AND h.ticker = NEW.source
+                    AND h.day = (SELECT MIN(day) FROM marketDays WHERE day >= NEW.day))
+            ELSE 0
+        END
+    WHERE account = NEW.account
+        AND ticker = CASE NEW.txType WHEN 'buy' THEN NEW.target ELSE NEW.source END
+        AND day >= NEW.day
+        AND day <= (SELECT MAX(day) FROM holdingsDaily);
+END;
+
+-- A new market day up to the current date carries the holdings of the market day before
+-- it, plus the transactions since, if no earlier market day is still to be written.
+-- Sales among those are booked at the average cost of the holdings carried and the
+-- units bought since, so they are exact unless followed by a buy
+CREATE TRIGGER IF NOT EXISTS holdings_on_market_day
+AFTER INSERT ON marketDays
+WHEN NEW.day <= current_date
+    AND NOT EXISTS (
+        SELECT 1 FROM marketDays m
+        WHERE m.day < NEW.day
+            AND ((SELECT MAX(day) FROM holdingsDaily) IS NULL
+                OR m.day > (SELECT MAX(day) FROM holdingsDaily))
+    )
+BEGIN
+    INSERT OR REPLACE INTO holdingsDaily
+        (account, ticker, day, units, cost, distributions, realizedGains)
+    SELECT account, ticker, NEW.day,
+        units + bought - sold,
+        CASE
+            WHEN sold = 0 THEN cost + paid
+            WHEN units + bought > sold THEN (cost + paid) * (units + bought - sold)
+                / (units + bought)
+            ELSE 0
+        END,
+        distributions,
+        realized + received - CASE
+            WHEN sold = 0 THEN 0
+            WHEN units + bought > sold THEN (cost + paid) * sold / (units + bought)
+            ELSE cost + paid
+        END
+    FROM (
+        SELECT account, ticker, TOTAL(units) AS units, TOTAL(cost) AS cost,
+            TOTAL(distributions) AS distributions, TOTAL(realized) AS realized,
+            TOTAL(bought) AS bought, TOTAL(sold) AS sold, TOTAL(paid) AS paid,
+            TOTAL(received) AS received
+        FROM (
+            SELECT account, ticker, units, cost, distributions,
+                realizedGains AS realized, 0 AS bought, 0 AS sold, 0 AS paid,
+                0 AS received
+            FROM holdingsDaily
+            WHERE day = (SELECT MAX(day) FROM marketDays WHERE day < NEW.day)
+            UNION ALL
+            SELECT account,
+                CASE txType WHEN 'buy' THEN target ELSE source END,
+                0, 0,
+                CASE txType WHEN 'dividend' THEN total ELSE 0 END,
+                0,
+                CASE txType WHEN 'buy' THEN COALESCE(units, 0) ELSE 0 END,
+                CASE txType WHEN 'sale' THEN COALESCE(units, 0) ELSE 0 END,
+                CASE txType WHEN 'buy' THEN total ELSE 0 END,
+                CASE txType WHEN 'sale' THEN total ELSE 0 END
+            FROM transactions t
+            WHERE txType IN ('buy', 'sale', 'dividend')
+                AND t.day <= NEW.day
+                AND NOT EXISTS (
+                    SELECT 1 FROM marketDays m WHERE m.day >= t.day AND m.day < NEW.day
+                )
+        )
+        GROUP BY account, ticker
+    );
+END;
+
 CREATE TABLE IF NOT EXISTS assetPrices (
     ticker text not null references assets(ticker),
     day date not null default current_date references marketDays(day),
@@ -71,3 +238,147 @@ CREATE TABLE IF NOT EXISTS inflationRates (
     month date not null primary key,
     rate numeric(9, 2)
 );
+
+-- Number of changes made to each table that portfolios are computed from, so that caches
+-- can tell whether their data is stale without reading it. Kept by the triggers below
+CREATE TABLE IF NOT EXISTS tableVersions (
+    name text not null primary key,
+    version integer not null default 0
+);
+
+-- Version of the last change to each day of those tables, so that portfolios can tell
+-- the earliest day changed since a version without reading the days themselves
+CREATE TABLE IF NOT EXISTS changedDays (
+    name text not null,
+    day date not null,
+    version integer not null,
+    primary key (name, day)
+);
+
+CREATE TRIGGER IF NOT EXISTS transactions_version_on_insert
+AFTER INSERT ON transactions
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('transactions', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'transactions', NEW.day, version FROM tableVersions WHERE name = 'transactions'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS transactions_version_on_update
+AFTER UPDATE ON transactions
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('transactions', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'transactions', OLD.day, version FROM tableVersions WHERE name = 'transactions'
+    UNION ALL
+    SELECT 'transactions', NEW.day, version FROM tableVersions WHERE name = 'transactions'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS transactions_version_on_delete
+AFTER DELETE ON transactions
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('transactions', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'transactions', OLD.day, version FROM tableVersions WHERE name = 'transactions'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS marketDays_version_on_insert
+AFTER INSERT ON marketDays
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('marketDays', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'marketDays', NEW.day, version FROM tableVersions WHERE name = 'marketDays'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS marketDays_version_on_update
+AFTER UPDATE ON marketDays
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('marketDays', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'marketDays', OLD.day, version FROM tableVersions WHERE name = 'marketDays'
+    UNION ALL
+    SELECT 'marketDays', NEW.day, version FROM tableVersions WHERE name = 'marketDays'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS marketDays_version_on_delete
+AFTER DELETE ON marketDays
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('marketDays', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'marketDays', OLD.day, version FROM tableVersions WHERE name = 'marketDays'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS assetPrices_version_on_insert
+AFTER INSERT ON assetPrices
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('assetPrices', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'assetPrices', NEW.day, version FROM tableVersions WHERE name = 'assetPrices'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS assetPrices_version_on_update
+AFTER UPDATE ON assetPrices
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('assetPrices', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'assetPrices', OLD.day, version FROM tableVersions WHERE name = 'assetPrices'
+    UNION ALL
+    SELECT 'assetPrices', NEW.day, version FROM tableVersions WHERE name = 'assetPrices'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS assetPrices_version_on_delete
+AFTER DELETE ON assetPrices
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('assetPrices', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'assetPrices', OLD.day, version FROM tableVersions WHERE name = 'assetPrices'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS distributions_version_on_insert
+AFTER INSERT ON distributions
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('distributions', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'distributions', NEW.day, version FROM tableVersions WHERE name = 'distributions'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS distributions_version_on_update
+AFTER UPDATE ON distributions
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('distributions', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'distributions', OLD.day, version FROM tableVersions WHERE name = 'distributions'
+    UNION ALL
+    SELECT 'distributions', NEW.day, version FROM tableVersions WHERE name = 'distributions'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS distributions_version_on_delete
+AFTER DELETE ON distributions
+BEGIN
+    INSERT INTO tableVersions (name, version) VALUES ('distributions', 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    INSERT INTO changedDays (name, day, version)
+    SELECT 'distributions', OLD.day, version FROM tableVersions WHERE name = 'distributions'
+    ON CONFLICT (name, day) DO UPDATE SET version = excluded.version;
+END;
@@ -1,9 +1,14 @@
-from datetime import datetime
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
 import pytest
 from sqlalchemy import bindparam
+from unittest.mock import patch
 
 from conftest import simple_fixture, simple_fixture_teardown
-from db.data import Data
+from db.data import Data, to_datetimes
+from util import tracer
+from util.tracer import Tracer
 
 
 class TestData:
@@ -42,3 +47,64 @@ class TestData:
 
         assert len(df) == 1
         assert df.loc[datetime(2017, 3, 2)]["amount"] == 10000
+
+    def test_unknown_fetch_engine(self):
+        with pytest.raises(ValueError, match="arrow"):
+            Data(fetch="arrow")
+
+    @pytest.mark.parametrize(
+        "sql, index_col, parse_dates",
+        [
+            # Dates declared as such, integers and floats
+            ("SELECT day, units, total FROM transactions ORDER BY rowid;", None, ["day"]),
+            # Dates from expressions, as ISO strings, indexed on two columns
+            (
+                """SELECT MIN(day) || '' AS day, target, SUM(total) AS total
+                FROM transactions WHERE txtype = 'buy' GROUP BY target;""",
+                ["day", "target"],
+                ["day"],
+            ),
+            # Nulls among the numbers and the strings of a join
+            (
+                """SELECT m.day, t.txtype, t.total
+                FROM marketdays m LEFT JOIN transactions t ON t.day = m.day
+                ORDER BY m.day, t.rowid;""",
+                "day",
+                ["day"],
+            ),
+            # No rows
+            ("SELECT day, total FROM transactions WHERE total < 0;", "day", ["day"]),
+        ],
+    )
+    def test_fetch_engines_match(self, sql, index_col, parse_dates):
+        pandas_df = Data(fetch="pandas").df_from_sql(sql, {}, index_col, parse_dates)
+        numpy_df = Data(fetch="numpy").df_from_sql(sql, {}, index_col, parse_dates)
+
+        pd.testing.assert_frame_equal(numpy_df, pandas_df)
+
+    @pytest.mark.parametrize(
+        "values",
+        [
+            (17227, None),
+            (date(2017, 3, 2), None),
+            ("2017-03-02", None),
+            (datetime(2017, 3, 2), None),
+        ],
+    )
+    def test_to_datetimes(self, values):
+        np.testing.assert_array_equal(
+            to_datetimes(values),
+            np.array(["2017-03-02", "NaT"], dtype="datetime64[ns]"),
+        )
+
+    def test_queries_are_named_only_if_traced(self):
+        sql = "SELECT day, total FROM transactions;"
+        with patch("db.data.query_name", return_value="sql:transactions") as name:
+            Data().df_from_sql(sql, {}, "day", ["day"])
+            assert not name.called
+
+            traced = Tracer()
+            with tracer.using(traced):
+                Data().df_from_sql(sql, {}, "day", ["day"])
+            name.assert_called_once_with(sql)
+        assert traced.to_dict()[0]["rows"] == 5
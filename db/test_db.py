@@ -1,9 +1,19 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from freezegun import freeze_time
 import pytest
-from sqlalchemy import bindparam, text
+import sqlite3
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.exc import IntegrityError
 
+from components.deposits import Deposits
+from components.position import Position
+from components.positions import Positions
+from components.tickers import Tickers
+import config
 from conftest import simple_fixture, simple_fixture_teardown
 from db import db
+from db.data import Data
 
 
 class TestConnectivity:
@@ -45,6 +55,124 @@ class TestConnectivity:
         assert db.is_alive()
 
 
+class TestSessions:
+    def setup_method(self):
+        simple_fixture()
+
+    def count_accounts(self, data):
+        return data.df_from_sql(
+            "SELECT COUNT(*) AS n FROM accounts;",
+            params={},
+            index_col=None,
+            parse_dates=None,
+        )["n"].iloc[0]
+
+    def test_session_shares_in_memory_database(self):
+        with Data() as data:
+            assert data._conn is not db.conn
+            assert self.count_accounts(data) == 1
+
+    def test_data_returns_to_shared_connection(self):
+        data = Data()
+        with data:
+            pass
+
+        assert data._conn is db.conn
+
+    def test_file_database_settings(self, file_database):
+        file_database(pool_size=3, busy_timeout=1234)
+
+        with db.session() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode;").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA busy_timeout;").scalar() == 1234
+        assert db.engine.pool.size() == 3
+
+    def test_readers_do_not_wait_for_writer(self, file_database):
+        file_database()
+
+        def read():
+            with Data() as data:
+                return self.count_accounts(data)
+
+        with db.transaction() as conn:
+            conn.execute(
+                text(
+                    """INSERT INTO accounts (name, accounttype, investor, datecreated)
+                    VALUES ('RRSP2', 'RRSP', 'Someone', '2017-03-01');"""
+                )
+            )
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                during = list(executor.map(lambda _: read(), range(2)))
+
+        assert during == [1, 1]
+        assert read() == 2
+
+    def test_readers_do_not_join_transactions(self, file_database):
+        file_database()
+
+        def read_shared():
+            return self.count_accounts(Data()), self.count_accounts(db)
+
+        with db.transaction() as conn:
+            assert conn is not db.conn
+            conn.execute(
+                text(
+                    """INSERT INTO accounts (name, accounttype, investor, datecreated)
+                    VALUES ('RRSP2', 'RRSP', 'Someone', '2017-03-01');"""
+                )
+            )
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                during = list(executor.map(lambda _: read_shared(), range(2)))
+            main = read_shared()
+
+        assert during == [(1, 1), (1, 1)]
+        assert main == (1, 1)
+        assert read_shared() == (2, 2)
+
+
+class TestProfiles:
+    def setup_method(self):
+        simple_fixture()
+
+    def pragma(self, name):
+        return db.conn.exec_driver_sql(f"PRAGMA {name};").scalar()
+
+    def test_default_profile(self, file_database):
+        file_database()
+
+        assert self.pragma("journal_mode") == "wal"
+        assert self.pragma("synchronous") == 1  # NORMAL
+
+    def test_reporting_profile_is_read_only(self, file_database):
+        file_database()
+        db.connect("test", "reporting")
+
+        assert self.pragma("journal_mode") == "wal"
+        assert self.pragma("cache_size") == -65536
+        assert self.pragma("temp_store") == 2  # MEMORY
+        assert self.pragma("mmap_size") > 0
+        with pytest.raises(Exception, match="readonly"):
+            db.conn.exec_driver_sql("INSERT INTO investors (name) VALUES ('Nobody');")
+
+    def test_reconnects_with_same_profile(self, file_database):
+        file_database()
+        db.connect("test", "reporting")
+        db.conn.close()
+        db.ensure_connected()
+
+        assert self.pragma("cache_size") == -65536
+
+    def test_profiles_apply_to_in_memory_databases(self):
+        db.connect("test", "reporting")
+
+        assert self.pragma("journal_mode") == "memory"
+        assert self.pragma("temp_store") == 2
+
+    def test_unknown_profile(self):
+        with pytest.raises(KeyError):
+            db.connect("test", "broken")
+
+
 class TestDfFromSql:
     def setup_method(self):
         simple_fixture()
@@ -77,3 +205,279 @@ class TestDfFromSql:
 
         assert len(df) == 1
         assert df.loc[datetime(2017, 3, 2)]["amount"] == 10000
+
+
+class TestChangedDays:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_nothing_changed(self):
+        assert db.first_changed_day(db.table_versions()) is None
+
+    def test_earliest_day_changed(self):
+        versions = db.table_versions()
+        db.conn.execute(
+            text(
+                """INSERT INTO transactions (day, txtype, account, source, target, total)
+                VALUES ('2017-03-07', 'deposit', 'RRSP1', null, 'Cash', 100);"""
+            )
+        )
+        db.conn.execute(
+            text(
+                """UPDATE assetprices SET day = '2017-03-09'
+                WHERE ticker = 'VEE.TO' AND day = '2017-03-06';"""
+            )
+        )
+
+        assert db.first_changed_day(versions) == date(2017, 3, 6)
+        assert db.first_changed_day(db.table_versions()) is None
+
+    def test_earliest_day_changed_with_epoch_days(self):
+        db.migrate_to_epoch_days()
+        versions = db.table_versions()
+        db.conn.execute(
+            text("DELETE FROM distributions WHERE day = :day;"),
+            {"day": date(2017, 3, 3)},
+        )
+
+        assert db.first_changed_day(versions) == date(2017, 3, 3)
+
+
+class TestMigrate:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_migrate_is_idempotent(self):
+        db.migrate()
+        db.migrate()
+
+        indexes = [
+            row.name
+            for row in db.conn.execute(
+                text(
+                    """SELECT name FROM sqlite_master
+                    WHERE type = 'index' AND tbl_name = 'transactions';"""
+                )
+            )
+        ]
+        assert "transactions_by_target" in indexes
+        assert "transactions_by_source" in indexes
+
+    def test_migrate_adds_new_columns_to_existing_tables(self):
+        db.conn.exec_driver_sql("DROP INDEX transactions_by_import_hash;")
+        db.conn.exec_driver_sql("ALTER TABLE transactions DROP COLUMN importHash;")
+        db.migrate()
+
+        columns = [
+            row[1] for row in db.conn.exec_driver_sql("PRAGMA table_info(transactions);")
+        ]
+        assert "importHash" in columns
+        assert db.conn.execute(text("SELECT COUNT(*) FROM transactions;")).scalar() == 5
+
+    def test_migrate_analyzes_tables(self):
+        db.migrate()
+
+        stats = db.conn.execute(
+            text("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'transactions';")
+        ).fetchone()[0]
+        assert stats > 0
+
+
+class TestEpochDays:
+    def setup_method(self):
+        simple_fixture()
+
+    def day_types(self):
+        return {
+            table: db.conn.execute(
+                text(f"SELECT DISTINCT typeof({column}) FROM {table};")
+            ).scalars().all()
+            for table, column in db._date_columns.items()
+        }
+
+    def test_migrate_to_epoch_days(self):
+        db.conn.execute(
+            text("INSERT INTO inflationRates (month, rate) VALUES ('2017-03-01', 0.2);")
+        )
+        holdings = db.conn.execute(text("SELECT COUNT(*) FROM holdingsDaily;")).scalar()
+        triggers = set(db._triggers())
+
+        assert db.migrate_to_epoch_days()
+        assert not db.migrate_to_epoch_days()
+
+        assert db.schema_version() == db.epoch_days_version
+        assert db.uses_epoch_days()
+        assert self.day_types() == {table: ["integer"] for table in db._date_columns}
+        first_day = db.conn.execute(text("SELECT MIN(day) FROM marketDays;")).scalar()
+        assert db.as_date(first_day) == date(2017, 3, 2)
+        assert (
+            db.conn.execute(text("SELECT COUNT(*) FROM holdingsDaily;")).scalar()
+            == holdings
+        )
+        assert set(db._triggers()) == triggers
+
+    def test_epoch_days_are_written_and_read_as_dates(self):
+        db.migrate_to_epoch_days()
+        db.conn.execute(
+            text(
+                """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+                VALUES (:day, 'buy', 'RRSP1', 'Cash', 'VCN.TO', 10, 298.85);"""
+            ),
+            {"day": date(2017, 3, 7)},
+        )
+
+        held = Data().df_from_sql(
+            """SELECT day, units FROM holdingsDaily
+            WHERE ticker = 'VCN.TO' AND day >= :from_day;""",
+            params={"from_day": datetime(2017, 3, 6)},
+            index_col="day",
+            parse_dates=["day"],
+        )
+        assert held["units"].to_dict() == {
+            datetime(2017, 3, 6): 100,
+            datetime(2017, 3, 7): 110,
+            datetime(2017, 3, 8): 110,
+        }
+        with pytest.raises(IntegrityError):
+            db.conn.execute(text("INSERT INTO marketDays (day) VALUES ('2017-03-09');"))
+
+    def test_every_date_column_is_written_as_epoch_days(self):
+        db.migrate_to_epoch_days()
+        db.conn.execute(
+            text(
+                """INSERT INTO accounts (name, accountType, investor, dateCreated)
+                VALUES ('TFSA1', 'RRSP', 'Someone', :date_created);"""
+            ),
+            {"date_created": date(2017, 3, 1)},
+        )
+
+        created = db.conn.execute(
+            text("SELECT name, dateCreated FROM accounts ORDER BY dateCreated;")
+        ).fetchall()
+        assert [(name, db.as_date(day)) for name, day in created] == [
+            ("TFSA1", date(2017, 3, 1)),
+            ("RRSP1", date(2017, 3, 2)),
+        ]
+
+    def test_dates_of_any_type_are_written_as_epoch_days(self):
+        adapters = dict(sqlite3.adapters)
+        db.migrate_to_epoch_days()
+
+        class Day(date):
+            pass
+
+        for day in [Day(2017, 3, 7), datetime(2017, 3, 8, 12)]:
+            db.conn.execute(
+                text("INSERT INTO assetPrices (ticker, day, close) VALUES ('X', :day, 1);"),
+                {"day": day},
+            )
+        days = db.conn.execute(
+            text("SELECT day FROM assetPrices WHERE ticker = 'X' ORDER BY day;")
+        ).scalars()
+        assert list(days) == [db.day_value(date(2017, 3, day)) for day in (7, 8)]
+        assert sqlite3.adapters == adapters
+
+    def test_failed_migration_leaves_days_as_they_were(self):
+        db.conn.execute(
+            text(
+                """INSERT INTO assetPrices (ticker, day, close)
+                VALUES ('VCN.TO', 'someday', 30.00);"""
+            )
+        )
+
+        with pytest.raises(sqlite3.IntegrityError, match="NOT NULL"):
+            db.migrate_to_epoch_days()
+
+        assert db.schema_version() == 0
+        assert not db.uses_epoch_days()
+        assert self.day_types()["marketDays"] == ["text"]
+        assert db.conn.execute(text("SELECT COUNT(*) FROM transactions;")).scalar() == 5
+
+    def test_new_databases_store_epoch_days_if_configured(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(
+            config.db,
+            "test",
+            {"type": "sqlite", "path": str(tmp_path / "finance.db"), "epoch_days": True},
+        )
+        db.connect("test")
+        db.migrate()
+        db.connect("test")
+
+        assert db.schema_version() == db.epoch_days_version
+        assert db.uses_epoch_days()
+        assert db.day_value(date(1970, 1, 2)) == 1
+
+
+class TestQueryPlans:
+    def setup_method(self):
+        simple_fixture()
+        # A longer history, so that the planner statistics favour the indexes
+        db.conn.execute(
+            text(
+                """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+                VALUES (:day, :txtype, :account, :source, :target, 1, 10);"""
+            ),
+            [
+                {
+                    "day": f"2017-03-0{2 + i % 7}",
+                    "txtype": txtype,
+                    "account": f"ACCOUNT{i % 50}",
+                    "source": "VCN.TO" if txtype == "dividend" else "Cash",
+                    "target": "Cash" if txtype == "dividend" else f"TICKER{i % 200}",
+                    "units": 1,
+                }
+                for i in range(2000)
+                for txtype in ["buy", "dividend", "deposit"]
+            ],
+        )
+        db.migrate()
+
+    def transactions_plans(self, build):
+        """Build components, and return the query plans of their queries on transactions."""
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if "FROM transactions" in statement:
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            with freeze_time(datetime(2017, 3, 7)):
+                build()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+
+        raw_conn = db.conn.connection.driver_connection
+        return [
+            [
+                row[3]
+                for row in raw_conn.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            ]
+            for statement, parameters in statements
+        ]
+
+    def assert_uses_indexes(self, plans):
+        assert len(plans) > 0
+        for plan in plans:
+            on_transactions = [step for step in plan if " transactions" in step]
+            assert len(on_transactions) > 0
+            for step in on_transactions:
+                assert step.startswith("SEARCH transactions USING"), step
+                assert "transactions_by_" in step, step
+
+    def test_tickers_use_indexes(self):
+        self.assert_uses_indexes(self.transactions_plans(lambda: Tickers(data=Data())))
+
+    def test_positions_use_indexes(self):
+        tickers = Tickers(data=Data())
+        self.assert_uses_indexes(
+            self.transactions_plans(lambda: Positions(tickers=tickers, data=Data()))
+        )
+
+    def test_position_uses_indexes(self):
+        self.assert_uses_indexes(
+            self.transactions_plans(lambda: Position("VCN.TO", data=Data()))
+        )
+
+    def test_deposits_use_indexes(self):
+        self.assert_uses_indexes(self.transactions_plans(lambda: Deposits(data=Data())))
@@ -0,0 +1,182 @@
+from datetime import date, timedelta
+
+from freezegun import freeze_time
+import pandas as pd
+from pytest import approx
+from sqlalchemy import text
+
+from conftest import simple_fixture
+from db import db, holdings
+
+
+def holdings_df():
+    return pd.read_sql_query(
+        sql=text(
+            """SELECT account, ticker, day, units, cost, distributions, realizedGains
+            FROM holdingsDaily
+            ORDER BY account, ticker, day;"""
+        ),
+        con=db.conn,
+    )
+
+
+def test_triggers_maintain_holdings():
+    simple_fixture()
+
+    df = holdings_df()
+    vcn = df[df["ticker"] == "VCN.TO"].set_index("day")
+    assert list(vcn.index) == [date(2017, 3, day) for day in range(3, 9)]
+    assert vcn["units"].tolist() == approx([100.0] * 6)
+    assert vcn["cost"].tolist() == approx([3010.35] * 6)
+    assert vcn["distributions"].tolist() == approx([10.10, 10.10, 10.10, 20.00, 20.00, 20.00])
+    vee = df[df["ticker"] == "VEE.TO"].set_index("day")
+    assert vee["distributions"].tolist() == approx([0.0] * 6)
+
+
+def test_backdated_transaction():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES ('2017-03-02', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 10, 300);"""
+        )
+    )
+
+    df = holdings_df()
+    vcn = df[df["ticker"] == "VCN.TO"].set_index("day")
+    assert vcn.index[0] == date(2017, 3, 2)
+    assert vcn["units"].tolist() == approx([10.0] + [110.0] * 6)
+    assert vcn["cost"].tolist() == approx([300.0] + [3310.35] * 6)
+
+
+def test_new_market_day_carries_holdings():
+    simple_fixture()
+    db.conn.execute(text("INSERT INTO marketdays (day, open) VALUES ('2017-03-09', 1);"))
+
+    df = holdings_df()
+    latest = df[df["day"] == date(2017, 3, 9)].set_index("ticker")
+    assert latest.loc["VCN.TO", "units"] == approx(100.0)
+    assert latest.loc["VCN.TO", "distributions"] == approx(20.0)
+    assert latest.loc["VEE.TO", "cost"] == approx(2800.35)
+
+
+def test_holdings_are_written_up_to_today_and_extended_as_days_pass():
+    simple_fixture()
+    today = date.today()
+    ahead = [today + timedelta(days=n) for n in range(1, 4)]
+    for day in ahead:
+        db.conn.execute(
+            text("INSERT INTO marketdays (day, open) VALUES (:day, 1);"), {"day": day}
+        )
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES (:day, 'buy', 'RRSP1', 'Cash', 'VCN.TO', 10, 300);"""
+        ),
+        {"day": ahead[1]},
+    )
+
+    assert holdings_df()["day"].max() == date(2017, 3, 8)
+    assert holdings.extend_to_today() == 0
+    with freeze_time(ahead[1]):
+        assert holdings.extend_to_today() == 4
+        assert holdings.extend_to_today() == 0
+    extended = holdings_df()
+    vcn = extended[extended["ticker"] == "VCN.TO"].set_index("day")
+    assert list(vcn.index[-2:]) == ahead[:2]
+    assert vcn["units"].tolist()[-2:] == approx([100.0, 110.0])
+    assert vcn["cost"].tolist()[-2:] == approx([3010.35, 3310.35])
+    with freeze_time(ahead[1]):
+        holdings.rebuild_from()
+    pd.testing.assert_frame_equal(holdings_df(), extended)
+
+
+def test_sales_take_out_their_average_cost():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES ('2017-03-06', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 100, 2989.65),
+                ('2017-03-06', 'sale', 'RRSP1', 'VCN.TO', 'Cash', 50, 1492.50),
+                ('2017-03-07', 'sale', 'RRSP1', 'VCN.TO', 'Cash', 50, 1492.50);"""
+        )
+    )
+    maintained = holdings_df()
+
+    vcn = maintained[maintained["ticker"] == "VCN.TO"].set_index("day")
+    assert vcn["units"].tolist() == approx([100.0] * 3 + [150.0] + [100.0] * 2)
+    assert vcn["cost"].tolist() == approx([3010.35] * 3 + [4500.0] + [3000.0] * 2)
+    assert vcn["realizedGains"].tolist() == approx([0.0] * 3 + [-7.5] + [-15.0] * 2)
+    holdings.rebuild_from()
+    pd.testing.assert_frame_equal(holdings_df(), maintained)
+
+
+def test_new_market_day_books_sales_since_the_last():
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES ('2017-03-09', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 100, 2989.65),
+                ('2017-03-09', 'sale', 'RRSP1', 'VCN.TO', 'Cash', 50, 1492.50),
+                ('2017-03-09', 'sale', 'RRSP1', 'VEE.TO', 'Cash', 100, 3100.00);"""
+        )
+    )
+    db.conn.execute(text("INSERT INTO marketdays (day, open) VALUES ('2017-03-09', 1);"))
+    maintained = holdings_df()
+
+    latest = maintained[maintained["day"] == date(2017, 3, 9)].set_index("ticker")
+    assert latest.loc["VCN.TO", "units"] == approx(150.0)
+    assert latest.loc["VCN.TO", "cost"] == approx(4500.0)
+    assert latest.loc["VCN.TO", "realizedGains"] == approx(-7.5)
+    assert latest.loc["VEE.TO", "units"] == approx(0.0)
+    assert latest.loc["VEE.TO", "cost"] == approx(0.0)
+    assert latest.loc["VEE.TO", "realizedGains"] == approx(299.65)
+    holdings.rebuild_from()
+    pd.testing.assert_frame_equal(holdings_df(), maintained)
+
+
+def test_rebuild_matches_triggers():
+    simple_fixture()
+    maintained = holdings_df()
+
+    written = holdings.rebuild_from()
+
+    assert written == len(maintained)
+    pd.testing.assert_frame_equal(holdings_df(), maintained)
+
+
+def test_rebuild_from_day_after_deletion():
+    simple_fixture()
+    db.conn.execute(
+        text("DELETE FROM transactions WHERE txtype = 'dividend' AND day = '2017-03-06';")
+    )
+
+    written = holdings.rebuild_from(date(2017, 3, 6))
+
+    assert written == 6
+    df = holdings_df()
+    vcn = df[df["ticker"] == "VCN.TO"].set_index("day")
+    assert vcn["distributions"].tolist() == approx([10.10] * 6)
+    assert vcn["units"].tolist() == approx([100.0] * 6)
+
+
+def test_deferred_holdings_match_triggers():
+    simple_fixture()
+    before = holdings_df()
+    insert = """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+        VALUES ('2017-03-06', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 10, 300),
+            ('2017-03-07', 'dividend', 'RRSP1', 'VEE.TO', 'Cash', 100, 12.5);"""
+    db.conn.execute(text(insert))
+    maintained = holdings_df()
+    db.conn.execute(text("DELETE FROM transactions WHERE rowid > 5;"))
+    holdings.rebuild_from(date(2017, 3, 6))
+
+    with db.transaction() as conn, holdings.deferred(conn):
+        conn.execute(text(insert))
+        pd.testing.assert_frame_equal(holdings_df(), before)
+
+    pd.testing.assert_frame_equal(holdings_df(), maintained)
+    triggers = db.conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'trigger';")
+    ).scalars()
+    assert "holdings_on_transaction" in list(triggers)
@@ -1,16 +1,25 @@
 #!/usr/bin/env python3
 """
-Dividend CSV to SQL converter.
+Dividend CSV importer.
 
-Reads a dividend CSV file from a brokerage and generates SQL INSERT statements
-for the transactions table, grouped by account.
+Streams dividend CSV files from a brokerage in chunks, and loads them as dividend
+transactions straight into the database, in a single database transaction.
+Transactions already loaded, by this or any earlier import, are skipped.
 """
 
 import argparse
 import csv
-import re
-from collections import defaultdict
-from datetime import datetime
+from datetime import date
+import hashlib
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from db import db, holdings
+
+
+# Columns of the transactions loaded, in the order they are inserted
+columns = ['txType', 'account', 'source', 'target', 'day', 'units', 'unitPrice', 'total']
 
 
 def load_account_mapping(account_codes_file):
@@ -26,113 +35,162 @@ def load_account_mapping(account_codes_file):
     return mapping
 
 
-def extract_share_count(description):
-    """Extract number of shares from description string.
+def extract_share_counts(descriptions):
+    """Extract the number of shares from a Series of description strings.
 
     Example: "DIST ON 52 SHS REC 12/30/25" -> 52
     """
-    match = re.search(r'DIST ON (\d+) SHS', description)
-    if match:
-        return int(match.group(1))
-    raise ValueError(f"Could not extract share count from: {description}")
+    shares = descriptions.str.extract(r'DIST ON (\d+) SHS', expand=False)
+    missing = shares.isna()
+    if missing.any():
+        raise ValueError(
+            f"Could not extract share count from: {descriptions[missing].iloc[0]}"
+        )
+    return shares.astype(int)
+
+
+def parse_dividends(chunk, account_mapping):
+    """Parse a chunk of a dividend CSV into a DataFrame of dividend transactions."""
+    accounts = chunk['Account #'].str.strip().map(account_mapping)
+    unknown = accounts.isna()
+    if unknown.any():
+        raise ValueError(f"Unknown account code: {chunk['Account #'][unknown].iloc[0]}")
+
+    return pd.DataFrame({
+        'txType': 'dividend',
+        'account': accounts,
+        'source': chunk['Symbol'].str.strip() + '.TO',
+        'target': 'Cash',
+        'day': pd.to_datetime(
+            chunk['Settlement Date'], format='%Y-%m-%d %I:%M:%S %p'
+        ).dt.strftime('%Y-%m-%d'),
+        'units': extract_share_counts(chunk['Description']),
+        'unitPrice': chunk['Price'].astype(float),
+        'total': chunk['Net Amount'].astype(float),
+    })
+
+
+def read_dividends(dividend_files, account_mapping, chunksize=10000):
+    """Yield DataFrames of dividend transactions, in chunks of rows of the CSV files.
+
+    Empty chunks (such as that of a file with only a header) are skipped.
+    """
+    for dividend_file in dividend_files:
+        for chunk in pd.read_csv(dividend_file, dtype=str, chunksize=chunksize):
+            if len(chunk) > 0:
+                yield parse_dividends(chunk, account_mapping)
 
 
-def parse_dividend_csv(dividend_file, account_mapping):
-    """Parse dividend CSV and return transactions grouped by account."""
-    transactions = defaultdict(list)
+def content_hashes(transactions):
+    """Return the content hash of each transaction, over the loaded columns.
 
-    with open(dividend_file, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # Extract and convert data
-            settlement_date = datetime.strptime(
-                row['Settlement Date'],
-                '%Y-%m-%d %I:%M:%S %p'
-            ).strftime('%Y-%m-%d')
-
-            symbol = row['Symbol'].strip() + '.TO'
-            account_code = row['Account #'].strip()
-
-            # Get account name from mapping
-            if account_code not in account_mapping:
-                raise ValueError(f"Unknown account code: {account_code}")
-            account_name = account_mapping[account_code]
-
-            # Extract share count from description
-            shares = extract_share_count(row['Description'])
-
-            # Get price and net amount
-            price = float(row['Price'])
-            net_amount = float(row['Net Amount'])
-
-            # Create transaction tuple
-            transaction = {
-                'txType': 'dividend',
-                'account': account_name,
-                'source': symbol,
-                'target': 'Cash',
-                'day': settlement_date,
-                'units': shares,
-                'unitPrice': price,
-                'total': net_amount
-            }
-
-            transactions[account_name].append(transaction)
-
-    return transactions
-
-
-def format_sql_value(value):
-    """Format a value for SQL insertion."""
-    if isinstance(value, str):
-        return f"'{value}'"
-    elif isinstance(value, (int, float)):
-        return str(value)
-    else:
-        return str(value)
-
-
-def generate_sql(transactions):
-    """Generate SQL INSERT statements grouped by account."""
-    sql_statements = []
-
-    for account_name in sorted(transactions.keys()):
-        txs = transactions[account_name]
-
-        # Start INSERT statement
-        sql = "INSERT INTO transactions (txType, account, source, target, day, units, unitPrice, total)\n"
-        sql += "VALUES\n"
-
-        # Add each transaction
-        values = []
-        for tx in txs:
-            value_str = f"    ({format_sql_value(tx['txType'])}, " \
-                       f"{format_sql_value(tx['account'])}, " \
-                       f"{format_sql_value(tx['source'])}, " \
-                       f"{format_sql_value(tx['target'])}, " \
-                       f"{format_sql_value(tx['day'])}, " \
-                       f"{format_sql_value(tx['units'])}, " \
-                       f"{format_sql_value(tx['unitPrice'])}, " \
-                       f"{format_sql_value(tx['total'])})"
-            values.append(value_str)
-
-        sql += ",\n".join(values) + ";\n"
-        sql_statements.append(sql)
-
-    return "\n".join(sql_statements)
+    Values are formatted the same way whether they are parsed or read back from the
+    database, so that the same transaction always hashes the same.
+    """
+    parts = [
+        transactions[column].astype(float).round(6).astype(str)
+        if column in ('units', 'unitPrice', 'total')
+        else transactions[column].fillna('').astype(str)
+        for column in columns
+    ]
+    keys = parts[0].str.cat(parts[1:], sep='|')
+    return pd.Series(
+        [hashlib.sha1(key.encode()).hexdigest() for key in keys],
+        index=transactions.index,
+    )
+
+
+def import_dividends(dividend_files, account_mapping, chunksize=10000):
+    """Load the dividends of the CSV files into the transactions table.
+
+    Every chunk is inserted with a single parameterized `executemany`, all within one
+    database transaction, and the holdings are rebuilt once at the end. Dividends
+    loaded earlier without a hash (such as those from SQL files) are hashed as they
+    are found, so they are skipped as well.
+
+    Returns:
+    DataFrame -- the transactions inserted, with their `importHash`
+    """
+    inserted = []
+    with db.transaction() as conn, holdings.deferred(conn):
+        for chunk in read_dividends(dividend_files, account_mapping, chunksize):
+            chunk['importHash'] = content_hashes(chunk)
+            chunk = chunk.drop_duplicates('importHash')
+            _hash_loaded(conn, chunk['day'].min(), chunk['day'].max())
+            loaded = _loaded_hashes(conn, chunk['importHash'].tolist())
+            new = chunk[~chunk['importHash'].isin(loaded)]
+            if len(new) > 0:
+                conn.exec_driver_sql(
+                    f"""INSERT INTO transactions ({', '.join(new.columns)})
+                    VALUES ({', '.join(['?'] * len(new.columns))});""",
+                    list(
+                        new.assign(day=pd.to_datetime(new['day']).dt.date)
+                        .itertuples(index=False, name=None)
+                    ),
+                )
+            inserted.append(new)
+    if not inserted:
+        return pd.DataFrame(columns=columns + ['importHash'])
+    return pd.concat(inserted, ignore_index=True)
+
+
+def _hash_loaded(conn, first_day, last_day):
+    """Hash the dividends loaded without a hash between two days."""
+    loaded = pd.read_sql_query(
+        sql=text(
+            f"""SELECT rowid, {', '.join(columns)}
+            FROM transactions
+            WHERE txType = 'dividend'
+                AND day BETWEEN :first_day AND :last_day
+                AND importHash IS NULL;"""
+        ),
+        con=conn,
+        params={
+            'first_day': date.fromisoformat(first_day),
+            'last_day': date.fromisoformat(last_day),
+        },
+    )
+    if len(loaded) > 0:
+        loaded['day'] = loaded['day'].map(db.as_date).astype(str)
+        conn.exec_driver_sql(
+            "UPDATE transactions SET importHash = ? WHERE rowid = ?;",
+            list(zip(content_hashes(loaded), loaded['rowid'].tolist())),
+        )
+
+
+def _loaded_hashes(conn, hashes):
+    """Return the set of the given hashes that are already in the transactions."""
+    cur = conn.execute(
+        text(
+            """SELECT importHash FROM transactions
+            WHERE importHash IN :hashes;"""
+        ).bindparams(bindparam('hashes', expanding=True)),
+        {'hashes': hashes},
+    )
+    return {row.importHash for row in cur}
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description='Convert dividend CSV to SQL INSERT statements'
+        description='Import dividend CSV files into the transactions table'
     )
-    parser.add_argument('input_file', help='Input dividend CSV file')
-    parser.add_argument('output_file', help='Output SQL file')
+    parser.add_argument('input_files', nargs='+', help='Input dividend CSV files')
     parser.add_argument(
         '--account-codes',
         default='data/account_codes.csv',
         help='Account codes mapping file (default: data/account_codes.csv)'
     )
+    parser.add_argument(
+        '-e', '--env',
+        default='prod',
+        help='Database environment to import into (default: prod)'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=10000,
+        help='Rows of CSV to read and insert at a time (default: 10000)'
+    )
 
     args = parser.parse_args()
 
@@ -141,25 +199,15 @@ def main():
     account_mapping = load_account_mapping(args.account_codes)
     print(f"Loaded {len(account_mapping)} account mappings")
 
-    # Parse dividend CSV
-    print(f"Parsing dividend data from {args.input_file}...")
-    transactions = parse_dividend_csv(args.input_file, account_mapping)
-
-    total_txs = sum(len(txs) for txs in transactions.values())
-    print(f"Parsed {total_txs} transactions across {len(transactions)} accounts")
-
-    # Generate SQL
-    print(f"Generating SQL...")
-    sql = generate_sql(transactions)
-
-    # Write to output file
-    with open(args.output_file, 'w') as f:
-        f.write(sql)
+    # Import dividends
+    print(f"Importing dividend data from {', '.join(args.input_files)}...")
+    db.connect(args.env)
+    inserted = import_dividends(args.input_files, account_mapping, args.chunk_size)
 
-    print(f"SQL statements written to {args.output_file}")
+    print(f"Inserted {len(inserted)} transactions")
     print("\nSummary:")
-    for account_name in sorted(transactions.keys()):
-        print(f"  {account_name}: {len(transactions[account_name])} transactions")
+    for account_name, count in inserted.groupby('account').size().items():
+        print(f"  {account_name}: {count} transactions")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,32 @@
+from docopt import docopt
+
+from db import db, holdings
+
+usage = """
+Bring the database schema up to date, refresh its statistics, and rebuild the
+materialized daily holdings.
+
+With --epoch-days, the days stored as ISO dates are converted to epoch-day numbers
+(days since 1970-01-01) first, in a single transaction. This cannot be undone.
+
+Usage:
+    migrate.py [-h] [--env <env>] [--epoch-days]
+
+Options:
+    -h --help               Show this
+    -e <env> --env <env>    Environment to migrate [default: prod]
+    --epoch-days            Store days as epoch-day numbers
+"""
+
+
+def main(args):
+    db.ensure_connected(args["--env"])
+    if args["--epoch-days"] and db.migrate_to_epoch_days():
+        print("Days converted to epoch-day numbers")
+    db.migrate()
+    holdings.rebuild_from()
+
+
+if __name__ == "__main__":
+    args = docopt(usage, argv=None, help=True, version=None, options_first=False)
+    main(args)
@@ -1,4 +1,5 @@
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import date, timedelta
 import numpy as np
 import pandas as pd
 
@@ -13,8 +14,18 @@ import config
 from db import db
 from db.data import Data
 from util.determine_accounts import determine_accounts
+from util.compact_frame import CompactFrame
+from util.drawdown import (
+    drawdowns,
+    initial_state as drawdown_initial_state,
+    last_drawdowns,
+)
 from util.relative_rate import relative_rate
+from util.portfolio_cache import PortfolioCache
+from util.lazy_frame import LazyFrame, Metric
 from util.price_updater import PriceUpdater
+from util import tracer
+from util.tracer import Tracer
 
 
 class Portfolio:
@@ -28,14 +39,25 @@ class Portfolio:
     current_year() -- Return the current year's metrics
     previous_year() -- Return last year's metrics
     allocations() -- Return the latest asset allocations
+    refresh() -- Bring the portfolio up to date, loading only the days since the last one held
 
     Instance variables:
     accounts -- list, the accounts for this portfolio. If None, the portfolio represents all accounts
     from_day -- date, the start date for accounting. If None, data is not filtered by date
-    deposits -- Deposits object, with all deposits relevant to the portfolio
-    tickers -- Tickers object, with all tickers relevant to the portfolio
+    materialized -- bool, whether positions are read from the materialized daily holdings
+    compact -- bool, whether `by_day` is held with compact dtypes and some columns derived on access
+    timings -- Tracer object with the time spent in each stage and SQL query, if traced.
+               Dumped with `timings.to_json()`, or `timings.folded()` for flamegraphs
+    workers -- int, number of threads to read tickers and positions with. A single read, if None
+    calendar -- MarketCalendar to generate market days from. Read from the database, if None
+    cost_method -- str, method to assign a cost to the units sold, `acb` (average cost) or `fifo`
+    deposits -- Deposits object, with all deposits relevant to the portfolio.
+                Loaded on first access when the portfolio is restored from cache or refreshed
+    tickers -- Tickers object, with all tickers relevant to the portfolio.
+               Loaded on first access when the portfolio is restored from cache or refreshed
     positions -- Positions object, with performance data for all positions in the portfolio
-    by_day -- DataFrame indexed by day, with the following Series:
+    by_day -- DataFrame indexed by day, computed on first access (`val()` and `latest()`
+              only compute the metrics they need), with the following Series:
         - `days_from_start` int, days from the date the account was opened
         - `years_from_start` float, years from the date the account was opened
         - `market_day` bool, whether the market was open on this date
@@ -46,6 +68,7 @@ class Portfolio:
         - `positions_value`, sum of the current market valuations of all positions in the portfolio on this date
         - `appreciation` float, the current market valuation minus the position cost
         - `dividends` float, sum of dividends received to this date
+        - `realized_gains` float, sum of the gains realized by sales to this date
         - `cash` float, cash held by the end of this date
         - `total_value` float, sum of the market value of all the positions *and* cash by the end of this date
         - `day_profit` float, difference between the market value on this date and the day before
@@ -63,6 +86,8 @@ class Portfolio:
         - `last_peak_twrr` float, time-weighted returns at the highest point in the lifetime of the portfolio to date
         - `current_drawdown` float, percentage drop in returns from the last peak
         - `greatest_drawdown` float, greatest percentage drop in returns in the lifetime of the portfolio
+        - `drawdown_duration` float, days since the last peak
+        - `recovery_days` float, on the days a drawdown ends, days it took to recover from its peak
         - `sharpe` float, Sharpe ratio of the portfolio as a whole
     by_month -- DataFrame indexed by end of month, similar to by_day but
                 with the following additional Series:
@@ -71,12 +96,51 @@ class Portfolio:
         - `month_returns` float, mirroring `day_returns` in `by_day`
     """
 
+    # by_day columns holding ratios, stored with the compact `ratios` dtype in compact mode
+    ratio_columns = [
+        "day_returns",
+        "twrr",
+        "mwrr",
+        "volatility",
+        "last_peak_twrr",
+        "current_drawdown",
+        "greatest_drawdown",
+        "sharpe",
+    ]
+
+    # by_day columns holding numbers of days, stored as integers in compact mode
+    count_columns = ["drawdown_duration", "recovery_days"]
+
+    # by_day columns not stored in compact mode, but computed on access from other columns
+    derived_columns = [
+        "years_from_start",
+        "appreciation",
+        "cash",
+        "profit",
+        "appreciation_returns",
+        "distribution_returns",
+        "returns",
+        "twrr_annualized",
+        "mwrr_annualized",
+        "10k_equivalent",
+    ]
+
     def val(self, prop, day):
         """Return the value of property `prop` on day `day`."""
+        if isinstance(self._by_day, LazyFrame):
+            return self._by_day.column(prop)[day]
+        if isinstance(self._by_day, CompactFrame):
+            return self._by_day.value(prop, day)
         return self.by_day[prop][day]
 
     def latest(self):
-        return self.by_day.iloc[-1] if len(self.by_day.index) > 0 else None
+        if len(self._by_day.index) == 0:
+            return None
+        if isinstance(self._by_day, LazyFrame):
+            return self._by_day.latest()
+        if isinstance(self._by_day, CompactFrame):
+            return self._by_day.row(-1)
+        return self.by_day.iloc[-1]
 
     def current_month(self):
         return self.by_month.iloc[-1] if len(self.by_month.index) > 0 else None
@@ -93,26 +157,320 @@ class Portfolio:
     def allocations(self):
         return self.positions.weights.iloc[-1]
 
-    def __init__(self, accounts=None, from_day=None, update=True, verbose=True):
-        """Instantiate a Portfolio object."""
-        self._data = Data()
-        self.accounts = determine_accounts(accounts)
-        if from_day is not None:
-            self.from_day = from_day
-        else:
-            self.from_day = self._get_start_date(self.accounts)
+    def refresh(self, update=True, verbose=True):
+        """Bring the portfolio up to date, loading only the days since the last one held.
+
+        Deposits, prices and positions are only loaded for the days after the last one
+        held, carried on from the state they were left in: the last prices, forward
+        filled, the lots held in each account and the totals to date of each position.
+        The daily metrics resume from the running state kept for the last day held.
+
+        Changes to the data are found through the days changed in each table since the
+        data was last loaded (see `db.first_changed_day()`). If one of the days held
+        changed (for instance, with today's close updated, or a backdated transaction),
+        the days are loaded again from that one instead, and the metrics computed again
+        from the earliest one they cannot be resumed from.
+        """
         if update:
             PriceUpdater(verbose).update()
-        self.deposits = Deposits(self.accounts, self.from_day, self._data)
-        self.tickers = Tickers(self.accounts, self.from_day, data=self._data)
+        held = self._daily()
+        states = self._running_states()
+        versions = db.table_versions()
+        changed = db.first_changed_day(self._versions)
+        self._versions = versions
+        if len(held.index) == 0:
+            self._reload()
+            return
+        start = held.index[-1] + timedelta(days=1)
+        if changed is not None:
+            start = min(start, pd.Timestamp(changed))
+        if start <= held.index[0]:
+            self._reload()
+            return
+        if start.date() > date.today():
+            return
+
+        opening = self.positions.state_before(start)
+        deposits = Deposits(self.accounts, start.date(), self._data)
+        tickers = Tickers(
+            self.accounts,
+            start.date(),
+            data=self._data,
+            workers=self.workers,
+            calendar=self.calendar,
+            carried=opening["current_prices"],
+        )
+        positions = Positions(
+            self.accounts,
+            start.date(),
+            tickers,
+            data=self._data,
+            materialized=self.materialized,
+            workers=self.workers,
+            cost_method=self.cost_method,
+            opening=opening,
+        )
+        inputs = self._daily_inputs(deposits, tickers, positions)
+        self.positions = self.positions.extended(positions)
+        self._deposits = None
+        self._tickers = None
+
+        kept = held.index.searchsorted(start)
+        if states is None or kept < len(held.index) - 1:
+            # Metrics cannot be resumed before the last day held
+            earlier = self._daily_frame(np.arange(kept), inputs.columns)
+            self._calc_all(pd.concat([earlier, inputs]))
+            self._store()
+            return
+
+        state = states[1] if kept == len(held.index) else states[0]
+        new_rows = self._calc_rows(inputs, state)
+        self._running_states()
+        if isinstance(held, CompactFrame):
+            self.by_day = held.extend(new_rows.frame(), kept)
+        else:
+            self.by_day = pd.concat([held.iloc[:kept], new_rows.frame()])
+        since = held.index[-1]
+        if self._by_month is not None:
+            self.by_month = self._summarize_by("month", since)
+        if self._by_year is not None:
+            self.by_year = self._summarize_by("year", since)
+        total_values = self._daily_frame(columns=["total_value"])["total_value"]
+        self.positions.calc_weights(total_values)
+        self._store()
+
+    def __init__(
+        self,
+        accounts=None,
+        from_day=None,
+        update=True,
+        verbose=True,
+        cache=False,
+        materialized=False,
+        tickers=None,
+        compact=False,
+        workers=None,
+        trace=False,
+        calendar=None,
+        cost_method="acb",
+    ):
+        """Instantiate a Portfolio object.
+
+        With `cache`, computed frames are stored on disk and loaded back by later
+        instances, for as long as the underlying data does not change.
+        With `materialized`, positions are read from the materialized daily holdings,
+        which book sales at average cost (so `cost_method` must be `acb`).
+        If `tickers` is provided (as done by `PortfolioSet`, sharing market data across
+        portfolios), it is used instead of loading the tickers of these accounts.
+        With `compact`, `by_day` is held in memory with the dtypes in `config.compact`,
+        and the columns in `derived_columns` are only computed when accessed.
+        With `workers`, tickers and positions are read in that many chunks of tickers,
+        each on its own thread and database connection.
+        With `trace`, the time spent in each stage and SQL query (from this
+        construction and from computing the frames later on) is recorded in `timings`.
+        If `calendar` (a MarketCalendar) is provided, market days are generated from it
+        instead of being read from the `marketDays` table.
+        Units sold are taken out of the positions at their average cost with the `acb`
+        `cost_method`, or at the cost of the earliest units bought with `fifo`.
+        """
+        self.timings = Tracer() if trace else None
+        with self._stage("portfolio"):
+            self._data = Data()
+            self.compact = compact
+            self.workers = workers
+            self.calendar = calendar
+            self.cost_method = cost_method
+            self.accounts = determine_accounts(accounts)
+            self.materialized = materialized
+            if from_day is not None:
+                self.from_day = from_day
+            else:
+                self.from_day = self._get_start_date(self.accounts)
+            if update:
+                with tracer.stage("update_prices"):
+                    PriceUpdater(verbose).update()
+            self._versions = db.table_versions()
+            self._cache = PortfolioCache() if cache else None
+            if self._cache is not None:
+                with tracer.stage("load_cache"):
+                    key = self._cache.key(
+                        self.accounts, self.from_day, self.cost_method
+                    )
+                    cached = self._cache.load(key)
+                if cached is not None:
+                    self._restore(cached)
+                    return
+            self._load_components(tickers)
+            with tracer.stage("calc_all"):
+                self._calc_all()
+            self._store()
+
+    @property
+    def by_day(self):
+        daily = self._daily()
+        return daily.expand() if isinstance(daily, CompactFrame) else daily
+
+    @by_day.setter
+    def by_day(self, df):
+        if self.compact and isinstance(df, pd.DataFrame) and len(df.index) > 0:
+            derived = {name: _row_function(name) for name in self.derived_columns}
+            df = CompactFrame(
+                df,
+                derived,
+                self.ratio_columns,
+                config.compact,
+                counts=self.count_columns,
+            )
+        self._by_day = df
+
+    @property
+    def by_month(self):
+        if self._by_month is None:
+            with self._stage("by_month"):
+                self._by_month = self._summarize_by("month")
+        return self._by_month
+
+    @by_month.setter
+    def by_month(self, df):
+        self._by_month = df
+
+    @property
+    def by_year(self):
+        if self._by_year is None:
+            with self._stage("by_year"):
+                self._by_year = self._summarize_by("year")
+        return self._by_year
+
+    @by_year.setter
+    def by_year(self, df):
+        self._by_year = df
+
+    @property
+    def deposits(self):
+        if self._deposits is None:
+            self._deposits = Deposits(self.accounts, self.from_day, self._data)
+        return self._deposits
+
+    @property
+    def tickers(self):
+        if self._tickers is None:
+            self._tickers = Tickers(
+                self.accounts,
+                self.from_day,
+                data=self._data,
+                workers=self.workers,
+                calendar=self.calendar,
+            )
+        return self._tickers
+
+    def _load_components(self, tickers=None):
+        with tracer.stage("deposits"):
+            self._deposits = Deposits(self.accounts, self.from_day, self._data)
+        if tickers is None:
+            with tracer.stage("tickers"):
+                tickers = Tickers(
+                    self.accounts,
+                    self.from_day,
+                    data=self._data,
+                    workers=self.workers,
+                    calendar=self.calendar,
+                )
+        self._tickers = tickers
+        with tracer.stage("positions"):
+            self.positions = Positions(
+                self.accounts,
+                self.from_day,
+                self._tickers,
+                data=self._data,
+                materialized=self.materialized,
+                workers=self.workers,
+                cost_method=self.cost_method,
+            )
+
+    @contextmanager
+    def _stage(self, name):
+        """Record a stage in `timings` if tracing this portfolio, or in an outer tracer."""
+        if self.timings is None:
+            with tracer.stage(name):
+                yield
+        else:
+            with tracer.using(self.timings), tracer.stage(name):
+                yield
+
+    def _daily(self):
+        """Return the daily metrics as held: a DataFrame, or a CompactFrame if compact.
+
+        Metrics still computed as accessed are all computed first.
+        """
+        if isinstance(self._by_day, LazyFrame):
+            with self._stage("by_day"):
+                self._running_states()
+                self.by_day = self._by_day.frame()
+        return self._by_day
+
+    def _daily_frame(self, rows=None, columns=None):
+        """Return the daily metrics for all rows or the given positions, and all columns or
+        the given ones. Only those are restored, if compact."""
+        daily = self._daily()
+        if isinstance(daily, CompactFrame):
+            return daily.expand(rows, columns)
+        df = daily if rows is None else daily.iloc[rows]
+        return df if columns is None else df[list(columns)]
+
+    def _store(self):
+        """Store the computed frames in the cache, if there is one."""
+        if self._cache is None or self._no_tickers():
+            return
+        frames = {
+            "by_day": self.by_day,
+            "by_month": self.by_month,
+            "by_year": self.by_year,
+        }
+        for attr, df in self.positions.frames().items():
+            frames[f"positions.{attr}"] = df
+        self._cache.store(
+            self._cache.key(self.accounts, self.from_day, self.cost_method), frames
+        )
+
+    def _restore(self, frames):
+        """Restore the computed frames from the cache.
+
+        Deposits and tickers are only loaded if accessed later on.
+        """
+        self._deposits = None
+        self._tickers = None
+        self._rows = None
+        self._states = None
+        self.by_day = frames["by_day"]
+        self.by_month = frames["by_month"]
+        self.by_year = frames["by_year"]
         self.positions = Positions(
-            self.accounts, self.from_day, self.tickers, data=self._data
+            self.accounts,
+            self.from_day,
+            data=self._data,
+            frames={
+                name.split(".", 1)[1]: df
+                for name, df in frames.items()
+                if name.startswith("positions.")
+            },
         )
-        self.by_day = self._calc_daily()
-        self.by_month = self._summarize_by("month")
-        self.by_year = self._summarize_by("year")
-        if len(self.by_day.index) > 0:
-            self.positions.calc_weights(self.by_day["total_value"])
+
+    def _reload(self):
+        """Load all data again from the first day, and compute all metrics again."""
+        self._load_components()
+        self._calc_all()
+        self._store()
+
+    def _calc_all(self, inputs=None):
+        """Set up the daily metrics, to be computed as accessed, and their summaries.
+
+        Metrics are computed from the `inputs` given, or else from the components loaded.
+        """
+        self.by_day = self._calc_daily() if inputs is None else self._calc_rows(inputs)
+        self.by_month = None
+        self.by_year = None
+        if len(self._by_day.index) > 0:
+            self.positions.calc_weights(self._by_day.column("total_value"))
 
     def _get_start_date(self, accounts):
         db.ensure_connected()
@@ -131,91 +489,362 @@ class Portfolio:
         if date_created is None:
             return None
 
-        # Convert string to date if needed (SQLite stores dates as strings)
-        if isinstance(date_created, str):
-            date_created = datetime.fromisoformat(date_created).date()
-
-        return date_created - timedelta(days=1)
+        # Dates may be read as strings, or as epoch-day numbers
+        return db.as_date(date_created) - timedelta(days=1)
 
     def _calc_daily(self):
         if self._no_tickers():
+            self._rows = None
+            self._states = (None, None)
             return pd.DataFrame()
-        df = pd.DataFrame(index=self.tickers.prices.index)
-        df["days_from_start"] = range(1, len(df) + 1)
-        df["years_from_start"] = df["days_from_start"] / 365.0
-        df["market_day"] = self.tickers.market_day
-        df["day_deposits"] = self.deposits.deposits
-        df["day_deposits"].fillna(0.00, inplace=True)
-        df["capital"] = df["day_deposits"].cumsum()
-        df["avg_capital"] = df["capital"].expanding().mean()
-        df["positions_cost"] = self.positions.costs.sum(axis=1)
-        df["positions_value"] = self.positions.market_values.sum(axis=1)
-        df["appreciation"] = df["positions_value"] - df["positions_cost"]
-        df["dividends"] = self.positions.distributions.sum(axis=1)
-        df["cash"] = df["capital"] + df["dividends"] - df["positions_cost"]
-        df["total_value"] = df["cash"] + df["positions_value"]
-        df["day_profit"] = (
-            df["total_value"] - df["total_value"].shift(1) - df["day_deposits"]
-        ).fillna(0.00)
-        prev_total_value = df["total_value"].shift(1)
-        df["day_returns"] = np.where(
-            (prev_total_value.notna()) & (prev_total_value != 0),
-            df["day_profit"] / prev_total_value,
-            0.00
-        )
-        df["profit"] = df["total_value"] - df["capital"]
-        df["appreciation_returns"] = df["appreciation"] / df["capital"]
-        df["distribution_returns"] = df["dividends"] / df["capital"]
-        df["returns"] = df["profit"] / df["capital"]
-        df["twrr"] = ((df["day_returns"] + 1).cumprod() - 1).fillna(0.00)
-        df["twrr_annualized"] = np.where(
-            df["years_from_start"] > 1.0,
-            (1.0 + df["twrr"]) ** (1 / df["years_from_start"]) - 1,
-            df["twrr"],
+        return self._calc_rows(
+            self._daily_inputs(self.deposits, self.tickers, self.positions)
         )
-        df["mwrr"] = df["profit"] / df["avg_capital"]
-        df["mwrr_annualized"] = np.where(
-            df["years_from_start"] > 1.0,
-            (1.0 + df["mwrr"]) ** (1 / df["years_from_start"]) - 1,
-            df["mwrr"],
-        )
-        df["volatility"] = df[df["market_day"] == 1]["day_returns"].expanding().std()
-        df["volatility"] = df["volatility"].ffill()
-        df["10k_equivalent"] = 10000 * (df["twrr"] + 1)
-        df["last_peak_twrr"] = df["twrr"].expanding().max()
-        # Map each peak value to the first date it occurred
-        peak_first_occurrence = df.groupby("last_peak_twrr", sort=False)[
-            "last_peak_twrr"
-        ].apply(lambda x: x.index[0])
-        df["last_peak"] = df["last_peak_twrr"].map(peak_first_occurrence).astype(
-            "datetime64[ns]"
-        )
-        df["current_drawdown"] = (df["twrr"] - df["last_peak_twrr"]) / (
-            1 + df["last_peak_twrr"]
-        )
-        df["greatest_drawdown"] = df["current_drawdown"].expanding().min()
-        df["sharpe"] = (df["twrr"] - config.sharpe * df["years_from_start"]) / df[
-            "volatility"
-        ]
 
+    def _daily_inputs(self, deposits, tickers, positions):
+        """Collect the daily figures that all metrics are computed from, off the components."""
+        df = pd.DataFrame(index=tickers.prices.index)
+        df["market_day"] = tickers.market_day
+        df["day_deposits"] = deposits.deposits
+        df["day_deposits"] = df["day_deposits"].astype(float).fillna(0.00)
+        df["positions_cost"] = positions.costs.sum(axis=1)
+        df["positions_value"] = positions.market_values.sum(axis=1)
+        df["dividends"] = positions.distributions.sum(axis=1)
+        df["realized_gains"] = positions.realized_gains.sum(axis=1)
         return df
 
-    def _summarize_by(self, freq):
-        """Valid frequencies are `month` and `year`."""
+    def _calc_rows(self, inputs, state=None):
+        """Set up the daily metrics for the `inputs` rows, resuming from `state`.
+
+        Metrics are computed as they are accessed, from the `daily_metrics` registry.
+        Cumulative metrics are all prefix scans, so they can be resumed from the running
+        state of the day before the first row. Without a state, the rows are taken to be
+        the first days of the portfolio.
+        """
+        self._rows = LazyFrame(
+            inputs,
+            daily_metrics,
+            _initial_state if state is None else state,
+            columns=by_day_columns,
+        )
+        self._states = None
+        return self._rows
+
+    def _running_states(self):
+        """Return the running states after the last two rows computed, for `refresh`."""
+        if self._states is None and self._rows is not None:
+            rows = self._rows
+
+            def state_after(i):
+                moments = rows.column("_moments")
+                return {
+                    "days": rows.column("days_from_start").iloc[i],
+                    "capital": rows.column("capital").iloc[i],
+                    "capital_sum": rows.column("_capital_sum").iloc[i],
+                    "total_value": rows.column("total_value").iloc[i],
+                    "growth": rows.column("_growth").iloc[i],
+                    "vol_n": moments["n"].iloc[i],
+                    "vol_mean": moments["mean"].iloc[i],
+                    "vol_m2": moments["m2"].iloc[i],
+                    "peak_twrr": rows.column("last_peak_twrr").iloc[i],
+                    "peak_day": rows.column("last_peak").iloc[i],
+                    "drawdown": rows.column("current_drawdown").iloc[i],
+                    "greatest_drawdown": rows.column("greatest_drawdown").iloc[i],
+                }
+
+            if len(rows) == 0:
+                self._states = (rows.state, rows.state)
+            else:
+                before_last = rows.state if len(rows) < 2 else state_after(-2)
+                self._states = (before_last, state_after(-1))
+            self._rows = None
+        return self._states
+
+    def _summarize_by(self, freq, since=None):
+        """Valid frequencies are `month` and `year`.
+
+        If `since` is provided, only the periods from that day onwards are summarized,
+        replacing those in the summary held.
+        """
         if self._no_tickers():
             return pd.DataFrame()
-        df = self.by_day.asfreq("ME" if freq == "month" else "YE")
-        if df.empty or df.index.values[-1] != self.by_day.index.values[-1]:
-            df.loc[self.by_day.index.values[-1]] = self.by_day.iloc[-1]
+        index = self._daily().index
+        if since is not None:
+            index = index[index >= since]
+        # Only the rows at the end of each period (and the last one) are restored
+        offset = "ME" if freq == "month" else "YE"
+        ends = pd.date_range(index[0], index[-1], freq=offset, name=index.name)
+        if len(ends) == 0 or ends[-1] != index[-1]:
+            ends = ends.append(index[-1:])
+        positions = self._daily().index.get_indexer(ends)
+        df = self._daily_frame(positions[positions >= 0]).reindex(ends)
         df = df.drop(
-            ["market_day", "day_deposits", "day_profit", "day_returns"], axis=1
+            ["market_day", "day_deposits", "day_profit", "day_returns", "recovery_days"],
+            axis=1,
         )
+        if since is not None:
+            held = getattr(self, f"by_{freq}")
+            kept = held[held.index < since]
+            seed = kept.iloc[-1:][df.columns]
+            df = pd.concat([seed, df])
         df[f"{freq}_deposits"] = df["capital"] - df["capital"].shift(1).fillna(0.00).infer_objects(copy=False)
         df[f"{freq}_profit"] = df["profit"] - df["profit"].shift(1).fillna(0).infer_objects(copy=False)
         df[f"{freq}_returns"] = relative_rate(df["returns"])
         df[f"{freq}_twrr"] = relative_rate(df["twrr"])
         df[f"{freq}_mwrr"] = relative_rate(df["mwrr"])
+        if since is not None:
+            df = pd.concat([kept, df.iloc[len(seed):]])
         return df
 
     def _no_tickers(self):
-        return len(self.tickers.ticker_names) == 0
+        return len(self.positions.ticker_names) == 0
+
+
+def _annualized(rate, years):
+    """Annualize a rate of returns over the given years, if longer than one year."""
+    return np.where(years > 1.0, (1.0 + rate) ** (1 / years) - 1, rate)
+
+
+# Running state of a portfolio before its first day
+_initial_state = {
+    "days": 0,
+    "capital": 0.0,
+    "capital_sum": 0.0,
+    "total_value": np.nan,
+    "growth": 1.0,
+    "vol_n": 0,
+    "vol_mean": 0.0,
+    "vol_m2": 0.0,
+    **drawdown_initial_state,
+}
+
+
+def _previous_total_value(total_value, s):
+    return total_value.shift(1, fill_value=s["total_value"])
+
+
+def _day_profit(total_value, day_deposits, s):
+    previous = _previous_total_value(total_value, s)
+    return (total_value - previous - day_deposits).fillna(0.00)
+
+
+def _day_returns(total_value, day_profit, s):
+    previous = _previous_total_value(total_value, s)
+    return np.where(
+        (previous.notna()) & (previous != 0), day_profit / previous, 0.00
+    )
+
+
+def _moments(market_day, day_returns, s):
+    """Return the running count, mean and sum of squared deviations of market day returns.
+
+    The figures for the new rows are merged with those in the running state (as in
+    Welford's algorithm), and carried over non-market days.
+    """
+    returns = day_returns[market_day == 1]
+    count = np.arange(1, len(returns) + 1)
+    delta = returns.expanding().mean() - s["vol_mean"]
+    n = s["vol_n"] + count
+    moments = pd.DataFrame(
+        {
+            "n": n,
+            "mean": s["vol_mean"] + delta * count / n,
+            "m2": s["vol_m2"]
+            + (returns.expanding().var() * (count - 1)).fillna(0.0)
+            + delta**2 * s["vol_n"] * count / n,
+        },
+        index=returns.index,
+    )
+    return (
+        moments.reindex(market_day.index)
+        .ffill()
+        .fillna({"n": s["vol_n"], "mean": s["vol_mean"], "m2": s["vol_m2"]})
+    )
+
+
+def _last_moments(market_day, day_returns, s):
+    """Return the count, mean and sum of squared deviations of all market day returns."""
+    returns = day_returns[market_day == 1]
+    count = len(returns)
+    if count == 0:
+        return pd.Series({"n": s["vol_n"], "mean": s["vol_mean"], "m2": s["vol_m2"]})
+    delta = returns.mean() - s["vol_mean"]
+    n = s["vol_n"] + count
+    return pd.Series(
+        {
+            "n": n,
+            "mean": s["vol_mean"] + delta * count / n,
+            "m2": s["vol_m2"]
+            + (returns.var() * (count - 1) if count > 1 else 0.0)
+            + delta**2 * s["vol_n"] * count / n,
+        }
+    )
+
+
+def _drawdowns(twrr, s):
+    drawdown, _ = drawdowns(
+        twrr, twrr.index, {k: s[k] for k in drawdown_initial_state}
+    )
+    return drawdown
+
+
+def _last_drawdowns(twrr, s):
+    return pd.Series(
+        last_drawdowns(twrr, twrr.index, {k: s[k] for k in drawdown_initial_state})
+    )
+
+
+def _row_function(name):
+    """Return a function computing a row metric from a DataFrame with its inputs."""
+    metric = daily_metrics[name]
+    return lambda df: metric.fn(*[df[i] for i in metric.inputs], None)
+
+
+# Daily metrics of a portfolio, computed as accessed from the daily inputs, in
+# dependency order. Metrics starting with an underscore are running figures kept for
+# the state, and not part of by_day
+daily_metrics = {
+    "days_from_start": Metric(
+        ["market_day"],
+        lambda market_day, s: s["days"] + np.arange(1, len(market_day) + 1),
+        last=lambda market_day, s: s["days"] + len(market_day),
+    ),
+    "years_from_start": Metric(
+        ["days_from_start"], lambda days, s: days / 365.0, row=True
+    ),
+    "capital": Metric(
+        ["day_deposits"],
+        lambda deposits, s: s["capital"] + deposits.cumsum(),
+        last=lambda deposits, s: s["capital"] + deposits.sum(),
+    ),
+    "_capital_sum": Metric(
+        ["capital"],
+        lambda capital, s: s["capital_sum"] + capital.cumsum(),
+        last=lambda capital, s: s["capital_sum"] + capital.sum(),
+    ),
+    "avg_capital": Metric(
+        ["_capital_sum", "days_from_start"],
+        lambda capital_sum, days, s: capital_sum / days,
+        row=True,
+    ),
+    "appreciation": Metric(
+        ["positions_value", "positions_cost"],
+        lambda value, cost, s: value - cost,
+        row=True,
+    ),
+    "cash": Metric(
+        ["capital", "dividends", "realized_gains", "positions_cost"],
+        lambda capital, dividends, realized, cost, s: (
+            capital + dividends + realized - cost
+        ),
+        row=True,
+    ),
+    "total_value": Metric(
+        ["cash", "positions_value"], lambda cash, value, s: cash + value, row=True
+    ),
+    "day_profit": Metric(["total_value", "day_deposits"], _day_profit),
+    "day_returns": Metric(["total_value", "day_profit"], _day_returns),
+    "profit": Metric(
+        ["total_value", "capital"], lambda value, capital, s: value - capital, row=True
+    ),
+    "appreciation_returns": Metric(
+        ["appreciation", "capital"],
+        lambda appreciation, capital, s: appreciation / capital,
+        row=True,
+    ),
+    "distribution_returns": Metric(
+        ["dividends", "capital"],
+        lambda dividends, capital, s: dividends / capital,
+        row=True,
+    ),
+    "returns": Metric(
+        ["profit", "capital"], lambda profit, capital, s: profit / capital, row=True
+    ),
+    "_growth": Metric(
+        ["day_returns"],
+        lambda returns, s: s["growth"] * (returns + 1).cumprod(),
+        last=lambda returns, s: s["growth"] * (returns + 1).prod(),
+    ),
+    "twrr": Metric(
+        ["_growth"], lambda growth, s: (growth - 1).fillna(0.00), row=True
+    ),
+    "twrr_annualized": Metric(
+        ["twrr", "years_from_start"],
+        lambda twrr, years, s: _annualized(twrr, years),
+        row=True,
+    ),
+    "mwrr": Metric(
+        ["profit", "avg_capital"],
+        lambda profit, avg_capital, s: profit / avg_capital,
+        row=True,
+    ),
+    "mwrr_annualized": Metric(
+        ["mwrr", "years_from_start"],
+        lambda mwrr, years, s: _annualized(mwrr, years),
+        row=True,
+    ),
+    "_moments": Metric(
+        ["market_day", "day_returns"], _moments, last=_last_moments
+    ),
+    "volatility": Metric(
+        ["_moments"],
+        lambda m, s: (m["m2"] / (m["n"] - 1)).where(m["n"] > 1) ** 0.5,
+        row=True,
+    ),
+    "10k_equivalent": Metric(
+        ["twrr"], lambda twrr, s: 10000 * (twrr + 1), row=True
+    ),
+    "_drawdowns": Metric(["twrr"], _drawdowns, last=_last_drawdowns),
+    **{
+        column: Metric(["_drawdowns"], lambda d, s, column=column: d[column], row=True)
+        for column in [
+            "last_peak_twrr",
+            "last_peak",
+            "current_drawdown",
+            "greatest_drawdown",
+            "drawdown_duration",
+            "recovery_days",
+        ]
+    },
+    "sharpe": Metric(
+        ["twrr", "years_from_start", "volatility"],
+        lambda twrr, years, volatility, s: (twrr - config.sharpe * years) / volatility,
+        row=True,
+    ),
+}
+
+# Columns of by_day, in order
+by_day_columns = [
+    "days_from_start",
+    "years_from_start",
+    "market_day",
+    "day_deposits",
+    "capital",
+    "avg_capital",
+    "positions_cost",
+    "positions_value",
+    "appreciation",
+    "dividends",
+    "realized_gains",
+    "cash",
+    "total_value",
+    "day_profit",
+    "day_returns",
+    "profit",
+    "appreciation_returns",
+    "distribution_returns",
+    "returns",
+    "twrr",
+    "twrr_annualized",
+    "mwrr",
+    "mwrr_annualized",
+    "volatility",
+    "10k_equivalent",
+    "last_peak_twrr",
+    "last_peak",
+    "current_drawdown",
+    "greatest_drawdown",
+    "drawdown_duration",
+    "recovery_days",
+    "sharpe",
+]
@@ -0,0 +1,176 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import multiprocessing
+
+import pandas as pd
+from sqlalchemy import bindparam
+
+from components.tickers import Tickers
+import config
+from db import db
+from db.data import Data
+from portfolio import Portfolio
+from util.price_updater import PriceUpdater
+
+
+class PortfolioSet:
+    """Portfolios over many sets of accounts, sharing their market data.
+
+    Market days, prices and distributions are loaded once, for the union of all
+    tickers bought in any of the accounts, and each portfolio is evaluated over a
+    slice of them. Only deposits and positions are queried for each account set.
+
+    Public methods:
+    portfolio(name) -- Return the Portfolio object of the given account set
+    evaluate(processes) -- Return the daily metrics of every account set
+
+    Instance variables:
+    account_sets -- Dict with account set names as keys and lists of accounts as values
+    from_days -- Dict with account set names as keys and the start date of each set as values
+    tickers -- Tickers object, with the market data shared by all account sets
+    """
+
+    def portfolio(self, name):
+        """Return the Portfolio object of the given account set."""
+        accounts = self.account_sets[name]
+        return Portfolio(
+            accounts,
+            self.from_days[name],
+            update=False,
+            verbose=False,
+            tickers=self.tickers.subset(
+                accounts, self.from_days[name], self._bought(name)
+            ),
+        )
+
+    def evaluate(self, processes=None):
+        """Return the daily metrics of every account set.
+
+        Keyword arguments:
+        processes -- number of worker processes to evaluate the sets in.
+                     Sets are evaluated in this process, if None or if the
+                     database is in memory (and so cannot be shared)
+
+        Returns:
+        dict -- account set names as keys, and `by_day` DataFrames as values
+        """
+        if processes is None or db.is_in_memory():
+            return {name: self.portfolio(name).by_day for name in self.account_sets}
+
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_connect_worker,
+            initargs=(db._env, config.db[db._env]),
+        ) as executor:
+            futures = {
+                name: executor.submit(
+                    _evaluate,
+                    accounts,
+                    self.from_days[name],
+                    self.tickers.quotes(self.from_days[name], self._bought(name)),
+                )
+                for name, accounts in self.account_sets.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
+
+    def __init__(self, account_sets=None, from_day=None, update=True, verbose=True):
+        """Instantiate a PortfolioSet object.
+
+        Keyword arguments:
+        account_sets -- dict with account set names as keys and lists of accounts as
+                        values. Every account, investor and tax type, if None
+        from_day -- start date of all account sets. If None, each one starts on the
+                    day before its earliest account was created
+        """
+        self._data = Data()
+        self._accounts = self._get_accounts()
+        if account_sets is None:
+            account_sets = account_groups(self._accounts)
+        self.account_sets = account_sets
+        self.from_days = {
+            name: self._get_start_date(accounts) if from_day is None else from_day
+            for name, accounts in self.account_sets.items()
+        }
+        if update:
+            PriceUpdater(verbose).update()
+
+        accounts = sorted({a for accounts in account_sets.values() for a in accounts})
+        starts = list(self.from_days.values())
+        start = None if None in starts or not starts else min(starts)
+        self.tickers = Tickers(accounts, start, data=self._data)
+        self._purchases = self._get_purchases(accounts)
+
+    def _get_accounts(self):
+        """Return a DataFrame indexed by account name, with its investor, tax type and creation date."""
+        return self._data.df_from_sql(
+            """SELECT a.name, a.investor, t.tax, a.dateCreated AS date_created
+            FROM accounts a JOIN accountTypes t ON a.accountType = t.name
+            ORDER BY a.name ASC;""",
+            params={},
+            index_col="name",
+            parse_dates=["date_created"],
+        )
+
+    def _get_start_date(self, accounts):
+        """Return the day before the earliest of the accounts was created."""
+        created = self._accounts.loc[
+            self._accounts.index.intersection(accounts), "date_created"
+        ].min()
+        if pd.isna(created):
+            return None
+        return created.date() - timedelta(days=1)
+
+    def _get_purchases(self, accounts):
+        """Return the last day each ticker was bought on, for each of the accounts."""
+        return self._data.df_from_sql(
+            """SELECT account, target AS ticker, MAX(day) AS last_day
+            FROM transactions
+            WHERE txtype = 'buy'
+                AND account IN :accounts
+                AND day <= :today
+            GROUP BY account, target;""",
+            params={"accounts": accounts, "today": date.today()},
+            index_col=None,
+            parse_dates=["last_day"],
+            bindparams=[bindparam("accounts", expanding=True)],
+        )
+
+    def _bought(self, name):
+        """Return the tickers bought in the accounts of a set since its start date."""
+        purchases = self._purchases[
+            self._purchases["account"].isin(self.account_sets[name])
+        ]
+        from_day = self.from_days[name]
+        if from_day is not None:
+            purchases = purchases[purchases["last_day"] >= pd.Timestamp(from_day)]
+        return set(purchases["ticker"])
+
+
+def account_groups(accounts):
+    """Group accounts by themselves, by investor and by tax type, plus all together.
+
+    Takes a DataFrame indexed by account name, with `investor` and `tax` columns, and
+    returns a dict of lists of account names, keyed as in `investor:<name>`.
+    """
+    groups = {"all": list(accounts.index)}
+    for name in accounts.index:
+        groups[f"account:{name}"] = [name]
+    for key in ["investor", "tax"]:
+        for value, members in accounts.groupby(key).groups.items():
+            groups[f"{key}:{value}"] = list(members)
+    return groups
+
+
+def _connect_worker(env, db_config):
+    """Connect a worker process to the same database as the parent process."""
+    config.db[env] = db_config
+    db.connect(env)
+
+
+def _evaluate(accounts, from_day, quotes):
+    """Evaluate the portfolio of some accounts, over already loaded quotes."""
+    tickers = Tickers(accounts, from_day, quotes=quotes)
+    return Portfolio(
+        accounts, from_day, update=False, verbose=False, tickers=tickers
+    ).by_day
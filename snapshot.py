@@ -1,5 +1,6 @@
 from docopt import docopt
 
+from db import db
 from portfolio import Portfolio
 
 
@@ -177,5 +178,7 @@ def snapshot(args):
 
 if __name__ == "__main__":
     args = docopt(usage, argv=None, help=True, options_first=False)
+    # Without price updates, the snapshot only reads from the database
+    db.connect("prod", "default" if args["--update"] else "reporting")
     report = snapshot(args)
     print("\n".join(report))
@@ -0,0 +1,146 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+from pytest import approx
+from sqlalchemy import text
+
+from conftest import simple_fixture
+from db import db
+from dividend_importer import extract_share_counts, import_dividends
+
+
+header = "Settlement Date,Account #,Symbol,Description,Price,Net Amount\n"
+accounts = {"A1": "RRSP1"}
+
+
+def write_csv(path, rows):
+    path.write_text(header + "".join(f"{row}\n" for row in rows))
+    return path
+
+
+def dividends():
+    return db.conn.execute(
+        text(
+            """SELECT day, source, units, total FROM transactions
+            WHERE txtype = 'dividend' ORDER BY day, source, total;"""
+        )
+    ).fetchall()
+
+
+def setup_function():
+    simple_fixture()
+
+
+def test_extract_share_counts():
+    descriptions = pd.Series(["DIST ON 52 SHS REC 12/30/25", "DIST ON 7 SHS"])
+
+    assert extract_share_counts(descriptions).tolist() == [52, 7]
+    with pytest.raises(ValueError, match="INTEREST"):
+        extract_share_counts(pd.Series(["DIST ON 1 SHS", "INTEREST"]))
+
+
+def test_imports_dividends_in_chunks(tmp_path):
+    first = write_csv(
+        tmp_path / "first.csv",
+        [
+            "2017-03-07 12:00:00 AM,A1,VEE,DIST ON 100 SHS REC 03/01/17,0.12,12.00",
+            "2017-03-07 12:00:00 AM,A1,VCN,DIST ON 100 SHS REC 03/01/17,0.05,5.00",
+        ],
+    )
+    second = write_csv(
+        tmp_path / "second.csv",
+        ["2017-03-08 12:00:00 AM,A1,VCN,DIST ON 100 SHS REC 03/02/17,0.06,6.00"],
+    )
+
+    inserted = import_dividends([first, second], accounts, chunksize=1)
+
+    assert len(inserted) == 3
+    assert len(dividends()) == 5
+    held = db.conn.execute(
+        text(
+            """SELECT distributions FROM holdingsDaily
+            WHERE ticker = 'VCN.TO' AND day = '2017-03-08';"""
+        )
+    ).scalar()
+    assert held == approx(10.10 + 9.90 + 5.00 + 6.00)
+
+
+def test_imports_nothing_from_header_only_files(tmp_path):
+    empty = write_csv(tmp_path / "empty.csv", [])
+    csv = write_csv(
+        tmp_path / "dividends.csv",
+        ["2017-03-07 12:00:00 AM,A1,VEE,DIST ON 100 SHS REC 03/01/17,0.12,12.00"],
+    )
+
+    assert len(import_dividends([empty], accounts)) == 0
+    assert len(import_dividends([empty, csv, empty], accounts)) == 1
+    assert len(dividends()) == 3
+
+
+def test_skips_dividends_already_loaded(tmp_path):
+    csv = write_csv(
+        tmp_path / "dividends.csv",
+        [
+            # Already in the fixture, loaded without a hash
+            "2017-03-06 12:00:00 AM,A1,VCN,DIST ON 100 SHS REC 03/01/17,0.099,9.90",
+            "2017-03-07 12:00:00 AM,A1,VCN,DIST ON 100 SHS REC 03/01/17,0.05,5.00",
+            "2017-03-07 12:00:00 AM,A1,VCN,DIST ON 100 SHS REC 03/01/17,0.05,5.00",
+        ],
+    )
+
+    assert len(import_dividends([csv], accounts)) == 1
+    assert len(import_dividends([csv], accounts)) == 0
+    assert len(dividends()) == 3
+
+
+def test_descriptions_are_not_sql(tmp_path):
+    csv = write_csv(
+        tmp_path / "dividends.csv",
+        [
+            "2017-03-07 12:00:00 AM,A1,VCN,"
+            "\"DIST ON 3 SHS'); DROP TABLE transactions; --\",0.05,0.15",
+        ],
+    )
+
+    import_dividends([csv], accounts)
+
+    assert (pd.Timestamp("2017-03-07").date(), "VCN.TO", 3, 0.15) in dividends()
+
+
+def test_failed_import_loads_nothing(tmp_path):
+    csv = write_csv(
+        tmp_path / "dividends.csv",
+        [
+            "2017-03-07 12:00:00 AM,A1,VCN,DIST ON 100 SHS REC 03/01/17,0.05,5.00",
+            "2017-03-08 12:00:00 AM,B2,VCN,DIST ON 100 SHS REC 03/01/17,0.05,5.00",
+        ],
+    )
+
+    with pytest.raises(ValueError, match="B2"):
+        import_dividends([csv], accounts, chunksize=1)
+
+    assert len(dividends()) == 2
+    triggers = db.conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'trigger';")
+    ).scalars()
+    assert "holdings_on_transaction" in list(triggers)
+
+
+def test_imports_dividends_with_epoch_days(tmp_path):
+    db.migrate_to_epoch_days()
+    csv = write_csv(
+        tmp_path / "dividends.csv",
+        [
+            "2017-03-06 12:00:00 AM,A1,VCN,DIST ON 100 SHS REC 03/01/17,0.099,9.90",
+            "2017-03-07 12:00:00 AM,A1,VCN,DIST ON 100 SHS REC 03/01/17,0.05,5.00",
+        ],
+    )
+
+    assert len(import_dividends([csv], accounts)) == 1
+    assert len(import_dividends([csv], accounts)) == 0
+    assert [db.as_date(row.day) for row in dividends()] == [
+        date(2017, 3, 3),
+        date(2017, 3, 6),
+        date(2017, 3, 7),
+    ]
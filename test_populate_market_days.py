@@ -92,3 +92,17 @@ def test_populate_market_days_weekend_check():
     assert days_dict["2023-01-07"] == 0
     # Jan 8 (Sunday) - weekend
     assert days_dict["2023-01-08"] == 0
+
+
+def test_populate_market_days_follows_holiday_rules():
+    inserted = populate_market_days("2030-04-15", "2030-04-22")
+
+    result = db.conn.execute(
+        text("SELECT day, open FROM marketDays WHERE day >= '2030-04-15' ORDER BY day")
+    ).fetchall()
+    days_dict = {str(row[0]): row[1] for row in result}
+
+    assert inserted == 8
+    assert days_dict["2030-04-18"] == 1  # Thursday
+    assert days_dict["2030-04-19"] == 0  # Good Friday
+    assert days_dict["2030-04-22"] == 1  # Easter Monday, open in Toronto
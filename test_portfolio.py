@@ -1,13 +1,19 @@
 from datetime import datetime as dt, date
 from freezegun import freeze_time
 import math
+import pandas as pd
 from pandas import Timestamp
 import pytest
 from pytest import approx
+from sqlalchemy import text
+from unittest.mock import patch
 
+from components.tickers import Tickers
+import config
 from conftest import simple_fixture, simple_fixture_teardown
 from portfolio import Portfolio
 from db import db
+from db.data import Data
 
 p = None
 
@@ -156,6 +162,10 @@ class TestSimplePortfolio:
         assert p.val("greatest_drawdown", "2017-03-02") == 0
         assert p.val("greatest_drawdown", "2017-03-06") == 0
 
+    def test_drawdown_duration(self):
+        assert p.val("drawdown_duration", "2017-03-05") == 2
+        assert p.val("drawdown_duration", "2017-03-06") == 0
+
     def test_sharpe(self):
         assert math.isnan(p.val("sharpe", "2017-03-02"))
         assert p.val("sharpe", "2017-03-06") == approx(1.7869651525257371)
@@ -170,3 +180,354 @@ class TestSimplePortfolio:
         allocations = p.allocations()
 
         assert allocations["Cash"] == approx(0.40496233512598245)
+
+
+class TestRefresh:
+    def setup_method(self):
+        simple_fixture()
+
+    def assert_same_frames(self, refreshed, rebuilt):
+        pd.testing.assert_frame_equal(refreshed.by_day, rebuilt.by_day, check_freq=False)
+        pd.testing.assert_frame_equal(
+            refreshed.by_month, rebuilt.by_month, check_freq=False
+        )
+        pd.testing.assert_frame_equal(refreshed.by_year, rebuilt.by_year, check_freq=False)
+        pd.testing.assert_frame_equal(refreshed.positions.weights, rebuilt.positions.weights)
+
+    def test_refresh_appends_new_days(self):
+        with freeze_time(dt(2017, 3, 3)):
+            refreshed = Portfolio(update=False)
+        with freeze_time(dt(2017, 3, 8)):
+            refreshed.refresh(update=False)
+            rebuilt = Portfolio(update=False)
+
+        assert len(refreshed.by_day) == 7
+        self.assert_same_frames(refreshed, rebuilt)
+
+    def test_refresh_updates_last_day(self):
+        with freeze_time(dt(2017, 3, 7)):
+            refreshed = Portfolio(update=False)
+            db.conn.execute(
+                text(
+                    """UPDATE assetprices SET close = 31.00
+                    WHERE ticker = 'VCN.TO' AND day = '2017-03-07';"""
+                )
+            )
+            refreshed.refresh(update=False)
+            rebuilt = Portfolio(update=False)
+
+        assert refreshed.val("positions_value", "2017-03-07") == approx(6300.00)
+        self.assert_same_frames(refreshed, rebuilt)
+
+    def test_refresh_recomputes_history_when_past_days_change(self):
+        with freeze_time(dt(2017, 3, 7)):
+            refreshed = Portfolio(update=False)
+            db.conn.execute(
+                text(
+                    """INSERT INTO transactions (day, txtype, account, source, target, total)
+                    VALUES ('2017-03-03', 'deposit', 'RRSP1', null, 'Cash', 500);"""
+                )
+            )
+            refreshed.refresh(update=False)
+            rebuilt = Portfolio(update=False)
+
+        assert refreshed.val("capital", "2017-03-03") == 10500
+        self.assert_same_frames(refreshed, rebuilt)
+
+    def test_refresh_loads_only_new_days(self):
+        with freeze_time(dt(2017, 3, 6)):
+            refreshed = Portfolio(update=False)
+        with freeze_time(dt(2017, 3, 8)):
+            with patch.object(
+                Tickers, "_load_quotes", autospec=True, side_effect=Tickers._load_quotes
+            ) as load_quotes:
+                refreshed.refresh(update=False)
+
+        load_quotes.assert_called_once()
+        assert load_quotes.call_args.args[1] == date(2017, 3, 7)
+
+    def test_refresh_carries_lots_at_fifo(self):
+        db.conn.execute(
+            text(
+                """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+                VALUES ('2017-03-06', 'buy', 'RRSP1', 'Cash', 'VCN.TO', 100, 2985.35);"""
+            )
+        )
+        with freeze_time(dt(2017, 3, 6)):
+            refreshed = Portfolio(update=False, cost_method="fifo")
+        db.conn.execute(
+            text(
+                """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+                VALUES ('2017-03-08', 'sale', 'RRSP1', 'VCN.TO', 'Cash', 150, 4522.15);"""
+            )
+        )
+        with freeze_time(dt(2017, 3, 8)):
+            refreshed.refresh(update=False)
+            rebuilt = Portfolio(update=False, cost_method="fifo")
+
+        assert refreshed.positions.costs["VCN.TO"].iloc[-1] == approx(2985.35 / 2)
+        self.assert_same_frames(refreshed, rebuilt)
+
+    def test_materialized_refresh(self):
+        with freeze_time(dt(2017, 3, 3)):
+            refreshed = Portfolio(update=False, materialized=True)
+        with freeze_time(dt(2017, 3, 8)):
+            refreshed.refresh(update=False)
+            rebuilt = Portfolio(update=False, materialized=True)
+
+        self.assert_same_frames(refreshed, rebuilt)
+
+
+class TestLazy:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_latest_computes_only_last_values(self):
+        with freeze_time(dt(2017, 3, 7)):
+            lazy = Portfolio(update=False)
+            full = Portfolio(update=False)
+        latest = lazy.latest()
+
+        assert "_moments" not in lazy._by_day._columns
+        assert "volatility" not in lazy._by_day._columns
+        assert "_drawdowns" not in lazy._by_day._columns
+        pd.testing.assert_series_equal(latest, full.by_day.iloc[-1], check_dtype=False)
+
+    def test_by_day_matches_eager_frame(self):
+        with freeze_time(dt(2017, 3, 7)):
+            p = Portfolio(update=False)
+        volatility = p.val("volatility", "2017-03-07")
+        by_day = p.by_day
+
+        assert by_day["volatility"]["2017-03-07"] == volatility
+        assert by_day.dtypes["days_from_start"] == "int64"
+        assert by_day.dtypes["last_peak"] == "datetime64[ns]"
+        assert list(p.by_month.index) == [pd.Timestamp("2017-03-07")]
+
+
+class TestMaterialized:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_materialized_portfolio_matches_portfolio(self):
+        with freeze_time(dt(2017, 3, 7)):
+            materialized = Portfolio(update=False, materialized=True)
+            computed = Portfolio(update=False)
+
+        pd.testing.assert_frame_equal(materialized.by_day, computed.by_day)
+        pd.testing.assert_frame_equal(
+            materialized.positions.weights, computed.positions.weights
+        )
+
+
+class TestSalesAndWithdrawals:
+    def setup_method(self):
+        simple_fixture()
+        db.conn.execute(
+            text(
+                """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+                VALUES ('2017-03-06', 'sale', 'RRSP1', 'VCN.TO', 'Cash', 50, 1492.50),
+                    ('2017-03-07', 'withdrawal', 'RRSP1', 'Cash', null, null, 1000);"""
+            )
+        )
+        with freeze_time(dt(2017, 3, 7)):
+            self.p = Portfolio(update=False)
+
+    def test_sale_moves_value_to_cash(self):
+        realized = 1492.50 - 50 * 30.1035
+
+        assert self.p.val("positions_cost", "2017-03-06") == approx(5810.70 - 1505.175)
+        assert self.p.val("realized_gains", "2017-03-03") == 0
+        assert self.p.val("realized_gains", "2017-03-06") == approx(realized)
+        assert self.p.val("cash", "2017-03-06") == approx(10000 - 5810.70 + 20 + 1492.50)
+        assert self.p.val("total_value", "2017-03-06") == approx(10394.30)
+        assert self.p.val("day_profit", "2017-03-06") == approx(384.90)
+
+    def test_materialized_portfolio_matches_portfolio(self):
+        with freeze_time(dt(2017, 3, 7)):
+            materialized = Portfolio(update=False, materialized=True)
+
+        pd.testing.assert_frame_equal(materialized.by_day, self.p.by_day)
+
+    def test_materialized_portfolio_books_sales_at_average_cost(self):
+        with pytest.raises(ValueError):
+            Portfolio(update=False, materialized=True, cost_method="fifo")
+
+    def test_withdrawal_takes_out_capital(self):
+        assert self.p.val("day_deposits", "2017-03-07") == -1000
+        assert self.p.val("capital", "2017-03-07") == 9000
+        assert self.p.val("cash", "2017-03-07") == approx(
+            self.p.val("cash", "2017-03-06") - 1000
+        )
+        assert self.p.val("day_profit", "2017-03-07") == approx(
+            self.p.val("total_value", "2017-03-07")
+            - self.p.val("total_value", "2017-03-06")
+            + 1000
+        )
+
+
+class TestCompact:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_compact_portfolio_matches_portfolio(self):
+        with freeze_time(dt(2017, 3, 7)):
+            compact = Portfolio(update=False, compact=True)
+            full = Portfolio(update=False)
+
+        pd.testing.assert_frame_equal(compact.by_day, full.by_day, rtol=1e-6)
+        pd.testing.assert_series_equal(compact.latest(), full.latest(), rtol=1e-6)
+        for column in full.by_day.columns.drop("last_peak"):
+            assert compact.val(column, "2017-03-06") == approx(
+                full.val(column, "2017-03-06"), rel=1e-6, nan_ok=True
+            )
+        assert compact.val("last_peak", "2017-03-07") == full.val("last_peak", "2017-03-07")
+        pd.testing.assert_frame_equal(compact.by_month, full.by_month)
+
+    def test_compact_portfolio_takes_half_the_memory(self):
+        with freeze_time(dt(2017, 3, 7)):
+            compact = Portfolio(update=False, compact=True)
+
+        expanded = compact.by_day.memory_usage(deep=True).sum()
+        stored = compact._by_day.stored.memory_usage(deep=True).sum()
+        assert stored <= expanded / 2
+
+    def test_compact_portfolio_refreshes(self):
+        with freeze_time(dt(2017, 3, 3)):
+            compact = Portfolio(update=False, compact=True)
+        with freeze_time(dt(2017, 3, 8)):
+            compact.refresh(update=False)
+            full = Portfolio(update=False)
+
+        pd.testing.assert_frame_equal(compact.by_day, full.by_day, rtol=1e-6)
+
+
+class TestWorkers:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_portfolio_read_in_threads_matches_portfolio(self, file_database):
+        file_database()
+
+        with freeze_time(dt(2017, 3, 7)):
+            threaded = Portfolio(update=False, workers=2)
+            serial = Portfolio(update=False)
+            materialized = Portfolio(update=False, workers=2, materialized=True)
+
+        pd.testing.assert_frame_equal(threaded.by_day, serial.by_day)
+        pd.testing.assert_frame_equal(materialized.by_day, serial.by_day)
+        pd.testing.assert_frame_equal(
+            threaded.positions.weights, serial.positions.weights
+        )
+        assert threaded.tickers.ticker_names == ["VCN.TO", "VEE.TO"]
+
+
+class TestEpochDays:
+    def setup_method(self):
+        simple_fixture()
+        db.conn.execute(
+            text(
+                """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+                VALUES ('2017-03-06', 'sale', 'RRSP1', 'VCN.TO', 'Cash', 50, 1492.50),
+                    ('2017-03-07', 'withdrawal', 'RRSP1', 'Cash', null, null, 1000);"""
+            )
+        )
+
+    @pytest.mark.parametrize("fetch", ["pandas", "numpy"])
+    def test_portfolio_is_unchanged_by_epoch_days(self, fetch, monkeypatch):
+        monkeypatch.setitem(config.data, "fetch", fetch)
+        with freeze_time(dt(2017, 3, 7)):
+            iso = Portfolio(update=False)
+            iso_materialized = Portfolio(update=False, materialized=True)
+            db.migrate_to_epoch_days()
+            epoch = Portfolio(update=False)
+            epoch_materialized = Portfolio(update=False, materialized=True)
+
+        pd.testing.assert_frame_equal(epoch.by_day, iso.by_day)
+        pd.testing.assert_frame_equal(epoch.by_month, iso.by_month)
+        pd.testing.assert_frame_equal(epoch.positions.weights, iso.positions.weights)
+        pd.testing.assert_frame_equal(epoch_materialized.by_day, iso_materialized.by_day)
+
+
+class TestTimings:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_untraced_portfolio_has_no_timings(self):
+        with freeze_time(dt(2017, 3, 7)):
+            assert Portfolio(update=False).timings is None
+
+    def test_traced_portfolio_records_stages(self):
+        with freeze_time(dt(2017, 3, 7)):
+            p = Portfolio(update=False, trace=True)
+            p.by_day
+
+        stages = {s["stage"]: s for s in p.timings.to_dict()}
+        for stage in [
+            "portfolio",
+            "portfolio/deposits",
+            "portfolio/tickers",
+            "portfolio/tickers/quotes/sql:assetprices",
+            "portfolio/positions/holdings/sql:transactions",
+            "portfolio/calc_all",
+            "by_day",
+            "by_day/metric:twrr",
+        ]:
+            assert stage in stages
+        quotes = stages["portfolio/tickers/quotes/sql:assetprices"]
+        assert quotes["rows"] == 10  # 8 prices and 2 distributions
+        assert quotes["bytes"] > 0
+        assert "portfolio;tickers;quotes;sql:assetprices " in p.timings.folded()
+
+
+class TestCache:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_cached_portfolio_is_restored(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(config.cache, "path", tmp_path)
+        with freeze_time(dt(2017, 3, 7)):
+            computed = Portfolio(update=False, cache=True)
+            with patch.object(Data, "df_from_sql") as data_call:
+                restored = Portfolio(update=False, cache=True)
+
+        assert data_call.call_count == 0
+        pd.testing.assert_frame_equal(restored.by_day, computed.by_day, check_freq=False)
+        # Summaries hold object columns, which are stored with their inferred types
+        pd.testing.assert_frame_equal(
+            restored.by_month, computed.by_month, check_freq=False, check_dtype=False
+        )
+        pd.testing.assert_frame_equal(
+            restored.by_year, computed.by_year, check_freq=False, check_dtype=False
+        )
+        pd.testing.assert_frame_equal(
+            restored.positions.market_values,
+            computed.positions.market_values,
+            check_freq=False,
+        )
+        assert restored.latest()["total_value"] == approx(10394.30)
+        assert restored.allocations()["Cash"] == approx(0.40496233512598245)
+        assert restored.positions.positions["VCN.TO"].units("2017-03-06") == 100
+
+    def test_cache_misses_when_data_changes(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(config.cache, "path", tmp_path)
+        with freeze_time(dt(2017, 3, 7)):
+            Portfolio(update=False, cache=True)
+            db.conn.execute(
+                text(
+                    """UPDATE assetprices SET close = 31.00
+                    WHERE ticker = 'VCN.TO' AND day = '2017-03-07';"""
+                )
+            )
+            p = Portfolio(update=False, cache=True)
+
+        assert p.val("positions_value", "2017-03-07") == approx(6300.00)
+
+    def test_restored_portfolio_loads_tickers_on_access(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(config.cache, "path", tmp_path)
+        with freeze_time(dt(2017, 3, 7)):
+            Portfolio(update=False, cache=True)
+            p = Portfolio(update=False, cache=True)
+
+            assert p._tickers is None
+            assert p.tickers.prices.loc["2017-03-06"]["VCN.TO"] == approx(29.85)
@@ -0,0 +1,92 @@
+from datetime import datetime as dt
+from freezegun import freeze_time
+import pandas as pd
+from sqlalchemy import text
+from unittest.mock import patch
+
+from conftest import simple_fixture
+from db import db
+from db.data import Data
+from portfolio import Portfolio
+from portfolio_set import PortfolioSet
+
+
+def second_account_fixture():
+    db.conn.execute(
+        text(
+            """INSERT INTO accounttypes (name, tax, margin)
+            VALUES ('TFSA', 'free', 0);"""
+        )
+    )
+    db.conn.execute(text("INSERT INTO investors (name) VALUES ('Someone Else');"))
+    db.conn.execute(
+        text(
+            """INSERT INTO accounts (name, accounttype, investor, datecreated)
+            VALUES ('TFSA1', 'TFSA', 'Someone Else', '2017-03-06');"""
+        )
+    )
+    db.conn.execute(
+        text(
+            """INSERT INTO transactions (day, txtype, account, source, target, units, total)
+            VALUES
+                ('2017-03-06', 'deposit', 'TFSA1', null, 'Cash', null, 5000),
+                ('2017-03-06', 'buy', 'TFSA1', 'Cash', 'VEE.TO', 50, 1600.35);"""
+        )
+    )
+
+
+class TestPortfolioSet:
+    def setup_method(self):
+        simple_fixture()
+        second_account_fixture()
+
+    def test_default_account_sets(self):
+        with freeze_time(dt(2017, 3, 8)):
+            portfolios = PortfolioSet(update=False)
+
+        assert portfolios.account_sets == {
+            "all": ["RRSP1", "TFSA1"],
+            "account:RRSP1": ["RRSP1"],
+            "account:TFSA1": ["TFSA1"],
+            "investor:Someone": ["RRSP1"],
+            "investor:Someone Else": ["TFSA1"],
+            "tax:deferred": ["RRSP1"],
+            "tax:free": ["TFSA1"],
+        }
+        assert portfolios.tickers.ticker_names == ["VCN.TO", "VEE.TO"]
+
+    def test_evaluate_matches_portfolios(self):
+        with freeze_time(dt(2017, 3, 8)):
+            by_day = PortfolioSet(update=False).evaluate()
+            for name, accounts in [
+                ("all", None),
+                ("account:RRSP1", "RRSP1"),
+                ("tax:free", "TFSA1"),
+            ]:
+                pd.testing.assert_frame_equal(
+                    by_day[name], Portfolio(accounts, update=False).by_day
+                )
+
+    def test_market_data_is_loaded_once(self):
+        with freeze_time(dt(2017, 3, 8)):
+            with patch.object(Data, "df_from_sql", wraps=Data().df_from_sql) as data_call:
+                PortfolioSet(update=False).evaluate()
+
+        market_queries = [
+            call for call in data_call.call_args_list if "assetprices" in call.args[0]
+        ]
+        assert len(market_queries) == 1
+
+    def test_evaluate_in_processes(self, file_database):
+        file_database()
+
+        with freeze_time(dt(2017, 3, 8)):
+            portfolios = PortfolioSet(
+                {"all": ["RRSP1", "TFSA1"], "tfsa": ["TFSA1"]}, update=False
+            )
+            in_processes = portfolios.evaluate(processes=2)
+            in_process = portfolios.evaluate()
+
+        assert list(in_processes) == ["all", "tfsa"]
+        for name, df in in_process.items():
+            pd.testing.assert_frame_equal(in_processes[name], df)
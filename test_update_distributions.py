@@ -1,84 +1,109 @@
-import os
-import tempfile
-from unittest.mock import patch, MagicMock
+from datetime import date
+
 import pandas as pd
-import pytest
 from sqlalchemy import text
 
 import update_distributions
-from conftest import simple_fixture, simple_fixture_teardown
+from conftest import simple_fixture
 from db import db
 
 
-def test_update_distributions_filters_and_inserts():
-    """Test that update_distributions correctly filters dates and inserts records."""
+def write_csv(path, rows):
+    """Write distributions as (ticker, date, type, amount) rows to a CSV file."""
+    pd.DataFrame(rows, columns=["Ticker", "Date", "Type", "Amount"]).to_csv(
+        path, index=False
+    )
+    return str(path)
+
+
+def load(path, chunk_size=10000):
+    return update_distributions.main(
+        {"--env": "test", "--file": path, "--chunk-size": str(chunk_size)}
+    )
+
+
+def test_update_distributions_filters_and_inserts(tmp_path):
+    """Test that update_distributions filters dates by the market calendar and inserts records."""
     simple_fixture()
 
-    # Add marketdays for test dates
+    # Add marketdays for test dates, so the calendar starts on 2016-09-08
     db.ensure_connected("test")
     db.conn.execute(
         text(
             """INSERT INTO marketdays (day, open)
-               VALUES ('2016-09-07', true), ('2016-09-08', true),
-                      ('2016-09-09', true), ('2016-09-10', true)"""
+               VALUES ('2016-09-08', true), ('2016-09-09', true), ('2016-09-10', true)"""
         )
     )
-
-    # Create a temporary CSV file with test data
-    test_data = pd.DataFrame(
-        {
-            "Ticker": ["VCN.TO", "VEE.TO", "VCN.TO", "VEE.TO"],
-            "Date": ["2016-09-07", "2016-09-08", "2016-09-09", "2016-09-10"],
-            "Type": ["income", "income", "capital gains", "income"],
-            "Amount": [0.10, 0.20, 0.30, 0.40],
-        }
+    path = write_csv(
+        tmp_path / "distributions.csv",
+        [
+            ("VCN.TO", "2016-09-07", "income", 0.10),
+            ("VEE.TO", "2016-09-08", "income", 0.20),
+            ("VCN.TO", "2016-09-09", "capital gains", 0.30),
+            ("VEE.TO", "2016-09-10", "income", 0.40),
+        ],
     )
 
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as f:
-        test_data.to_csv(f.name, index=False)
-        temp_csv = f.name
-
-    try:
-        # Patch the CSV file path
-        with patch("pandas.read_csv") as mock_read_csv:
-            mock_read_csv.return_value = test_data
-
-            # Run the main function
-            args = {"--env": "test"}
-            update_distributions.main(args)
-
-        # Verify the data was inserted correctly
-        db.ensure_connected("test")
-        result = db.conn.execute(
-            text(
-                """SELECT ticker, day, type, amount FROM distributions
-               WHERE day BETWEEN '2016-09-07' AND '2016-09-10'
-               ORDER BY day, ticker"""
-            )
+    counts = load(path, chunk_size=2)
+
+    # Verify the data was inserted correctly
+    db.ensure_connected("test")
+    result = db.conn.execute(
+        text(
+            """SELECT ticker, day, type, amount FROM distributions
+           WHERE day BETWEEN '2016-09-07' AND '2016-09-10'
+           ORDER BY day, ticker"""
         )
-        rows = result.fetchall()
+    )
+    rows = result.fetchall()
+
+    # Should have 3 rows (filtered out 2016-09-07)
+    assert counts == {"inserted": 3, "changed": 0, "unchanged": 0, "skipped": 1}
+    assert len(rows) == 3
+    assert rows[0][0] == "VEE.TO"  # ticker
+    assert str(rows[0][1]) == "2016-09-08"  # day
+    assert rows[0][2] == "income"  # type
+    assert float(rows[0][3]) == 0.20  # amount
 
-        # Should have 3 rows (filtered out 2016-09-07)
-        assert len(rows) == 3
-        assert rows[0][0] == "VEE.TO"  # ticker
-        assert str(rows[0][1]) == "2016-09-08"  # day
-        assert rows[0][2] == "income"  # type
-        assert float(rows[0][3]) == 0.20  # amount
+    assert rows[1][0] == "VCN.TO"
+    assert str(rows[1][1]) == "2016-09-09"
+    assert float(rows[1][3]) == 0.30
 
-        assert rows[1][0] == "VCN.TO"
-        assert str(rows[1][1]) == "2016-09-09"
-        assert float(rows[1][3]) == 0.30
+    assert rows[2][0] == "VEE.TO"
+    assert str(rows[2][1]) == "2016-09-10"
+    assert float(rows[2][3]) == 0.40
+
+
+def test_update_distributions_skips_days_missing_from_the_calendar(tmp_path):
+    """Test that days between market days, but not in the calendar, are skipped."""
+    simple_fixture()
+    db.conn.execute(
+        text(
+            """INSERT INTO marketdays (day, open)
+               VALUES ('2016-09-08', true), ('2016-09-12', true)"""
+        )
+    )
+    path = write_csv(
+        tmp_path / "distributions.csv",
+        [
+            ("VCN.TO", "2016-09-08", "income", 0.10),
+            ("VCN.TO", "2016-09-09", "income", 0.20),
+            ("VEE.TO", "2016-09-12", "income", 0.30),
+            ("VEE.TO", "2017-03-09", "income", 0.40),
+        ],
+    )
 
-        assert rows[2][0] == "VEE.TO"
-        assert str(rows[2][1]) == "2016-09-10"
-        assert float(rows[2][3]) == 0.40
+    counts = load(path)
 
-    finally:
-        os.unlink(temp_csv)
+    assert counts == {"inserted": 2, "changed": 0, "unchanged": 0, "skipped": 2}
+    days = db.conn.execute(
+        text("SELECT day FROM distributions WHERE day < '2017-01-01' ORDER BY day")
+    ).scalars()
+    assert [str(day) for day in days] == ["2016-09-08", "2016-09-12"]
 
 
-def test_update_distributions_handles_duplicates():
-    """Test that ON CONFLICT DO NOTHING works correctly."""
+def test_update_distributions_handles_duplicates(tmp_path):
+    """Test that distributions are loaded once, however many times they appear."""
     simple_fixture()
 
     # Add marketdays for test dates
@@ -88,22 +113,17 @@ def test_update_distributions_handles_duplicates():
     )
 
     # Create test data with a duplicate entry
-    test_data = pd.DataFrame(
-        {
-            "Ticker": ["VCN.TO", "VCN.TO"],
-            "Date": ["2016-09-08", "2016-09-08"],
-            "Type": ["income", "income"],
-            "Amount": [0.10, 0.10],
-        }
+    path = write_csv(
+        tmp_path / "distributions.csv",
+        [
+            ("VCN.TO", "2016-09-08", "income", 0.10),
+            ("VCN.TO", "2016-09-08", "income", 0.10),
+        ],
     )
 
-    with patch("pandas.read_csv") as mock_read_csv:
-        mock_read_csv.return_value = test_data
-
-        # Run the main function twice
-        args = {"--env": "test"}
-        update_distributions.main(args)
-        update_distributions.main(args)
+    # Run the main function twice
+    first = load(path, chunk_size=1)
+    second = load(path, chunk_size=1)
 
     # Verify only one record exists
     db.ensure_connected("test")
@@ -114,28 +134,52 @@ def test_update_distributions_handles_duplicates():
     )
     count = result.fetchone()[0]
     assert count == 1
+    assert first["inserted"] == 1
+    assert second == {"inserted": 0, "changed": 0, "unchanged": 1, "skipped": 0}
 
 
-def test_update_distributions_empty_csv():
-    """Test that empty CSV after filtering doesn't cause errors."""
+def test_update_distributions_updates_changes(tmp_path):
+    """Test that distributions already loaded are updated, and the changes reported."""
     simple_fixture()
-
-    # Create test data where all dates are before cutoff
-    test_data = pd.DataFrame(
-        {
-            "Ticker": ["VCN.TO", "VEE.TO"],
-            "Date": ["2016-09-01", "2016-09-07"],
-            "Type": ["income", "income"],
-            "Amount": [0.10, 0.20],
-        }
+    path = write_csv(
+        tmp_path / "distributions.csv",
+        [
+            ("VCN.TO", "2017-03-03", "income", 0.1010),
+            ("VCN.TO", "2017-03-06", "capital gains", 0.0990),
+            ("VEE.TO", "2017-03-06", "income", 0.2500),
+            ("VEE.TO", "2017-03-07", "income", 0.1200),
+        ],
     )
 
-    with patch("pandas.read_csv") as mock_read_csv:
-        mock_read_csv.return_value = test_data
+    counts = load(path)
+
+    assert counts == {"inserted": 2, "changed": 1, "unchanged": 1, "skipped": 0}
+    rows = db.conn.execute(
+        text("SELECT ticker, day, type, amount FROM distributions ORDER BY ticker, day")
+    ).fetchall()
+    assert [(row[0], str(row[1]), row[2], float(row[3])) for row in rows] == [
+        ("VCN.TO", "2017-03-03", "income", 0.1010),
+        ("VCN.TO", "2017-03-06", "capital gains", 0.0990),
+        ("VEE.TO", "2017-03-06", "income", 0.2500),
+        ("VEE.TO", "2017-03-07", "income", 0.1200),
+    ]
 
-        # Run the main function
-        args = {"--env": "test"}
-        update_distributions.main(args)
+
+def test_update_distributions_empty_csv(tmp_path):
+    """Test that a CSV with nothing in the market calendar doesn't cause errors."""
+    simple_fixture()
+
+    # Create test data where all dates are before the market calendar
+    path = write_csv(
+        tmp_path / "distributions.csv",
+        [
+            ("VCN.TO", "2016-09-01", "income", 0.10),
+            ("VEE.TO", "2016-09-07", "income", 0.20),
+        ],
+    )
+
+    # Run the main function
+    counts = load(path)
 
     # Verify no records were inserted for the test date range
     db.ensure_connected("test")
@@ -147,3 +191,26 @@ def test_update_distributions_empty_csv():
     )
     count = result.fetchone()[0]
     assert count == 0
+    assert counts["skipped"] == 2
+
+
+def test_update_distributions_with_epoch_days(tmp_path):
+    """Test that distributions are loaded as epoch-day numbers, once converted."""
+    simple_fixture()
+    db.migrate_to_epoch_days()
+    path = write_csv(
+        tmp_path / "distributions.csv",
+        [
+            ("VCN.TO", "2017-03-03", "income", 0.1010),
+            ("VEE.TO", "2017-03-07", "income", 0.1200),
+            ("VEE.TO", "2017-03-09", "income", 0.1300),
+        ],
+    )
+
+    counts = load(path)
+
+    assert counts == {"inserted": 1, "changed": 0, "unchanged": 1, "skipped": 1}
+    days = db.conn.execute(
+        text("SELECT day FROM distributions WHERE ticker = 'VEE.TO';")
+    ).scalars()
+    assert [db.as_date(day) for day in days] == [date(2017, 3, 7)]
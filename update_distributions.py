@@ -7,46 +7,100 @@ from db import db
 usage = """
 Load distributions from CSV file into the database.
 
+Distributions on days not in the market calendar of the database are skipped.
+Those already loaded are updated if their type or amount changed.
+
 Usage:
-    update_distributions.py [-h] [--env <env>]
+    update_distributions.py [-h] [--env <env>] [--file <file>] [--chunk-size <rows>]
 
 Options:
-    -h --help               Show this
-    -e <env> --env <env>    Environment to load prices into [default: dev]
+    -h --help                      Show this
+    -e <env> --env <env>           Environment to load prices into [default: dev]
+    -f <file> --file <file>        CSV file to load [default: populate/distributions.csv]
+    -c <rows> --chunk-size <rows>  Rows to read from the file at a time [default: 10000]
 """
 
+
 def connect(env):
     db.ensure_connected(env)
 
 
+def update_distributions(path, chunksize=10000):
+    """Merge the distributions of a CSV file into the database, in a single transaction.
+
+    The file is streamed in chunks into a temporary staging table (where later rows for
+    the same ticker and day replace earlier ones), and merged into `distributions`
+    with a single upsert.
+
+    Returns:
+    dict -- number of distributions `inserted`, `changed` and `unchanged`, and
+            `skipped` for being on days not in the market calendar
+    """
+    with db.transaction() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS temp.distributionsStaging;")
+        conn.exec_driver_sql(
+            """CREATE TEMP TABLE distributionsStaging (
+                ticker text not null,
+                day date not null,
+                type text not null,
+                amount numeric(9, 6),
+                primary key (ticker, day)
+            );"""
+        )
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            chunk["Date"] = pd.to_datetime(chunk["Date"]).dt.date
+            conn.exec_driver_sql(
+                """INSERT INTO distributionsStaging (ticker, day, type, amount)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (ticker, day) DO UPDATE
+                SET type = excluded.type, amount = excluded.amount;""",
+                list(
+                    chunk[["Ticker", "Date", "Type", "Amount"]].itertuples(
+                        index=False, name=None
+                    )
+                ),
+            )
+
+        counts = conn.execute(
+            text(
+                """WITH staged AS
+                    (SELECT *, day IN (SELECT day FROM marketDays) AS in_calendar
+                    FROM distributionsStaging)
+                SELECT
+                    TOTAL(s.in_calendar AND d.ticker IS NULL) AS inserted,
+                    TOTAL(s.in_calendar AND d.ticker IS NOT NULL
+                        AND (d.type IS NOT s.type OR d.amount IS NOT s.amount))
+                        AS changed,
+                    TOTAL(s.in_calendar AND d.type IS s.type AND d.amount IS s.amount)
+                        AS unchanged,
+                    TOTAL(NOT s.in_calendar) AS skipped
+                FROM staged s LEFT JOIN distributions d USING (ticker, day);"""
+            )
+        ).one()
+
+        conn.exec_driver_sql(
+            """INSERT INTO distributions (ticker, day, type, amount)
+            SELECT s.ticker, s.day, s.type, s.amount
+            FROM distributionsStaging s
+            WHERE s.day IN (SELECT day FROM marketDays)
+            ON CONFLICT (ticker, day) DO UPDATE
+            SET type = excluded.type, amount = excluded.amount
+            WHERE type IS NOT excluded.type OR amount IS NOT excluded.amount;"""
+        )
+        conn.exec_driver_sql("DROP TABLE temp.distributionsStaging;")
+
+    return {name: int(value) for name, value in counts._mapping.items()}
+
+
 def main(args):
     env = args["--env"]
     connect(env)
-    table = pd.read_csv("populate/distributions.csv")
-
-    # Filter data using vectorized operation
-    filtered = table[table["Date"] >= "2016-09-08"]  # TODO: so hacky; fix
-
-    # Prepare data for batch insert
-    data = [
-        {
-            "ticker": row.Ticker,
-            "day": row.Date,
-            "type": row.Type,
-            "amount": row.Amount,
-        }
-        for row in filtered.itertuples()
-    ]
-
-    # Insert records using SQLAlchemy
-    for record in data:
-        db.conn.execute(
-            text("""
-                INSERT INTO distributions (ticker, day, type, amount)
-                VALUES (:ticker, :day, :type, :amount) ON CONFLICT DO NOTHING;
-            """),
-            record
-        )
+    counts = update_distributions(args["--file"], int(args["--chunk-size"]))
+    print(
+        f"{counts['inserted']} distribution(s) inserted, {counts['changed']} changed, "
+        f"{counts['unchanged']} unchanged, {counts['skipped']} skipped"
+    )
+    return counts
 
 
 if __name__ == "__main__":
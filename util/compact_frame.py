@@ -0,0 +1,146 @@
+import copy
+import numpy as np
+import pandas as pd
+
+
+class CompactFrame:
+    """Day-indexed DataFrame held with compact dtypes, and some columns derived on access.
+
+    Columns are stored as follows:
+        - `derived` columns are not stored, but computed from the others when accessed
+        - `ratios` columns are stored with the `ratios` dtype of the policy
+        - datetime columns are stored as int32 offsets in days from the first day
+        - `counts` columns (whole numbers, or missing) are stored as int32
+        - integer and boolean columns are stored as int8 if their values fit, or int32
+        - all other columns are stored with the `amounts` dtype of the policy
+    and restored as float64, datetime64 and int64 columns when accessed. Missing datetimes
+    and counts are stored as `missing_offset`.
+
+    Public methods:
+    expand(rows, columns) -- Return the DataFrame for all rows or the given positions, with
+                             all columns or the given ones
+    column(name) -- Return a column, for all rows
+    row(i) -- Return the row at position `i`, with all columns
+    value(column, day) -- Return the value of a column on the given day
+    extend(df, keep) -- Return a CompactFrame with the first `keep` rows of this one and
+                        the rows of `df`
+
+    Instance variables:
+    columns -- List of column names, stored or derived, in their original order
+    index -- DatetimeIndex of the frame
+    stored -- DataFrame with the stored columns, in their compact dtypes
+    """
+
+    # Offset stored in place of missing datetimes and counts
+    missing_offset = np.iinfo(np.int32).min
+
+    def expand(self, rows=None, columns=None):
+        """Return the DataFrame for all rows or the given positions, and all columns or some.
+
+        Derived columns are computed from all stored columns, so only asking for stored
+        columns restores just those.
+        """
+        columns = self.columns if columns is None else list(columns)
+        derive = any(column in self._derived for column in columns)
+        df = self.stored if rows is None else self.stored.iloc[rows]
+        if not derive:
+            df = df[columns]
+        expanded = pd.DataFrame(index=df.index)
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if column in self._datetimes:
+                missing = values == self.missing_offset
+                days = np.where(missing, 0, values).astype("timedelta64[D]")
+                dates = (self._origin + days).astype("datetime64[ns]")
+                dates[missing] = np.datetime64("NaT", "ns")
+                expanded[column] = dates
+            elif column in self._counts:
+                counts = values.astype(np.float64)
+                counts[values == self.missing_offset] = np.nan
+                expanded[column] = counts
+            elif column in self._integers:
+                expanded[column] = values.astype(np.int64)
+            else:
+                expanded[column] = values.astype(np.float64)
+        if derive:
+            for column, fn in self._derived.items():
+                expanded[column] = fn(expanded)
+        return expanded[columns]
+
+    def column(self, name):
+        """Return a column, for all rows."""
+        return self.expand(columns=[name])[name]
+
+    def row(self, i):
+        """Return the row at position `i`, with all columns."""
+        return self.expand([i]).iloc[0]
+
+    def value(self, column, day):
+        """Return the value of a column on the given day."""
+        return self.expand([self.index.get_loc(day)])[column].iloc[0]
+
+    def extend(self, df, keep):
+        """Return a CompactFrame with the first `keep` rows of this one and the rows of `df`.
+
+        The rows of `df` are stored as those of this frame, without restoring the rows kept.
+        """
+        tail = CompactFrame(
+            df, self._derived, self._ratios, self._policy, self._origin, self._counts
+        )
+        extended = copy.copy(self)
+        extended.stored = pd.concat(
+            [self.stored.iloc[:keep], tail.stored[self.stored.columns]]
+        )
+        extended.index = extended.stored.index
+        return extended
+
+    def __init__(
+        self, df, derived=None, ratios=None, policy=None, origin=None, counts=None
+    ):
+        """Instantiate a CompactFrame object.
+
+        Keyword arguments:
+        df -- day-indexed DataFrame to hold
+        derived -- dict with column names as keys, and functions computing the column from
+                   a DataFrame with the other columns as values, in dependency order
+        ratios -- list of names of the columns holding ratios
+        policy -- dict with the `ratios` and `amounts` dtypes. float32 for ratios and
+                  float64 for amounts, if None
+        origin -- day that datetime columns are stored as offsets from. The first day,
+                  if None
+        counts -- list of names of the float columns holding whole numbers, or missing values
+        """
+        policy = {"ratios": "float32", "amounts": "float64", **(policy or {})}
+        self._derived = {c: f for c, f in (derived or {}).items() if c in df.columns}
+        self._ratios = ratios
+        self._counts = [c for c in (counts or []) if c in df.columns]
+        self._policy = policy
+        self.columns = list(df.columns)
+        self.index = df.index
+        if origin is None and len(df.index) > 0:
+            origin = df.index.values[0]
+        self._origin = origin
+        self._datetimes = []
+        self._integers = []
+        stored = {}
+        for column in self.columns:
+            if column in self._derived:
+                continue
+            values = df[column]
+            if pd.api.types.is_datetime64_any_dtype(values):
+                self._datetimes.append(column)
+                offsets = (values - self._origin).dt.days
+                stored[column] = offsets.fillna(self.missing_offset).astype(np.int32)
+            elif column in self._counts:
+                stored[column] = values.fillna(self.missing_offset).astype(np.int32)
+            elif pd.api.types.is_integer_dtype(values) or pd.api.types.is_bool_dtype(
+                values
+            ):
+                self._integers.append(column)
+                small = values.empty or values.abs().max() <= np.iinfo(np.int8).max
+                stored[column] = values.astype(np.int8 if small else np.int32)
+            elif column in (ratios or []):
+                stored[column] = values.astype(policy["ratios"])
+            else:
+                stored[column] = values.astype(policy["amounts"])
+        self.stored = pd.DataFrame(stored, index=df.index)
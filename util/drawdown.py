@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+
+def drawdowns(returns, days, state=None):
+    """
+    Compute the peaks and drawdowns of a series of cumulative returns in a single pass
+
+    Every figure is a prefix scan (running maxima and minima, and the position of the
+    last running maximum), so the computation is linear in the length of the series,
+    and it can be resumed from the `state` after the last row of an earlier series.
+
+    Parameters
+    ----------
+    returns: array-like of float
+        Cumulative returns from a fixed origin, such as time-weighted returns
+    days: array-like of datetime64
+        Time of each of the returns, in increasing order
+    state: dict, optional
+        Running state before the first row, as returned by this function.
+        The series is taken to start from scratch, if None
+
+    Returns
+    -------
+    A dict of NumPy arrays, one value per row:
+        - `last_peak_twrr`, highest returns to date
+        - `last_peak`, time of the last peak
+        - `current_drawdown`, percentage drop from the last peak
+        - `greatest_drawdown`, greatest percentage drop to date
+        - `drawdown_duration`, days since the last peak
+        - `recovery_days`, on the rows where a drawdown ends, days it took to recover
+          from its peak. NaN elsewhere
+    and the running state after the last row
+    """
+    s = initial_state if state is None else state
+    returns = np.asarray(returns, dtype=float)
+    days = np.asarray(days, dtype="datetime64[ns]")
+    peak_day = pd.Timestamp(s["peak_day"]).to_datetime64()
+    one_day = np.timedelta64(1, "D")
+
+    peaks = np.maximum.accumulate(np.concatenate([[s["peak_twrr"]], returns]))
+    last_peak_twrr = peaks[1:]
+    new_peak = returns > peaks[:-1]
+    peak_at = np.maximum.accumulate(np.where(new_peak, np.arange(len(returns)), -1))
+    last_peak = np.where(peak_at >= 0, days[np.maximum(peak_at, 0)], peak_day)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        current_drawdown = (returns - last_peak_twrr) / (1 + last_peak_twrr)
+    greatest_drawdown = np.minimum(
+        s["greatest_drawdown"], np.minimum.accumulate(current_drawdown)
+    )
+    drawdown_duration = (days - last_peak) / one_day
+    previous_drawdown = np.concatenate([[s["drawdown"]], current_drawdown[:-1]])
+    previous_peak = np.concatenate([[peak_day], last_peak[:-1]])
+    recovery_days = np.where(
+        (current_drawdown >= 0) & (previous_drawdown < 0),
+        (days - previous_peak) / one_day,
+        np.nan,
+    )
+
+    if len(returns) > 0:
+        s = {
+            "peak_twrr": last_peak_twrr[-1],
+            "peak_day": pd.Timestamp(last_peak[-1]),
+            "drawdown": current_drawdown[-1],
+            "greatest_drawdown": greatest_drawdown[-1],
+        }
+    return {
+        "last_peak_twrr": last_peak_twrr,
+        "last_peak": last_peak,
+        "current_drawdown": current_drawdown,
+        "greatest_drawdown": greatest_drawdown,
+        "drawdown_duration": drawdown_duration,
+        "recovery_days": recovery_days,
+    }, s
+
+
+def last_drawdowns(returns, days, state=None):
+    """
+    Compute the peaks and drawdowns of a series of cumulative returns, on its last row
+
+    Only the running maxima are computed for every row (to find the greatest
+    drawdown), and peaks are located by their first occurrence.
+
+    Parameters
+    ----------
+    returns: array-like of float
+        Cumulative returns from a fixed origin, such as time-weighted returns. Not empty
+    days: array-like of datetime64
+        Time of each of the returns, in increasing order
+    state: dict, optional
+        Running state before the first row, as returned by `drawdowns`.
+        The series is taken to start from scratch, if None
+
+    Returns
+    -------
+    A dict with the figures of `drawdowns` on the last row
+    """
+    s = initial_state if state is None else state
+    returns = np.asarray(returns, dtype=float)
+    days = np.asarray(days, dtype="datetime64[ns]")
+    one_day = np.timedelta64(1, "D")
+
+    def peak(n):
+        """Return the peak returns and its time over the first `n` rows."""
+        if n > 0 and returns[:n].max() > s["peak_twrr"]:
+            at = np.argmax(returns[:n])
+            return returns[at], days[at]
+        return s["peak_twrr"], pd.Timestamp(s["peak_day"]).to_datetime64()
+
+    peaks = np.maximum.accumulate(np.concatenate([[s["peak_twrr"]], returns]))[1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        current_drawdowns = (returns - peaks) / (1 + peaks)
+    last_peak_twrr, last_peak = peak(len(returns))
+    previous_drawdown = current_drawdowns[-2] if len(returns) > 1 else s["drawdown"]
+    recovery_days = np.nan
+    if current_drawdowns[-1] >= 0 and previous_drawdown < 0:
+        recovery_days = (days[-1] - peak(len(returns) - 1)[1]) / one_day
+    return {
+        "last_peak_twrr": last_peak_twrr,
+        "last_peak": pd.Timestamp(last_peak),
+        "current_drawdown": current_drawdowns[-1],
+        "greatest_drawdown": min(s["greatest_drawdown"], current_drawdowns.min()),
+        "drawdown_duration": (days[-1] - last_peak) / one_day,
+        "recovery_days": recovery_days,
+    }
+
+
+# Running state before the first row of a series
+initial_state = {
+    "peak_twrr": -np.inf,
+    "peak_day": pd.NaT,
+    "drawdown": 0.0,
+    "greatest_drawdown": np.inf,
+}
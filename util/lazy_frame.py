@@ -0,0 +1,108 @@
+from collections import namedtuple
+
+import pandas as pd
+
+from util import tracer
+
+
+Metric = namedtuple("Metric", ["inputs", "fn", "last", "row"], defaults=[None, False])
+Metric.__doc__ = """Definition of a column computed from other columns.
+
+inputs -- names of the columns the metric is computed from
+fn -- function of the input columns (as Series) and the running state, returning the column
+last -- function of the input columns and the running state, returning only the value on
+        the last row. The last value of the whole column is taken, if None
+row -- whether each value only depends on the inputs on the same row, so the last value can
+       be computed from the last value of each input
+"""
+
+
+class LazyFrame:
+    """Day-indexed frame whose columns are computed from a registry of metrics when first accessed.
+
+    Each metric declares the columns it is computed from, so accessing a column computes
+    (and memoizes) only the columns it depends on. Metrics with names starting with an
+    underscore hold intermediate results, and are not part of the frame.
+
+    Public methods:
+    column(name) -- Return a column, computing it and its inputs on first access
+    last(name) -- Return the value of a column on the last row, computing as little as possible
+    latest() -- Return the last row, with all columns
+    frame() -- Return the DataFrame with all columns
+
+    Instance variables:
+    columns -- List of column names, in the order of the base frame and the registry
+    index -- DatetimeIndex of the frame
+    state -- Running state before the first row, passed on to the metrics
+    """
+
+    def column(self, name):
+        """Return a column, computing it and its inputs on first access."""
+        if name not in self._columns:
+            metric = self._metrics[name]
+            inputs = [self.column(i) for i in metric.inputs]
+            with tracer.stage(f"metric:{name}"):
+                values = metric.fn(*inputs, self.state)
+            if not name.startswith("_"):
+                values = pd.Series(values, index=self.index, name=name)
+            self._columns[name] = values
+        return self._columns[name]
+
+    def last(self, name):
+        """Return the value of a column on the last row, computing as little as possible."""
+        if name not in self._last:
+            metric = self._metrics.get(name)
+            if name in self._columns or metric is None:
+                value = self.column(name).iloc[-1]
+            elif metric.row:
+                inputs = [_as_row(self.last(i)) for i in metric.inputs]
+                value = pd.Series(metric.fn(*inputs, self.state)).iloc[0]
+            elif metric.last is not None:
+                inputs = [self.column(i) for i in metric.inputs]
+                value = metric.last(*inputs, self.state)
+            else:
+                value = self.column(name).iloc[-1]
+            self._last[name] = value
+        return self._last[name]
+
+    def latest(self):
+        """Return the last row, with all columns."""
+        return pd.Series(
+            [self.last(c) for c in self.columns],
+            index=self.columns,
+            name=self.index[-1],
+            dtype=object,
+        )
+
+    def frame(self):
+        """Return the DataFrame with all columns."""
+        return pd.DataFrame({c: self.column(c) for c in self.columns}, index=self.index)
+
+    def __init__(self, base, metrics, state=None, columns=None):
+        """Instantiate a LazyFrame object.
+
+        Keyword arguments:
+        base -- day-indexed DataFrame with the columns the metrics are computed from
+        metrics -- dict with column names as keys and Metric objects as values
+        state -- running state before the first row, passed on to the metrics
+        columns -- order of the columns in the frame. The base columns followed by the
+                   metrics, if None
+        """
+        self.index = base.index
+        self.state = state
+        self._metrics = metrics
+        self._columns = {c: base[c] for c in base.columns}
+        self._last = {}
+        if columns is None:
+            columns = list(base.columns) + [
+                c for c in metrics if not c.startswith("_") and c not in self._columns
+            ]
+        self.columns = list(columns)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def _as_row(value):
+    """Wrap the last value of a column (or the last row of a DataFrame) as a single row."""
+    return pd.DataFrame([value]) if isinstance(value, pd.Series) else pd.Series([value])
@@ -0,0 +1,241 @@
+import numpy as np
+
+
+# Methods to assign a cost to the units sold
+methods = ["acb", "fifo"]
+
+# Width, in natural log units, of the blocks the average cost scan is rebased on
+_span = 256.0
+
+
+def cost_basis(keys, days, txtypes, units, totals, method="acb"):
+    """
+    Book a ledger of transactions into lots, for all accounts and tickers in a single pass
+
+    Transactions are sorted by key and day (keeping their order within a day), and every
+    figure is a grouped prefix scan over the sorted arrays, so the ledger is processed in
+    time linear in its length plus the sort. Buys add units and their total to the cost
+    basis of their key. Sales take units away and, with them, the cost of the units sold:
+        - with `acb`, their share of the adjusted cost base (average cost) held
+        - with `fifo`, the cost of the earliest units bought and not sold yet
+    Selling more units than held is not supported: the units held go negative, and the
+    cost basis to zero.
+
+    Parameters
+    ----------
+    keys: array-like of int
+        Pool of units each transaction belongs to, such as an account and ticker code
+    days: array-like of datetime64
+        Day of each transaction
+    txtypes: array-like of str
+        Type of each transaction: `buy`, `sale`, `dividend`, `deposit` or `withdrawal`
+    units: array-like of float
+        Units bought or sold. Ignored for other types of transactions
+    totals: array-like of float
+        Cash paid for a buy, received for a sale or a dividend, deposited or withdrawn
+    method: str
+        Method to assign a cost to the units sold, `acb` or `fifo`
+
+    Returns
+    -------
+    A dict of NumPy arrays, one value per transaction, in the order given:
+        - `units`, change in the units held
+        - `cost`, change in the cost basis of the units held
+        - `realized`, gains realized by a sale: its total minus the cost of the units sold
+        - `cash`, cash flow into the account: negative for buys and withdrawals
+    The units and cost basis held are the cumulative sums of the changes of each key
+    """
+    if method not in methods:
+        raise ValueError(f"Unknown cost basis method: {method}")
+    keys = np.asarray(keys, dtype=np.int64)
+    txtypes = np.asarray(txtypes)
+    order = _ledger_order(keys, np.asarray(days, dtype="datetime64[D]"))
+    keys, txtypes = keys[order], txtypes[order]
+    units = np.nan_to_num(np.asarray(units, dtype=float)[order])
+    totals = np.nan_to_num(np.asarray(totals, dtype=float)[order])
+
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    bought = np.where(txtypes == "buy", units, 0.0)
+    sold = np.where(txtypes == "sale", units, 0.0)
+    paid = np.where(txtypes == "buy", totals, 0.0)
+
+    if method == "acb":
+        held = _cumsum_by(bought - sold, first)
+        cost = _average_cost(held, held - bought + sold, paid, sold > 0, first)
+    else:
+        cost = _first_in_cost(bought, sold, paid, first)
+    cost_change = cost - np.where(first, 0.0, np.roll(cost, 1))
+
+    booked = {
+        "units": bought - sold,
+        "cost": cost_change,
+        "realized": np.where(txtypes == "sale", totals + cost_change, 0.0),
+        "cash": np.where(np.isin(txtypes, ["buy", "withdrawal"]), -totals, totals),
+    }
+    unsorted = np.empty_like(order)
+    unsorted[order] = np.arange(len(order))
+    return {name: values[unsorted] for name, values in booked.items()}
+
+
+def open_lots(keys, days, txtypes, units, totals, method="acb"):
+    """
+    Return the lots still held after a ledger of transactions, to book more from
+
+    Booking the lots as buys, ahead of later transactions, books those as the whole
+    ledger would be:
+        - with `acb`, a single lot per key, of the units held at their adjusted cost base
+        - with `fifo`, the units of each buy not sold yet, at the price they were bought
+
+    Parameters
+    ----------
+    Those of `cost_basis()`
+
+    Returns
+    -------
+    A dict of NumPy arrays, one value per lot, sorted by key and in the order bought:
+        - `key`, pool of units the lot belongs to
+        - `units`, units held
+        - `cost`, cost basis of the units held
+    """
+    if method not in methods:
+        raise ValueError(f"Unknown cost basis method: {method}")
+    keys = np.asarray(keys, dtype=np.int64)
+    txtypes = np.asarray(txtypes)
+    units = np.nan_to_num(np.asarray(units, dtype=float))
+    totals = np.nan_to_num(np.asarray(totals, dtype=float))
+    if method == "acb":
+        booked = cost_basis(keys, days, txtypes, units, totals, method)
+        pools, pool = np.unique(keys, return_inverse=True)
+        held = np.bincount(pool, booked["units"], minlength=len(pools))
+        cost = np.bincount(pool, booked["cost"], minlength=len(pools))
+        kept = held > 0
+        return {"key": pools[kept], "units": held[kept], "cost": cost[kept]}
+
+    order = _ledger_order(keys, np.asarray(days, dtype="datetime64[D]"))
+    keys, txtypes, units, totals = keys[order], txtypes[order], units[order], totals[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    group = np.cumsum(first) - 1
+    bought = np.where(txtypes == "buy", units, 0.0)
+    sold = np.where(txtypes == "sale", units, 0.0)
+    bought_to_date = _cumsum_by(bought, first)
+    consumed = np.minimum(
+        np.bincount(group, sold)[group], np.bincount(group, bought)[group]
+    )
+    left = np.clip(bought_to_date - consumed, 0.0, bought)
+    kept = left > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cost = left * totals / bought
+    return {"key": keys[kept], "units": left[kept], "cost": cost[kept]}
+
+
+def _ledger_order(keys, days):
+    """Return the positions of the transactions sorted by key and day, stably.
+
+    Keys and days are packed into a single integer, which sorts faster than both apart.
+    """
+    if len(keys) == 0:
+        return np.arange(0)
+    day_numbers = days.astype(np.int64) - days.min().astype(np.int64)
+    packed = (keys - keys.min()) * (day_numbers.max() + 1) + day_numbers
+    return np.argsort(packed, kind="stable")
+
+
+def _average_cost(held, held_before, paid, is_sale, first):
+    """Return the adjusted cost base held after each transaction.
+
+    The cost base follows the recurrence `cost = ratio * previous + paid`, where a sale
+    keeps the ratio of the units held after and before it, and a buy keeps it all. Its
+    solution is `cost[i] = sum(paid[j] * exp(log_ratio[i] - log_ratio[j]))` over the
+    transactions up to `i`, with the cumulative log ratios as prefix sums. Those only
+    decrease, so the exponentials are taken relative to blocks of `_span` width: earlier
+    terms than the previous block are smaller than a dollar by far, and dropped.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(
+            is_sale, np.where(held_before > 0, np.clip(held / held_before, 0, 1), 0), 1
+        )
+        # Selling everything starts the cost base over
+        reset = first | (ratio == 0)
+        log_ratio = _cumsum_by(np.where(reset, 0.0, np.log(ratio)), reset)
+
+    block = np.floor(-log_ratio / _span)
+    block_first = reset.copy()
+    block_first[1:] |= block[1:] != block[:-1]
+    scaled = _cumsum_by(paid * np.exp(-log_ratio - _span * block), block_first)
+
+    # Sum over the previous block of each row, if it is in the same run of holdings
+    starts = np.flatnonzero(block_first)
+    ends = np.append(starts[1:], len(block)) - 1
+    previous = np.zeros(len(starts))
+    follows = ~reset[starts[1:]] & (block[starts[1:]] == block[starts[:-1]] + 1)
+    previous[1:] = np.where(follows, scaled[ends[:-1]], 0.0)
+    previous = np.repeat(previous, ends - starts + 1)
+
+    return np.exp(log_ratio + _span * block) * (scaled + np.exp(-_span) * previous)
+
+
+def _first_in_cost(bought, sold, paid, first):
+    """Return the cost basis held after each transaction, selling the earliest units first.
+
+    Units sold to date are consumed from the cumulative units bought, so the cost of
+    those sold is the cumulative cost of the buys, interpolated at the units sold. The
+    interpolation looks up the lot each row is consuming by merging the rows into the
+    buys, sorted by key and cumulative units.
+    """
+    group = np.cumsum(first) - 1
+    bought_to_date = _cumsum_by(bought, first)
+    paid_to_date = _cumsum_by(paid, first)
+    consumed = np.minimum(_cumsum_by(sold, first), bought_to_date)
+
+    lots = np.flatnonzero(bought > 0)
+    if len(lots) == 0:
+        return paid_to_date
+    lot_group = group[lots]
+    lot_units = bought_to_date[lots]
+    lot_paid = _cumsum_by(np.where(bought > 0, paid, 0.0), first)[lots]
+    lot_price = paid[lots] / bought[lots]
+
+    # Number of lots at or before each row's units consumed, in the merged order
+    is_row = np.concatenate([np.zeros(len(lots), dtype=bool), np.ones(len(group), bool)])
+    merged = np.lexsort(
+        (
+            is_row,
+            np.concatenate([lot_units, consumed]),
+            np.concatenate([lot_group, group]),
+        )
+    )
+    lots_before = np.cumsum(~is_row[merged])
+    found = np.empty(len(group), dtype=int)
+    found[merged[is_row[merged]] - len(lots)] = lots_before[is_row[merged]]
+
+    last = found - 1
+    has_last = (last >= 0) & (lot_group[np.maximum(last, 0)] == group)
+    has_next = found < len(lots)
+    has_next &= lot_group[np.minimum(found, len(lots) - 1)] == group
+    base_units = np.where(has_last, lot_units[np.maximum(last, 0)], 0.0)
+    base_paid = np.where(has_last, lot_paid[np.maximum(last, 0)], 0.0)
+    price = np.where(has_next, lot_price[np.minimum(found, len(lots) - 1)], 0.0)
+    return paid_to_date - base_paid - (consumed - base_units) * price
+
+
+def _cumsum_by(values, first):
+    """Return the cumulative sums of `values`, starting over on the rows flagged `first`.
+
+    The sums are scanned in doubling steps, each adding the partial sum `step` rows
+    back within the same group, so that no group ever adds or takes away the sums of
+    another. Taking them off a single cumulative sum instead would lose the precision
+    of small groups after large ones.
+    """
+    sums = np.asarray(values, dtype=float)
+    if len(sums) == 0:
+        return sums
+    positions = np.arange(len(sums))
+    offset = positions - np.maximum.accumulate(np.where(first, positions, 0))
+    step = 1
+    while step <= offset.max():
+        shifted = np.concatenate([np.zeros(step), sums[:-step]])
+        sums = np.where(offset >= step, sums + shifted, sums)
+        step *= 2
+    return sums
@@ -0,0 +1,161 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+Holiday = namedtuple("Holiday", ["name", "dates", "observed"], defaults=[False])
+Holiday.__doc__ = """Rule for a market holiday.
+
+name -- name of the holiday
+dates -- function of an array of years, returning the datetime64[D] date in each year
+observed -- whether the holiday moves to the next weekday that is not already a holiday,
+            when it falls on a weekend
+"""
+
+
+def fixed(month, day):
+    """Rule for a holiday on the same date every year."""
+
+    def dates(years):
+        return _first_of_month(years, month) + np.timedelta64(day - 1, "D")
+
+    return dates
+
+
+def nth_weekday(month, weekday, n):
+    """Rule for a holiday on the n-th given weekday (Monday is 0) of a month."""
+
+    def dates(years):
+        first = _first_of_month(years, month)
+        offset = (weekday - _weekday(first)) % 7
+        return first + (offset + 7 * (n - 1)).astype("timedelta64[D]")
+
+    return dates
+
+
+def weekday_before(month, day, weekday):
+    """Rule for a holiday on the last given weekday (Monday is 0) before a date."""
+
+    def dates(years):
+        limit = fixed(month, day)(years) - np.timedelta64(1, "D")
+        return limit - ((_weekday(limit) - weekday) % 7).astype("timedelta64[D]")
+
+    return dates
+
+
+def easter(offset=0):
+    """Rule for a holiday a number of days from (Western) Easter Sunday."""
+
+    def dates(years):
+        # Anonymous Gregorian algorithm, on arrays of years
+        a = years % 19
+        b, c = years // 100, years % 100
+        d, e = b // 4, b % 4
+        g = (8 * b + 13) // 25
+        h = (19 * a + b - d - g + 15) % 30
+        i, k = c // 4, c % 4
+        j = (32 + 2 * e + 2 * i - h - k) % 7
+        m = (a + 11 * h + 19 * j) // 433
+        month = (h + j - 7 * m + 90) // 25
+        day = (h + j - 7 * m + 33 * month + 19) % 32
+        sunday = _first_of_month(years, month) + (day - 1).astype("timedelta64[D]")
+        return sunday + np.timedelta64(offset, "D")
+
+    return dates
+
+
+# Holidays of the Toronto Stock Exchange
+tsx_holidays = [
+    Holiday("New Year's Day", fixed(1, 1), observed=True),
+    Holiday("Family Day", nth_weekday(2, 0, 3)),
+    Holiday("Good Friday", easter(-2)),
+    Holiday("Victoria Day", weekday_before(5, 25, 0)),
+    Holiday("Canada Day", fixed(7, 1), observed=True),
+    Holiday("Civic Holiday", nth_weekday(8, 0, 1)),
+    Holiday("Labour Day", nth_weekday(9, 0, 1)),
+    Holiday("Thanksgiving Day", nth_weekday(10, 0, 2)),
+    Holiday("Christmas Day", fixed(12, 25), observed=True),
+    Holiday("Boxing Day", fixed(12, 26), observed=True),
+]
+
+
+class MarketCalendar:
+    """Open and closed market days, generated from holiday rules for any range of years.
+
+    Holidays are computed for all the years in a range at once, and memoized per year,
+    so the calendar can stand in for the `marketDays` table without querying it.
+
+    Public methods:
+    holidays(first_year, last_year) -- Return the holidays in a range of years
+    days(from_day, to_day) -- Return whether the market is open on every day of a range
+    is_open(day) -- Return whether the market is open on a day
+
+    Instance variables:
+    rules -- List of Holiday rules, applied in order
+    """
+
+    def holidays(self, first_year, last_year):
+        """Return a DatetimeIndex with the (observed) holidays in a range of years."""
+        years = np.arange(first_year, last_year + 1)
+        missing = [y for y in years if y not in self._holidays]
+        if missing:
+            for year, days in self._generate(np.array(missing)).items():
+                self._holidays[year] = days
+        return pd.DatetimeIndex(
+            np.concatenate([self._holidays[y] for y in years]), name="day"
+        )
+
+    def days(self, from_day, to_day):
+        """Return a Series indexed by day, with 1 on the days the market is open and 0 otherwise."""
+        # Without a frequency, like the days read from the database
+        days = pd.DatetimeIndex(pd.date_range(from_day, to_day, name="day"), freq=None)
+        if len(days) == 0:
+            return pd.Series(index=days, dtype=int, name="open")
+        holidays = self.holidays(days[0].year, days[-1].year)
+        is_open = (days.dayofweek < 5) & ~days.isin(holidays)
+        return pd.Series(is_open.astype(int), index=days, name="open")
+
+    def is_open(self, day):
+        """Return whether the market is open on a day."""
+        return bool(self.days(day, day).iloc[0])
+
+    def __init__(self, rules=None):
+        """Instantiate a MarketCalendar object, with the TSX holidays unless `rules` is provided."""
+        self.rules = tsx_holidays if rules is None else rules
+        self._holidays = {}
+
+    def _generate(self, years):
+        """Return a dict with the years as keys, and arrays of their holidays as values."""
+        taken = np.empty((len(years), 0), dtype="datetime64[D]")
+        for rule in self.rules:
+            dates = rule.dates(years)
+            if rule.observed:
+                # Shifted days may land on another weekend day or holiday, hence the loop
+                while True:
+                    taken_already = (dates[:, None] == taken).any(axis=1)
+                    moved = (_weekday(dates) >= 5) | taken_already
+                    if not moved.any():
+                        break
+                    dates = dates + moved.astype("timedelta64[D]")
+            taken = np.column_stack([taken, dates])
+        return {int(year): np.sort(days) for year, days in zip(years, taken)}
+
+
+def _first_of_month(years, month):
+    """Return the first day of a month (or array of months) in each year, as datetime64[D]."""
+    months = (years - 1970) * 12 + (month - 1)
+    return months.astype("datetime64[M]").astype("datetime64[D]")
+
+
+def _weekday(days):
+    """Return the weekday (Monday is 0) of datetime64[D] days."""
+    return (days.astype("int64") - 4) % 7  # 1970-01-01 was a Thursday
+
+
+@lru_cache(maxsize=None)
+def market_calendar():
+    """Return the shared TSX MarketCalendar, with the holidays computed so far."""
+    return MarketCalendar()
+
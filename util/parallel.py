@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from db import db
+
+
+def map_chunks(fn, items, data, workers=None):
+    """
+    Apply a query function over chunks of items, each chunk on its own thread and connection
+
+    SQLite reads on separate connections run concurrently, as does most of the work that
+    pandas does when reading the results. In-memory databases cannot be shared across
+    connections, so they are always read in a single chunk on the connection given.
+    Each chunk checks out a connection of the pool, so there are no more chunks than
+    connections available to sessions (see `db.session_capacity()`): raise `pool_size`
+    in `config.db` to read with more threads. Chunks query with the settings of `data`.
+
+    Parameters
+    ----------
+    fn: function
+        Function of a Data object and a list of items, returning the results for those items
+    items: list
+        Items to split in chunks, such as ticker names
+    data: Data
+        Data object to use when not running in parallel
+    workers: int, optional
+        Number of chunks, and threads, to split the items in, up to the connections
+        available to sessions. No threads, if None
+
+    Returns
+    -------
+    List with the results of each chunk, in order
+    """
+    if workers is None or workers < 2 or len(items) < 2 or db.is_in_memory():
+        return [fn(data, list(items))]
+
+    def run(chunk):
+        with data.copy() as chunk_data:
+            return fn(chunk_data, list(chunk))
+
+    count = min(workers, len(items), db.session_capacity())
+    chunks = np.array_split(np.asarray(items, dtype=object), count)
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        return list(executor.map(run, chunks))
@@ -0,0 +1,87 @@
+from datetime import date
+import hashlib
+from pathlib import Path
+import shutil
+import tempfile
+
+from pyarrow import feather
+from sqlalchemy import text
+
+import config
+from db import db
+
+
+class PortfolioCache:
+    """On-disk cache of the frames computed for a portfolio.
+
+    Frames are stored as Feather files, in one directory per portfolio and data version.
+    The portfolio is identified by its environment, accounts, start date and cost method,
+    and the data version by the current date and the number of changes made to the
+    transactions, market days, prices and distributions in the database (kept in the
+    `tableVersions` table by triggers). Any change to those makes the stored frames stale,
+    and storing a new version removes the older ones. Each store is written to a staging
+    directory of its own, and renamed into place once complete.
+
+    Public methods:
+    key(accounts, from_day, cost_method) -- Return the cache key for a portfolio at the
+                                           current data version
+    load(key) -- Return the dict of frames stored under `key`, or None if there are none
+    store(key, frames) -- Store a dict of day-indexed frames under `key`
+
+    Instance variables:
+    path -- Path to the cache directory
+    """
+
+    def key(self, accounts, from_day, cost_method="acb"):
+        """Return the cache key (a directory) for a portfolio at the current data version."""
+        portfolio = self._digest(db._env, sorted(accounts), from_day, cost_method)
+        version = self._digest(date.today(), self._fingerprint())
+        return self.path / portfolio / version
+
+    def load(self, key):
+        """Return the frames stored under `key`, or None if there are none."""
+        if not key.is_dir():
+            return None
+        try:
+            return {
+                f.stem: feather.read_table(f, memory_map=True).to_pandas().set_index("day")
+                for f in sorted(key.glob("*.feather"))
+            }
+        except FileNotFoundError:
+            # Replaced by a newer version while being read
+            return None
+
+    def store(self, key, frames):
+        """Store day-indexed frames under `key`, replacing older versions.
+
+        If another writer stores the same version first, its frames are kept. Staging
+        directories of other writers are left alone.
+        """
+        key.parent.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f"{key.name}.", suffix=".tmp", dir=key.parent))
+        for name, df in frames.items():
+            df.rename_axis("day").reset_index().to_feather(staging / f"{name}.feather")
+        try:
+            staging.rename(key)
+        except OSError:
+            shutil.rmtree(staging)
+            if not key.is_dir():
+                raise
+        for old in key.parent.iterdir():
+            if old != key and old.suffix != ".tmp":
+                shutil.rmtree(old, ignore_errors=True)
+
+    def __init__(self, path=None):
+        """Instantiate a PortfolioCache object, in `config.cache` unless a path is given."""
+        self.path = Path(config.cache["path"] if path is None else path)
+
+    def _fingerprint(self):
+        """Return the number of changes made to the tables that portfolios are computed from."""
+        db.ensure_connected()
+        cur = db.conn.execute(
+            text("SELECT name, version FROM tableVersions ORDER BY name ASC;")
+        )
+        return tuple(tuple(row) for row in cur)
+
+    def _digest(self, *parts):
+        return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
@@ -1,22 +1,39 @@
+from datetime import date, timedelta
 import math
 
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 
 from db import db
 from util.yahoo_scraper import YahooScraper
 
 
 class PriceUpdater:
-    def __init__(self, verbose=False):
+    tolerance = 0.0051  # price differences below this are rounding noise
+
+    def __init__(self, verbose=False, overlap_days=5, backfill_days=3650):
+        """Instantiate a PriceUpdater object.
+
+        Tickers are requested from their last stored price, going back `overlap_days`
+        to pick up revised closes. Tickers without prices are backfilled `backfill_days`.
+        """
         self.verbose = verbose
+        self.overlap_days = overlap_days
+        self.backfill_days = backfill_days
         self.scraper = YahooScraper()
 
     def update(self):
         self.new_quotes = self.updated_quotes = 0
         if self.verbose:
             print("===Updating prices===")
-        self._record_quotes(self.scraper.get_quotes(symbols=self._ticker_symbols()))
+        symbols = self._ticker_symbols()
+        self._record_quotes(
+            self.scraper.get_quotes(
+                symbols=symbols, start_days=self._start_days(symbols)
+            )
+        )
         if self.verbose:
+            for symbol, error in self.scraper.failures.items():
+                print(f"! {symbol:6} could not be fetched: {error}")
             print(f"{self.new_quotes} new quote(s), {self.updated_quotes} update(s)")
             print("===Finished update===\n")
 
@@ -34,62 +51,96 @@ class PriceUpdater:
 
         return [ticker.name for ticker in cur.fetchall()]
 
-    def _record_quotes(self, quotes):
-        for quote in quotes:
-            self._record_quote(quote)
-
-    def _record_quote(self, quote):
-        if quote.price is None:
-            if self.verbose:
-                print(f"x {quote.symbol:6} {quote.day}: -null- (skipping)")
-            return
-
+    def _start_days(self, symbols):
+        """Get the first day to request for each ticker, from its last stored price."""
         cur = db.conn.execute(
             text(
-                """SELECT close FROM assetprices
-            WHERE ticker = :ticker AND day = :day;"""
-            ),
-            {"ticker": quote.symbol, "day": quote.day},
+                """SELECT ticker, MAX(day) AS last_day
+            FROM assetprices
+            WHERE ticker IN :tickers
+            GROUP BY ticker;"""
+            ).bindparams(bindparam("tickers", expanding=True)),
+            {"tickers": symbols},
         )
+        last_days = {row.ticker: db.as_date(row.last_day) for row in cur.fetchall()}
+        backfill_day = date.today() - timedelta(days=self.backfill_days)
+        return {
+            symbol: last_days[symbol] - timedelta(days=self.overlap_days)
+            if symbol in last_days
+            else backfill_day
+            for symbol in symbols
+        }
+
+    def _record_quotes(self, quotes):
+        """Record all quotes at once, inserting new prices and updating changed ones.
 
-        existing_row = cur.fetchone()
-        if existing_row is None:
-            cur = db.conn.execute(
-                text(
-                    """
-                INSERT INTO assetprices (ticker, day, close)
-                VALUES (:ticker, :day, :close)
-                ON CONFLICT DO NOTHING;"""
-                ),
+        Existing prices are fetched in a single query to tell new, updated and unchanged
+        quotes apart, and all writes go through one upsert in a single transaction.
+        """
+        staged = {}
+        for quote in quotes:
+            if quote.price is None:
+                if self.verbose:
+                    print(f"x {quote.symbol:6} {quote.day}: -null- (skipping)")
+                continue
+            staged[(quote.symbol, quote.day)] = quote
+        if not staged:
+            return
+
+        existing = self._existing_prices(staged.values())
+        rows = []
+        for key, quote in staged.items():
+            if key not in existing:
+                self.new_quotes += 1
+                if self.verbose:
+                    print(f"+ {quote.symbol:6} {quote.day}:  -.-- -> {quote.price:.2f}")
+            elif existing[key] is None or not self._is_same_price(
+                existing[key], quote.price
+            ):
+                self.updated_quotes += 1
+                if self.verbose:
+                    prev_price = "-.--" if existing[key] is None else f"{existing[key]:.2f}"
+                    print(f"* {quote.symbol:6} {quote.day}: {prev_price} -> {quote.price:.2f}")
+            else:
+                continue
+            rows.append(
                 {
                     "ticker": quote.symbol,
                     "day": quote.day,
                     "close": round(quote.price, 2),
-                },
+                    "tolerance": self.tolerance,
+                }
             )
-            self.new_quotes += 1
-            if self.verbose:
-                print(f"+ {quote.symbol:6} {quote.day}:  -.-- -> {quote.price:.2f}")
-        else:
-            prev_price = existing_row.close
-            if not self._is_same_price(prev_price, quote.price):
-                cur = db.conn.execute(
+
+        if rows:
+            with db.transaction() as conn:
+                conn.execute(
                     text(
-                        """UPDATE assetprices
-                    SET close = :close
-                    WHERE ticker = :ticker AND day = :day;"""
+                        """INSERT INTO assetprices (ticker, day, close)
+                    VALUES (:ticker, :day, :close)
+                    ON CONFLICT (ticker, day) DO UPDATE
+                    SET close = excluded.close
+                    WHERE close IS NULL OR abs(close - excluded.close) > :tolerance;"""
                     ),
-                    {
-                        "ticker": quote.symbol,
-                        "day": quote.day,
-                        "close": round(quote.price, 2),
-                    },
+                    rows,
                 )
-                self.updated_quotes += 1
-                if self.verbose:
-                    print(
-                        f"* {quote.symbol:6} {quote.day}: {prev_price:.2f} -> {quote.price:.2f}"
-                    )
+
+    def _existing_prices(self, quotes):
+        """Return the stored closing prices for the quotes' tickers and days, keyed by both."""
+        cur = db.conn.execute(
+            text(
+                """SELECT ticker, day, close FROM assetprices
+            WHERE ticker IN :tickers
+                AND day >= :first_day
+                AND day <= :last_day;"""
+            ).bindparams(bindparam("tickers", expanding=True)),
+            {
+                "tickers": sorted({quote.symbol for quote in quotes}),
+                "first_day": min(quote.day for quote in quotes),
+                "last_day": max(quote.day for quote in quotes),
+            },
+        )
+        return {(row.ticker, db.as_date(row.day)): row.close for row in cur.fetchall()}
 
     def _is_same_price(self, prev, new):
-        return math.isclose(float(prev), float(new), abs_tol=0.0051)
+        return math.isclose(float(prev), float(new), abs_tol=self.tolerance)
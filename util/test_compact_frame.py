@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from pytest import approx, raises
+
+from util.compact_frame import CompactFrame
+
+
+def frame():
+    days = pd.date_range("2017-03-02", periods=4, freq="D", name="day")
+    return pd.DataFrame(
+        {
+            "days_from_start": [1, 2, 3, 4],
+            "market_day": [1, 1, 0, 0],
+            "capital": [10000.0, 10000.0, 10500.0, 10500.0],
+            "twrr": [0.0, 0.0012345678, 0.0012345678, -0.01],
+            "last_peak": pd.to_datetime(
+                ["2017-03-02", "2017-03-03", "2017-03-03", pd.NaT]
+            ),
+            "10k_equivalent": [10000.0, 10012.345678, 10012.345678, 9900.0],
+        },
+        index=days,
+    )
+
+
+def compact_frame(policy=None):
+    return CompactFrame(
+        frame(),
+        derived={"10k_equivalent": lambda df: 10000 * (df["twrr"] + 1)},
+        ratios=["twrr"],
+        policy=policy,
+    )
+
+
+def test_stored_dtypes():
+    stored = compact_frame().stored
+
+    assert list(stored.columns) == [
+        "days_from_start",
+        "market_day",
+        "capital",
+        "twrr",
+        "last_peak",
+    ]
+    assert stored.dtypes.to_dict() == {
+        "days_from_start": np.int8,
+        "market_day": np.int8,
+        "capital": np.float64,
+        "twrr": np.float32,
+        "last_peak": np.int32,
+    }
+    assert list(stored["last_peak"][:3]) == [0, 1, 1]
+
+
+def test_expand():
+    expanded = compact_frame().expand()
+
+    pd.testing.assert_frame_equal(expanded, frame(), rtol=1e-6)
+
+
+def test_expand_with_float64_ratios():
+    expanded = compact_frame({"ratios": "float64"}).expand()
+
+    pd.testing.assert_frame_equal(expanded, frame())
+
+
+def test_row_and_value():
+    compact = compact_frame()
+
+    assert compact.row(-1)["capital"] == 10500.0
+    assert pd.isna(compact.row(-1)["last_peak"])
+    assert compact.value("10k_equivalent", "2017-03-03") == approx(10012.345678)
+    assert compact.value("last_peak", "2017-03-04") == pd.Timestamp("2017-03-03")
+    with raises(KeyError):
+        compact.value("capital", "2017-03-10")
+
+
+def test_large_offsets_and_counts():
+    days = pd.date_range("2000-01-01", periods=1000, freq="D")
+    df = pd.DataFrame(
+        {"days_from_start": np.arange(1, 1001), "last_peak": days}, index=days
+    )
+    compact = CompactFrame(df)
+
+    assert compact.stored["days_from_start"].dtype == np.int32
+    pd.testing.assert_frame_equal(compact.expand(), df)
+
+
+def test_expand_some_rows_and_columns():
+    compact = compact_frame()
+
+    stored_only = compact.expand([1, 2], ["capital", "last_peak"])
+    with_derived = compact.expand(columns=["10k_equivalent"])
+
+    pd.testing.assert_frame_equal(
+        stored_only, frame().iloc[[1, 2]][["capital", "last_peak"]]
+    )
+    pd.testing.assert_frame_equal(
+        with_derived, frame()[["10k_equivalent"]], rtol=1e-6
+    )
+    pd.testing.assert_series_equal(compact.column("capital"), frame()["capital"])
+
+
+def test_counts_keep_missing_values():
+    df = frame()
+    df["recovery_days"] = [np.nan, 3.0, np.nan, 400.0]
+    compact = CompactFrame(df, counts=["recovery_days"])
+
+    assert compact.stored["recovery_days"].dtype == np.int32
+    pd.testing.assert_series_equal(
+        compact.column("recovery_days"), df["recovery_days"]
+    )
+
+
+def test_extend():
+    compact = compact_frame()
+    tail = frame().iloc[2:].copy()
+    tail.loc["2017-03-04", "capital"] = 11000.0
+
+    extended = compact.extend(tail, 2)
+
+    expected = pd.concat([frame().iloc[:2], tail])
+    pd.testing.assert_frame_equal(extended.expand(), expected, rtol=1e-6)
+    assert list(extended.stored["last_peak"][:3]) == [0, 1, 1]
+    assert len(compact.index) == 4
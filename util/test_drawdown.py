@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pytest import approx
+
+from util.drawdown import drawdowns, last_drawdowns
+
+
+days = pd.date_range("2017-03-01", periods=7, freq="D")
+returns = np.array([0.0, 0.1, 0.1, -0.01, 0.05, 0.1, 0.2])
+
+
+def test_drawdowns():
+    d, _ = drawdowns(returns, days)
+
+    assert d["last_peak_twrr"] == approx([0.0, 0.1, 0.1, 0.1, 0.1, 0.1, 0.2])
+    assert list(d["last_peak"]) == list(days[[0, 1, 1, 1, 1, 1, 6]])
+    assert d["current_drawdown"] == approx([0.0, 0.0, 0.0, -0.1, -0.05 / 1.1, 0.0, 0.0])
+    assert d["greatest_drawdown"] == approx([0.0, 0.0, 0.0, -0.1, -0.1, -0.1, -0.1])
+    assert d["drawdown_duration"] == approx([0, 0, 1, 2, 3, 4, 0])
+
+
+def test_recovery_days():
+    d, _ = drawdowns(returns, days)
+
+    assert np.isnan(d["recovery_days"][[0, 1, 2, 3, 4, 6]]).all()
+    assert d["recovery_days"][5] == 4
+
+
+def test_resume_from_state():
+    whole, whole_state = drawdowns(returns, days)
+    _, state = drawdowns(returns[:4], days[:4])
+    rest, rest_state = drawdowns(returns[4:], days[4:], state)
+
+    for column, values in rest.items():
+        np.testing.assert_array_equal(values, whole[column][4:])
+    assert rest_state == whole_state
+
+
+def test_empty_series():
+    d, state = drawdowns([], pd.DatetimeIndex([]))
+
+    assert all(len(values) == 0 for values in d.values())
+    assert state["peak_twrr"] == -np.inf
+
+
+
+def last_row(d):
+    return pd.Series(
+        {column: pd.Series(values).iloc[-1] for column, values in d.items()}
+    )
+
+
+@pytest.mark.parametrize("rows", [1, 2, 4, 5, 6, 7])
+def test_last_drawdowns_match_last_row(rows):
+    whole, _ = drawdowns(returns[:rows], days[:rows])
+    _, state = drawdowns(returns[:3], days[:3])
+
+    last = last_drawdowns(returns[:rows], days[:rows])
+    pd.testing.assert_series_equal(pd.Series(last), last_row(whole))
+    if rows > 3:
+        rest, _ = drawdowns(returns[3:rows], days[3:rows], state)
+        resumed = last_drawdowns(returns[3:rows], days[3:rows], state)
+        pd.testing.assert_series_equal(pd.Series(resumed), last_row(rest))
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from pytest import approx
+
+from util.lazy_frame import LazyFrame, Metric
+
+
+metrics = {
+    "total": Metric(
+        ["amount"],
+        lambda amount, s: s["total"] + amount.cumsum(),
+        last=lambda amount, s: s["total"] + amount.sum(),
+    ),
+    "doubled": Metric(["total"], lambda total, s: 2 * total, row=True),
+    "_stats": Metric(
+        ["amount"],
+        lambda amount, s: pd.DataFrame(
+            {"n": np.arange(1, len(amount) + 1), "max": amount.cummax()},
+            index=amount.index,
+        ),
+    ),
+    "max": Metric(["_stats"], lambda stats, s: stats["max"], row=True),
+    "running": Metric(["total"], lambda total, s: total.expanding().mean()),
+}
+
+
+def lazy_frame():
+    days = pd.date_range("2017-03-02", periods=4, freq="D", name="day")
+    base = pd.DataFrame({"amount": [1.0, 2.0, 4.0, 3.0]}, index=days)
+    return LazyFrame(base, metrics, {"total": 10.0})
+
+
+def test_columns_are_computed_on_access():
+    lazy = lazy_frame()
+
+    assert list(lazy.column("doubled")) == [22.0, 26.0, 34.0, 40.0]
+    assert set(lazy._columns) == {"amount", "total", "doubled"}
+
+
+def test_last_values_skip_columns():
+    lazy = lazy_frame()
+
+    assert lazy.last("doubled") == 40.0
+    assert lazy.last("max") == 4.0
+    assert set(lazy._columns) == {"amount", "_stats"}
+
+
+def test_frame_and_latest():
+    lazy = lazy_frame()
+    df = lazy.frame()
+
+    assert list(df.columns) == ["amount", "total", "doubled", "max", "running"]
+    assert df["running"].iloc[-1] == approx((11 + 13 + 17 + 20) / 4)
+    pd.testing.assert_series_equal(
+        lazy_frame().latest(), df.iloc[-1].astype(object), check_dtype=False
+    )
@@ -0,0 +1,207 @@
+from collections import deque
+import numpy as np
+import pytest
+from pytest import approx
+
+from util.lots import cost_basis, open_lots
+
+
+days = np.array(
+    ["2020-01-01", "2020-01-02", "2020-01-03", "2020-01-06", "2020-01-07"],
+    dtype="datetime64[D]",
+)
+txtypes = ["buy", "buy", "sale", "buy", "sale"]
+units = [10, 10, 5, 10, 25]
+totals = [100, 200, 100, 300, 1000]
+
+
+def test_average_cost_takes_sales_out_at_the_average_cost():
+    booked = cost_basis([0] * 5, days, txtypes, units, totals)
+
+    assert list(booked["units"]) == [10, 10, -5, 10, -25]
+    assert list(booked["cost"]) == approx([100, 200, -75, 300, -525])
+    assert list(booked["realized"]) == approx([0, 0, 25, 0, 475])
+
+
+def test_fifo_takes_sales_out_from_the_earliest_lots():
+    booked = cost_basis([0] * 5, days, txtypes, units, totals, method="fifo")
+
+    assert list(booked["cost"]) == approx([100, 200, -50, 300, -550])
+    assert list(booked["realized"]) == approx([0, 0, 50, 0, 450])
+
+
+def test_selling_everything_starts_the_cost_base_over():
+    booked = cost_basis(
+        [0] * 4,
+        days[:4],
+        ["buy", "sale", "buy", "sale"],
+        [10, 10, 4, 2],
+        [100, 150, 80, 50],
+    )
+
+    assert np.cumsum(booked["cost"]) == approx([100, 0, 80, 40])
+    assert list(booked["realized"]) == approx([0, 50, 0, 10])
+
+
+def test_keys_are_booked_apart_and_in_order_of_day():
+    keys = [1, 0, 1, 0, 1, 0]
+    shuffled_days = days[[3, 2, 0, 1, 1, 0]]
+    booked = cost_basis(
+        keys,
+        shuffled_days,
+        ["sale", "sale", "buy", "buy", "buy", "buy"],
+        [5, 1, 10, 1, 10, 1],
+        [100, 30, 100, 20, 200, 10],
+    )
+
+    assert list(booked["cost"]) == approx([-75, -15, 100, 20, 200, 10])
+    assert list(booked["realized"]) == approx([25, 15, 0, 0, 0, 0])
+
+
+def test_cash_flows():
+    booked = cost_basis(
+        [0] * 5,
+        days,
+        ["deposit", "buy", "dividend", "sale", "withdrawal"],
+        [None, 10, 10, 5, None],
+        [1000, 100, 5, 60, 200],
+    )
+
+    assert list(booked["cash"]) == approx([1000, -100, 5, 60, -200])
+    assert list(booked["units"]) == [0, 10, 0, -5, 0]
+
+
+def test_matches_booking_lot_by_lot():
+    rng = np.random.default_rng(0)
+    n = 2000
+    keys = rng.integers(0, 10, n)
+    tx = np.where(rng.random(n) < 0.6, "buy", "sale")
+    ledger_units = rng.integers(1, 20, n).astype(float)
+    ledger_totals = ledger_units * rng.uniform(5, 50, n)
+    held = {}
+    for i in range(n):
+        if tx[i] == "sale":
+            ledger_units[i] = min(ledger_units[i], held.get(keys[i], 0))
+        held[keys[i]] = held.get(keys[i], 0) + ledger_units[i] * (
+            1 if tx[i] == "buy" else -1
+        )
+    ledger_days = np.arange(n).astype("datetime64[D]")
+
+    for method in ["acb", "fifo"]:
+        booked = cost_basis(
+            keys, ledger_days, tx, ledger_units, ledger_totals, method=method
+        )
+        lots = {}
+        for i in range(n):
+            queue = lots.setdefault(keys[i], deque())
+            if tx[i] == "buy":
+                queue.append([ledger_units[i], ledger_totals[i] / ledger_units[i]])
+                assert booked["cost"][i] == approx(ledger_totals[i])
+                continue
+            if ledger_units[i] == 0:
+                assert booked["cost"][i] == approx(0)
+                continue
+            if method == "acb":
+                price = sum(u * p for u, p in queue) / sum(u for u, _ in queue)
+                queue = deque([[sum(u for u, _ in queue), price]])
+                lots[keys[i]] = queue
+            left, cost = ledger_units[i], 0.0
+            while left > 0:
+                taken = min(queue[0][0], left)
+                cost += taken * queue[0][1]
+                queue[0][0] -= taken
+                left -= taken
+                if queue[0][0] == 0:
+                    queue.popleft()
+            assert booked["cost"][i] == approx(-cost, abs=1e-6)
+
+
+def test_many_partial_sales_stay_finite():
+    n = 3000
+    sold = 1e6 * 0.3 * 0.7 ** np.arange(n)
+    booked = cost_basis(
+        np.zeros(n + 1, dtype=int),
+        np.arange(n + 1).astype("datetime64[D]"),
+        ["buy"] + ["sale"] * n,
+        np.concatenate([[1e6], sold]),
+        np.concatenate([[1e6], np.ones(n)]),
+    )
+    held = np.cumsum(booked["cost"])
+
+    assert np.isfinite(held).all()
+    assert held[10] == approx(1e6 * 0.7**10)
+    assert held[-1] == approx(0, abs=1e-6)
+
+
+def test_long_run_of_partial_sales_matches_average_cost():
+    rng = np.random.default_rng(1)
+    n = 6000
+    tx = np.where(rng.random(n) < 0.25, "buy", "sale")
+    tx[0] = "buy"
+    ledger_units = np.zeros(n)
+    ledger_totals = np.zeros(n)
+    expected, held, cost = np.zeros(n), 0.0, 0.0
+    for i in range(n):
+        if tx[i] == "buy":
+            ledger_units[i] = rng.uniform(1, 100)
+            ledger_totals[i] = ledger_units[i] * rng.uniform(5, 50)
+            held, cost = held + ledger_units[i], cost + ledger_totals[i]
+        else:
+            ledger_units[i] = held * rng.uniform(0.01, 0.2)
+            ledger_totals[i] = ledger_units[i] * rng.uniform(5, 50)
+            cost -= cost * ledger_units[i] / held
+            held -= ledger_units[i]
+        expected[i] = cost
+
+    booked = cost_basis(
+        np.zeros(n, dtype=int),
+        np.arange(n).astype("datetime64[D]"),
+        tx,
+        ledger_units,
+        ledger_totals,
+    )
+
+    assert np.cumsum(booked["cost"]) == approx(expected, rel=1e-6)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        cost_basis([0], days[:1], ["buy"], [1], [10], method="lifo")
+
+
+@pytest.mark.parametrize("method", ["acb", "fifo"])
+def test_open_lots_book_later_transactions_as_the_whole_ledger(method):
+    keys = [0, 1, 0, 0, 1, 0, 1, 0]
+    ledger_days = days[[0, 0, 1, 2, 2, 3, 4, 4]]
+    tx = ["buy", "buy", "buy", "sale", "sale", "buy", "buy", "sale"]
+    ledger_units = [10, 5, 10, 15, 5, 10, 2, 12]
+    ledger_totals = [100, 50, 200, 400, 70, 300, 30, 500]
+    whole = cost_basis(keys, ledger_days, tx, ledger_units, ledger_totals, method)
+
+    lots = open_lots(
+        keys[:5], ledger_days[:5], tx[:5], ledger_units[:5], ledger_totals[:5], method
+    )
+    opened = len(lots["key"])
+    resumed = cost_basis(
+        np.concatenate([lots["key"], keys[5:]]),
+        np.concatenate([np.repeat(days[2], opened), ledger_days[5:]]),
+        ["buy"] * opened + tx[5:],
+        np.concatenate([lots["units"], ledger_units[5:]]),
+        np.concatenate([lots["cost"], ledger_totals[5:]]),
+        method,
+    )
+
+    assert list(lots["key"]) == [0]
+    assert sum(lots["cost"]) == approx(sum(whole["cost"][:5]))
+    assert list(resumed["cost"][opened:]) == approx(list(whole["cost"][5:]))
+    assert list(resumed["realized"][opened:]) == approx(list(whole["realized"][5:]))
+
+
+def test_open_lots_keep_the_earliest_units_left_with_fifo():
+    lots = open_lots([0] * 5, days, txtypes, units, totals, method="fifo")
+
+    assert list(lots["units"]) == []
+    lots = open_lots([0] * 4, days[:4], txtypes[:4], units[:4], totals[:4], "fifo")
+
+    assert list(lots["units"]) == [5, 10, 10]
+    assert list(lots["cost"]) == approx([50, 200, 300])
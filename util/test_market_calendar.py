@@ -0,0 +1,98 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from util.market_calendar import (
+    Holiday,
+    MarketCalendar,
+    easter,
+    fixed,
+    market_calendar,
+    nth_weekday,
+    weekday_before,
+)
+
+
+def dates(days):
+    return [day.date() for day in days]
+
+
+def test_tsx_holidays():
+    assert dates(MarketCalendar().holidays(2024, 2024)) == [
+        date(2024, 1, 1),
+        date(2024, 2, 19),
+        date(2024, 3, 29),
+        date(2024, 5, 20),
+        date(2024, 7, 1),
+        date(2024, 8, 5),
+        date(2024, 9, 2),
+        date(2024, 10, 14),
+        date(2024, 12, 25),
+        date(2024, 12, 26),
+    ]
+
+
+def test_observed_shifts():
+    holidays = dates(MarketCalendar().holidays(2016, 2023))
+
+    assert date(2016, 12, 26) in holidays  # Christmas on a Sunday
+    assert date(2016, 12, 27) in holidays  # and Boxing Day after it
+    assert date(2017, 7, 3) in holidays  # Canada Day on a Saturday
+    assert date(2020, 12, 28) in holidays  # Boxing Day on a Saturday
+    assert date(2021, 12, 27) in holidays  # Christmas on a Saturday
+    assert date(2021, 12, 28) in holidays  # and Boxing Day on a Sunday
+    assert date(2022, 1, 3) in holidays  # New Year's Day on a Saturday
+
+
+def test_rules():
+    years = np.array([2019, 2024, 2025])
+
+    assert dates(pd.DatetimeIndex(easter()(years))) == [
+        date(2019, 4, 21),
+        date(2024, 3, 31),
+        date(2025, 4, 20),
+    ]
+    assert dates(pd.DatetimeIndex(fixed(7, 1)(years)))[0] == date(2019, 7, 1)
+    assert dates(pd.DatetimeIndex(nth_weekday(10, 0, 2)(years))) == [
+        date(2019, 10, 14),
+        date(2024, 10, 14),
+        date(2025, 10, 13),
+    ]
+    assert dates(pd.DatetimeIndex(weekday_before(5, 25, 0)(years))) == [
+        date(2019, 5, 20),
+        date(2024, 5, 20),
+        date(2025, 5, 19),
+    ]
+
+
+def test_days():
+    days = MarketCalendar().days("2017-03-02", "2017-03-08")
+
+    assert days.index.name == "day"
+    assert days.tolist() == [1, 1, 0, 0, 1, 1, 1]
+    assert MarketCalendar().is_open("2017-04-14") is False  # Good Friday
+    assert MarketCalendar().days("2017-03-08", "2017-03-02").empty
+
+
+def test_custom_rules():
+    calendar = MarketCalendar([Holiday("Remembrance Day", fixed(11, 11), True)])
+
+    assert dates(calendar.holidays(2017, 2018)) == [
+        date(2017, 11, 13),
+        date(2018, 11, 12),
+    ]
+
+
+def test_holidays_are_computed_once_per_year():
+    calendar = MarketCalendar()
+    calendar.holidays(2020, 2021)
+    cached = calendar._holidays[2021]
+    calendar.holidays(2021, 2022)
+
+    assert calendar._holidays[2021] is cached
+    assert sorted(calendar._holidays) == [2020, 2021, 2022]
+
+
+def test_shared_calendar():
+    assert market_calendar() is market_calendar()
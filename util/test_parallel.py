@@ -0,0 +1,66 @@
+import threading
+
+from conftest import simple_fixture
+from db.data import Data
+from util.parallel import map_chunks
+
+
+def count_tickers(data, names):
+    df = data.df_from_sql(
+        "SELECT COUNT(DISTINCT ticker) AS n FROM assetPrices;",
+        params={},
+        index_col=None,
+        parse_dates=None,
+    )
+    return names, df["n"].iloc[0], threading.get_ident(), data._conn, data._fetch
+
+
+class TestMapChunks:
+    def setup_method(self):
+        simple_fixture()
+
+    def test_runs_once_without_workers(self):
+        data = Data()
+        assert map_chunks(count_tickers, ["a", "b", "c"], data) == [
+            (["a", "b", "c"], 2, threading.get_ident(), data._conn, data._fetch)
+        ]
+
+    def test_runs_once_in_memory(self):
+        data = Data()
+        results = map_chunks(count_tickers, ["a", "b", "c"], data, workers=3)
+        assert [r[0] for r in results] == [["a", "b", "c"]]
+        assert results[0][3] is data._conn
+
+    def test_runs_chunks_on_own_connections(self, file_database):
+        file_database()
+        data = Data()
+
+        results = map_chunks(count_tickers, ["a", "b", "c", "d", "e"], data, workers=2)
+
+        assert [r[0] for r in results] == [["a", "b", "c"], ["d", "e"]]
+        assert [r[1] for r in results] == [2, 2]
+        assert all(r[3] is not data._conn for r in results)
+
+    def test_runs_no_more_chunks_than_items(self, file_database):
+        file_database()
+
+        results = map_chunks(count_tickers, ["a", "b"], Data(), workers=8)
+
+        assert [r[0] for r in results] == [["a"], ["b"]]
+
+    def test_chunks_keep_the_fetch_engine(self, file_database):
+        file_database()
+
+        results = map_chunks(count_tickers, ["a", "b"], Data(fetch="numpy"), workers=2)
+
+        assert [r[4] for r in results] == ["numpy", "numpy"]
+        assert [r[1] for r in results] == [2, 2]
+
+    def test_runs_no_more_chunks_than_pooled_connections(self, file_database):
+        file_database(pool_size=3)
+        items = [str(i) for i in range(8)]
+
+        results = map_chunks(count_tickers, items, Data(), workers=8)
+
+        assert len(results) == 2
+        assert sum((r[0] for r in results), []) == items
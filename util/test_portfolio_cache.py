@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime as dt
+from freezegun import freeze_time
+import pandas as pd
+from sqlalchemy import text
+
+from conftest import simple_fixture
+from db import db
+from util.portfolio_cache import PortfolioCache
+
+
+frame = pd.DataFrame(
+    {"value": [1.0, 2.0]},
+    index=pd.DatetimeIndex([dt(2017, 3, 2), dt(2017, 3, 3)], name="day"),
+)
+
+
+def test_store_and_load(tmp_path):
+    simple_fixture()
+    cache = PortfolioCache(tmp_path)
+    key = cache.key(["RRSP1"], date(2017, 3, 1))
+
+    assert cache.load(key) is None
+
+    cache.store(key, {"by_day": frame})
+    loaded = cache.load(key)
+
+    pd.testing.assert_frame_equal(loaded["by_day"], frame)
+
+
+def test_key_depends_on_accounts_and_from_day(tmp_path):
+    simple_fixture()
+    cache = PortfolioCache(tmp_path)
+
+    assert cache.key(["A", "B"], None) == cache.key(["B", "A"], None)
+    assert cache.key(["A"], None) != cache.key(["B"], None)
+    assert cache.key(["A"], None) != cache.key(["A"], date(2017, 3, 1))
+
+
+def test_key_changes_with_data(tmp_path):
+    simple_fixture()
+    cache = PortfolioCache(tmp_path)
+    key = cache.key(["RRSP1"], None)
+
+    db.conn.execute(
+        text(
+            """UPDATE assetprices SET close = 31.00
+            WHERE ticker = 'VCN.TO' AND day = '2017-03-08';"""
+        )
+    )
+
+    assert cache.key(["RRSP1"], None) != key
+
+
+def test_key_changes_with_edits_that_keep_counts_and_totals(tmp_path):
+    simple_fixture()
+    cache = PortfolioCache(tmp_path)
+    keys = [cache.key(["RRSP1"], None)]
+
+    db.conn.execute(
+        text("UPDATE transactions SET day = '2017-03-02' WHERE txtype = 'buy';")
+    )
+    keys.append(cache.key(["RRSP1"], None))
+    db.conn.execute(
+        text(
+            """UPDATE transactions
+            SET total = CASE target WHEN 'VCN.TO' THEN 2800.35 ELSE 3010.35 END
+            WHERE txtype = 'buy';"""
+        )
+    )
+    keys.append(cache.key(["RRSP1"], None))
+
+    assert len(set(keys)) == 3
+
+
+def test_key_changes_with_date(tmp_path):
+    simple_fixture()
+    cache = PortfolioCache(tmp_path)
+    with freeze_time(dt(2017, 3, 7)):
+        key = cache.key(["RRSP1"], None)
+    with freeze_time(dt(2017, 3, 8)):
+        assert cache.key(["RRSP1"], None) != key
+
+
+def test_store_replaces_older_versions(tmp_path):
+    simple_fixture()
+    cache = PortfolioCache(tmp_path)
+    old_key = cache.key(["RRSP1"], None)
+    cache.store(old_key, {"by_day": frame})
+    db.conn.execute(
+        text(
+            """INSERT INTO distributions (ticker, day, amount)
+            VALUES ('VEE.TO', '2017-03-08', 0.05);"""
+        )
+    )
+    new_key = cache.key(["RRSP1"], None)
+    cache.store(new_key, {"by_day": frame})
+
+    assert cache.load(old_key) is None
+    assert cache.load(new_key) is not None
+    assert list(new_key.parent.iterdir()) == [new_key]
+
+
+def test_concurrent_stores_of_a_version(tmp_path):
+    simple_fixture()
+    cache = PortfolioCache(tmp_path)
+    key = cache.key(["RRSP1"], None)
+    other = key.with_name(f"{key.name}.other.tmp")
+    other.mkdir(parents=True)
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda _: cache.store(key, {"by_day": frame}), range(8)))
+
+    pd.testing.assert_frame_equal(cache.load(key)["by_day"], frame)
+    assert sorted(key.parent.iterdir()) == sorted([key, other])
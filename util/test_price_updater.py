@@ -1,6 +1,12 @@
-from datetime import date
+from datetime import date, datetime as dt, timedelta
+from freezegun import freeze_time
+from sqlalchemy import text
+from unittest.mock import patch
 
+from conftest import simple_fixture
+from db import db
 from util.price_updater import PriceUpdater
+from util.yahoo_scraper import Quote, YahooScraper
 
 
 def test_price_updater_initializes():
@@ -17,3 +23,98 @@ def test_is_same_price():
     assert updater._is_same_price(1_000_000.50, 1_000_000.4951)
     assert not updater._is_same_price(0.00, 0.01)
     assert not updater._is_same_price(1_000_000.50, 1_000_000.49)
+
+
+def quote(symbol, day, price):
+    q = Quote(symbol, (0, price))
+    q.day = day
+    return q
+
+
+def closes():
+    cur = db.conn.execute(
+        text("SELECT ticker, day, close FROM assetprices ORDER BY ticker, day;")
+    )
+    return {(row.ticker, str(row.day)): row.close for row in cur.fetchall()}
+
+
+def test_record_quotes_inserts_and_updates():
+    simple_fixture()
+    updater = PriceUpdater()
+    updater.new_quotes = updater.updated_quotes = 0
+    updater._record_quotes(
+        [
+            quote("VCN.TO", date(2017, 3, 7), 29.85),  # unchanged
+            quote("VCN.TO", date(2017, 3, 8), 30.50),  # updated
+            quote("VEE.TO", date(2017, 3, 8), 31.004),  # within tolerance
+            quote("VEE.TO", date(2017, 3, 9), 31.25),  # new
+            quote("VEE.TO", date(2017, 3, 10), None),  # skipped
+        ]
+    )
+
+    assert updater.new_quotes == 1
+    assert updater.updated_quotes == 1
+    prices = closes()
+    assert prices[("VCN.TO", "2017-03-07")] == 29.85
+    assert prices[("VCN.TO", "2017-03-08")] == 30.50
+    assert prices[("VEE.TO", "2017-03-08")] == 31.00
+    assert prices[("VEE.TO", "2017-03-09")] == 31.25
+    assert ("VEE.TO", "2017-03-10") not in prices
+
+
+def test_record_quotes_writes_in_one_transaction():
+    simple_fixture()
+    updater = PriceUpdater()
+    updater.new_quotes = updater.updated_quotes = 0
+    with patch.object(db, "transaction", wraps=db.transaction) as transaction:
+        updater._record_quotes(
+            [quote("VCN.TO", date(2017, 3, day), 30.00) for day in range(9, 20)]
+        )
+
+    assert transaction.call_count == 1
+    assert updater.new_quotes == 11
+
+
+def test_record_quotes_without_quotes():
+    simple_fixture()
+    updater = PriceUpdater()
+    updater.new_quotes = updater.updated_quotes = 0
+    updater._record_quotes([quote("VCN.TO", date(2017, 3, 9), None)])
+
+    assert updater.new_quotes == 0
+    assert updater.updated_quotes == 0
+
+
+def test_update_from_local_server(chart_server):
+    simple_fixture()
+    updater = PriceUpdater()
+    updater.scraper = YahooScraper(base_url=chart_server.url)
+    updater.update()
+
+    prices = closes()
+    assert updater.new_quotes == 2  # The `Cash` asset is polled as well
+    assert updater.updated_quotes == 4
+    assert prices[("VCN.TO", "2017-03-08")] == 30.25
+
+
+def test_start_days():
+    simple_fixture()
+    updater = PriceUpdater(overlap_days=3, backfill_days=100)
+    with freeze_time(dt(2017, 3, 9)):
+        start_days = updater._start_days(["VCN.TO", "VEE.TO", "Cash"])
+
+    assert start_days == {
+        "VCN.TO": date(2017, 3, 5),
+        "VEE.TO": date(2017, 3, 5),
+        "Cash": date(2016, 11, 29),
+    }
+
+
+def test_update_requests_missing_days_only(chart_server):
+    simple_fixture()
+    updater = PriceUpdater()
+    updater.scraper = YahooScraper(base_url=chart_server.url)
+    updater.update()
+
+    assert chart_server.start_days["VCN.TO"] == date(2017, 3, 3)
+    assert chart_server.start_days["Cash"] == date.today() - timedelta(days=3650)
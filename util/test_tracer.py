@@ -0,0 +1,62 @@
+import json
+
+from util import tracer
+from util.tracer import Tracer
+
+
+def test_stages_do_nothing_without_tracer():
+    with tracer.stage("outer"):
+        tracer.count(rows=10)
+
+    assert tracer.is_tracing() is False
+
+
+def test_nested_stages():
+    with tracer.tracing() as t:
+        with tracer.stage("outer"):
+            tracer.count(rows=1, bytes=8)
+            for _ in range(2):
+                with tracer.stage("inner"):
+                    tracer.count(rows=10, bytes=80)
+
+    assert t.to_dict() == [
+        {
+            "stage": "outer",
+            "calls": 1,
+            "seconds": t.spans[0]["seconds"],
+            "rows": 1,
+            "bytes": 8,
+        },
+        {
+            "stage": "outer/inner",
+            "calls": 2,
+            "seconds": t.spans[1]["seconds"] + t.spans[2]["seconds"],
+            "rows": 20,
+            "bytes": 160,
+        },
+    ]
+    assert json.loads(t.to_json()) == t.to_dict()
+    assert tracer.is_tracing() is False
+
+
+def test_folded_stacks_hold_self_time():
+    t = Tracer()
+    t.spans = [
+        {"path": ("outer",), "seconds": 0.5, "rows": 0, "bytes": 0},
+        {"path": ("outer", "inner"), "seconds": 0.2, "rows": 0, "bytes": 0},
+        {"path": ("outer", "inner"), "seconds": 0.1, "rows": 0, "bytes": 0},
+    ]
+
+    assert t.folded() == "outer 200000\nouter;inner 300000"
+
+
+def test_using_a_given_tracer():
+    t = Tracer()
+    with tracer.using(t):
+        with tracer.stage("first"):
+            pass
+    with tracer.using(t):
+        with tracer.stage("second"):
+            pass
+
+    assert [span["path"] for span in t.spans] == [("first",), ("second",)]
@@ -1,4 +1,5 @@
-from datetime import date
+import asyncio
+from datetime import date, timedelta
 
 from util.yahoo_scraper import Quote
 from util.yahoo_scraper import YahooScraper
@@ -16,3 +17,79 @@ def test_quote_class():
     assert q.symbol == "SYM"
     assert q.day == date(2021, 7, 29)
     assert q.price == 77.15
+
+
+def test_parse_quotes_without_response():
+    assert YahooScraper()._parse_quotes(None) == []
+
+
+def test_get_quotes(chart_server):
+    y = YahooScraper(base_url=chart_server.url)
+    quotes = y.get_quotes(["VCN.TO", "VEE.TO"])
+
+    assert len(quotes) == 4
+    assert y.failures == {}
+    assert {(q.symbol, q.day, q.price) for q in quotes} == {
+        ("VCN.TO", date(2017, 3, 7), 30.10),
+        ("VCN.TO", date(2017, 3, 8), 30.25),
+        ("VEE.TO", date(2017, 3, 7), 30.10),
+        ("VEE.TO", date(2017, 3, 8), 30.25),
+    }
+
+
+def test_get_quotes_within_a_running_event_loop(chart_server):
+    async def get_quotes():
+        return YahooScraper(base_url=chart_server.url).get_quotes(["VCN.TO"])
+
+    quotes = asyncio.run(get_quotes())
+
+    assert [(q.symbol, q.day) for q in quotes] == [
+        ("VCN.TO", date(2017, 3, 7)),
+        ("VCN.TO", date(2017, 3, 8)),
+    ]
+
+
+def test_get_quotes_retries_errors(chart_server):
+    y = YahooScraper(base_url=chart_server.url, backoff=0.001)
+    quotes = y.get_quotes(["FLAKY.TO"])
+
+    assert len(quotes) == 2
+    assert y.failures == {}
+    assert chart_server.requests["FLAKY.TO"] == 2
+
+
+def test_get_quotes_isolates_failures(chart_server):
+    y = YahooScraper(base_url=chart_server.url, retries=2, backoff=0.001)
+    quotes = y.get_quotes(["DOWN.TO", "VCN.TO", "MISSING.TO"])
+
+    assert [q.symbol for q in quotes] == ["VCN.TO", "VCN.TO"]
+    assert set(y.failures) == {"DOWN.TO", "MISSING.TO"}
+    assert y.failures["DOWN.TO"] == "HTTP 503"
+    assert chart_server.requests["DOWN.TO"] == 3
+    assert chart_server.requests["MISSING.TO"] == 1
+
+
+def test_get_quotes_caps_concurrency(chart_server):
+    chart_server.delay = 0.02
+    y = YahooScraper(base_url=chart_server.url, concurrency=4)
+    quotes = y.get_quotes([f"S{i}.TO" for i in range(40)])
+
+    assert len(quotes) == 80
+    assert 1 < chart_server.max_in_flight <= 4
+
+
+def test_get_quotes_for_a_thousand_symbols(chart_server):
+    y = YahooScraper(base_url=chart_server.url, concurrency=32)
+    quotes = y.get_quotes([f"S{i}.TO" for i in range(1000)])
+
+    assert len(quotes) == 2000
+    assert y.failures == {}
+    assert len(chart_server.requests) == 1000
+
+
+def test_get_quotes_from_start_days(chart_server):
+    y = YahooScraper(base_url=chart_server.url)
+    y.get_quotes(["VCN.TO", "VEE.TO"], start_days={"VCN.TO": date(2017, 3, 1)})
+
+    assert chart_server.start_days["VCN.TO"] == date(2017, 3, 1)
+    assert chart_server.start_days["VEE.TO"] == date.today() - timedelta(days=30)
@@ -0,0 +1,130 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import json
+from time import perf_counter
+
+
+# Tracer recording the stages run in the current context, if tracing
+_active = ContextVar("tracer", default=None)
+_disabled = nullcontext()
+
+
+class Tracer:
+    """Record of the wall time, rows and bytes of nested stages.
+
+    Stages are opened with the module's `stage(name)`, from anywhere down the call stack,
+    while the tracer is active in the context (see `tracing()` and `using()`). Repeated
+    stages with the same path are recorded separately, and summed in the outputs.
+
+    Public methods:
+    stage(name) -- Context manager recording a stage nested in the current one
+    count(rows, bytes) -- Add rows and bytes to the current stage
+    to_dict() -- Return the stages, summed by path, as a list of dicts
+    to_json() -- Return the stages, summed by path, as a JSON string
+    folded() -- Return the stages in the folded stacks format of flamegraph tools
+
+    Instance variables:
+    spans -- List of the stages recorded, as dicts with their `path`, `seconds`, `rows`
+             and `bytes`, in the order they started
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        """Record a stage nested in the current one, for the duration of the block."""
+        parent = self._stack[-1]["path"] if self._stack else ()
+        span = {"path": parent + (name,), "seconds": 0.0, "rows": 0, "bytes": 0}
+        self.spans.append(span)
+        self._stack.append(span)
+        start = perf_counter()
+        try:
+            yield span
+        finally:
+            span["seconds"] = perf_counter() - start
+            self._stack.pop()
+
+    def count(self, rows=0, bytes=0):
+        """Add rows and bytes to the current stage."""
+        if self._stack:
+            self._stack[-1]["rows"] += rows
+            self._stack[-1]["bytes"] += bytes
+
+    def to_dict(self):
+        """Return the stages, summed by path, as a list of dicts in the order they started."""
+        totals = {}
+        for span in self.spans:
+            total = totals.setdefault(
+                span["path"],
+                {
+                    "stage": "/".join(span["path"]),
+                    "calls": 0,
+                    "seconds": 0.0,
+                    "rows": 0,
+                    "bytes": 0,
+                },
+            )
+            total["calls"] += 1
+            for key in ["seconds", "rows", "bytes"]:
+                total[key] += span[key]
+        return list(totals.values())
+
+    def to_json(self):
+        """Return the stages, summed by path, as a JSON string."""
+        return json.dumps(self.to_dict(), indent=2)
+
+    def folded(self):
+        """Return the stages in the folded stacks format of flamegraph tools.
+
+        One line per path, with the stage names separated by semicolons and followed by
+        the time spent in the stage itself (not in nested stages), in microseconds.
+        """
+        self_seconds = {}
+        for span in self.spans:
+            path = span["path"]
+            self_seconds[path] = self_seconds.get(path, 0.0) + span["seconds"]
+            if len(path) > 1:
+                parent = path[:-1]
+                self_seconds[parent] = self_seconds.get(parent, 0.0) - span["seconds"]
+        return "\n".join(
+            f"{';'.join(path)} {max(round(seconds * 1e6), 0)}"
+            for path, seconds in self_seconds.items()
+        )
+
+
+@contextmanager
+def tracing():
+    """Trace the stages run in the block, yielding a new Tracer."""
+    tracer = Tracer()
+    with using(tracer):
+        yield tracer
+
+
+@contextmanager
+def using(tracer):
+    """Record the stages run in the block in a given Tracer. Nothing is traced, if None."""
+    token = _active.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _active.reset(token)
+
+
+def stage(name):
+    """Context manager recording a stage, if tracing. Does nothing otherwise."""
+    tracer = _active.get()
+    return _disabled if tracer is None else tracer.stage(name)
+
+
+def count(rows=0, bytes=0):
+    """Add rows and bytes to the current stage, if tracing."""
+    tracer = _active.get()
+    if tracer is not None:
+        tracer.count(rows, bytes)
+
+
+def is_tracing():
+    """Report whether stages are being traced in the current context."""
+    return _active.get() is not None
@@ -1,51 +1,128 @@
 import calendar
-import grequests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
+import random
+import time
 
 from datetime import date, timedelta
 
+import requests
+from requests.adapters import HTTPAdapter
+
 
 class YahooScraper:
+    """Fetch daily closing prices from the Yahoo chart API.
+
+    Symbols are fetched on a pool of `concurrency` threads, so there are at most that
+    many requests in flight, over a pool of reused connections. Failed requests are
+    retried with jittered exponential backoff, and a symbol that still fails is
+    recorded in `failures` without affecting the others. Responses are parsed as they
+    arrive. No event loop is involved, so quotes can be fetched from within a running
+    one (such as Jupyter's).
+
+    Public methods:
+    get_quotes(symbols) -- Return a list of Quote objects for the symbols requested
+
+    Instance variables:
+    look_back_days -- Number of days of prices to request, unless a start day is given
+    concurrency -- Number of threads fetching, and so maximum number of requests in flight
+    retries -- Number of times a failed request is retried
+    backoff -- Base delay before retrying, in seconds. Doubled on every retry
+    base_url -- URL of the chart API, to which the symbol is appended
+    failures -- Dict with the symbols that could not be fetched in the last call, and why
+    """
+
+    base_url = "https://query2.finance.yahoo.com/v8/finance/chart"
     user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
     "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15"
     timeout = 5  # seconds
 
-    def __init__(self, look_back_days=30):
+    def __init__(
+        self, look_back_days=30, concurrency=8, retries=3, backoff=0.5, base_url=None
+    ):
         self.look_back_days = look_back_days
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        if base_url is not None:
+            self.base_url = base_url
+        self.failures = {}
 
-    def get_quotes(self, symbols):
+    def get_quotes(self, symbols, start_days=None):
         """
         Fetch price quotes from Yahoo for the symbols requested.
 
+        `start_days` is an optional dict with the first day to request for each symbol.
+        Symbols not in it are requested from `look_back_days` ago.
+
         Returns a list of Quote objects with symbol, day, and price attributes.
         """
-        responses = self._fetch_quotes(symbols)
+        start_days = start_days or {}
+        self.failures = {}
         quotes = []
-        for res in responses:
-            quotes.extend(self._parse_quotes(res))
+        with self._session() as session, ThreadPoolExecutor(
+            self.concurrency
+        ) as executor:
+            fetches = {
+                executor.submit(
+                    self._fetch_quotes, session, symbol, start_days.get(symbol)
+                ): symbol
+                for symbol in symbols
+            }
+            for fetch in as_completed(fetches):
+                try:
+                    quotes.extend(self._parse_quotes(fetch.result()))
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    self.failures[fetches[fetch]] = f"unexpected response ({e!r})"
         return quotes
 
-    def _fetch_quotes(self, symbols):
-        return grequests.map(
-            grequests.get(
-                f"https://query2.finance.yahoo.com/v8/finance/chart/{symbol}"
-                f"?period1={self._ts_from()}&period2={self._ts_to()}"
-                "&interval=1d&events=historical&crumb=RIFO8TvSQSf",
-                headers={"User-Agent": self.user_agent},
-                timeout=self.timeout,
-            )
-            for symbol in symbols
+    def _fetch_quotes(self, session, symbol, start_day):
+        """Fetch the chart of a symbol, retrying on errors. Returns the response, or None."""
+        url = (
+            f"{self.base_url}/{symbol}"
+            f"?period1={self._ts_from(start_day)}&period2={self._ts_to()}"
+            "&interval=1d&events=historical&crumb=RIFO8TvSQSf"
         )
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self._delay(attempt))
+            try:
+                res = session.get(
+                    url, headers={"User-Agent": self.user_agent}, timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                error = str(e)
+                continue
+            if res.status_code < 500 and res.status_code != 429:
+                return res
+            error = f"HTTP {res.status_code}"
+        self.failures[symbol] = error
+        return None
 
-    def _ts_from(self):
-        return calendar.timegm(
-            (date.today() - timedelta(days=self.look_back_days)).timetuple()
+    def _session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.concurrency, pool_maxsize=self.concurrency
         )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _delay(self, attempt):
+        """Seconds to wait before a retry: exponential backoff, with jitter."""
+        return self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    def _ts_from(self, start_day=None):
+        if start_day is None:
+            start_day = date.today() - timedelta(days=self.look_back_days)
+        return calendar.timegm(start_day.timetuple())
 
     def _ts_to(self):
         return calendar.timegm((date.today() + timedelta(days=1)).timetuple())
 
     def _parse_quotes(self, res):
+        if res is None:
+            return []
         payload = json.loads(res.text)
         symbol = payload["chart"]["result"][0]["meta"]["symbol"]
         timestamps = payload["chart"]["result"][0]["timestamp"]